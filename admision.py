@@ -0,0 +1,193 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.responses import JSONResponse
+
+# Control de admisión por clase de ruta. Cada clase tiene un cupo de requests en curso y
+# una cola acotada que espera en el event loop (sin ocupar un hilo del threadpool). Un
+# request se rechaza con 503 + Retry-After si la cola está llena, si la espera estimada
+# supera el plazo de la clase o si el plazo vence esperando: mejor fallar rápido que
+# responder cuando el cliente ya se fue.
+
+@dataclass
+class ClaseConfig:
+    """Cupo de una clase. `limite` = 0 la deja sin control (no encola ni rechaza)."""
+    limite: int
+    cola: int = 64           # requests esperando como máximo
+    espera_max: float = 2.0  # segundos de espera tolerados antes de rechazar
+
+    @classmethod
+    def from_env(cls, nombre: str, defecto: "ClaseConfig") -> "ClaseConfig":
+        env, pref = os.environ, f"PENITENCIARIO_ADMISION_{nombre.upper()}_"
+        return cls(
+            limite=int(env.get(pref + "LIMITE", defecto.limite)),
+            cola=int(env.get(pref + "COLA", defecto.cola)),
+            espera_max=float(env.get(pref + "ESPERA", defecto.espera_max)),
+        )
+
+
+class Rechazo(Exception):
+    def __init__(self, motivo: str, retry_after: float):
+        super().__init__(motivo)
+        self.motivo = motivo
+        self.retry_after = retry_after
+
+
+class ClaseConcurrencia:
+    """
+    Semáforo FIFO con cola acotada. Vive en el event loop: no usa locks. Al salir, el cupo
+    pasa directo al primero de la cola, así un request nuevo no se adelanta a los que esperan.
+    """
+
+    ALFA = 0.2   # peso de la última duración en el promedio móvil
+
+    def __init__(self, nombre: str, config: ClaseConfig):
+        self.nombre = nombre
+        self.config = config
+        self.en_curso = 0
+        self._cola: Deque[asyncio.Future] = deque()
+        self.duracion_media = 0.0     # EWMA de segundos por request, para estimar la espera
+        self.admitidos = 0
+        self.rechazados: Dict[str, int] = {"cola_llena": 0, "espera": 0, "plazo": 0}
+        self.espera_total = 0.0
+        self.espera_max_vista = 0.0
+
+    @property
+    def en_cola(self) -> int:
+        return len(self._cola)
+
+    def espera_estimada(self) -> float:
+        """Segundos hasta obtener cupo si se encolara ahora."""
+        return (len(self._cola) + 1) * self.duracion_media / max(self.config.limite, 1)
+
+    async def entrar(self) -> float:
+        """Espera cupo y devuelve los segundos esperados; lanza Rechazo si no lo obtiene."""
+        cfg = self.config
+        if self.en_curso < cfg.limite and not self._cola:
+            self.en_curso += 1
+            self.admitidos += 1
+            return 0.0
+        if len(self._cola) >= cfg.cola:
+            self._rechazar("cola_llena")
+        if self.espera_estimada() > cfg.espera_max:
+            self._rechazar("espera")
+        t0 = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        self._cola.append(fut)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), cfg.espera_max)
+        except BaseException as e:
+            # Vencido el plazo o cancelado (el cliente cortó): si el cupo llegó justo, se devuelve
+            if fut.done() and not fut.cancelled():
+                self.salir()
+            else:
+                fut.cancel()
+                self._cola.remove(fut)
+            if isinstance(e, asyncio.TimeoutError):
+                self._rechazar("plazo")
+            raise
+        espera = time.perf_counter() - t0
+        self.admitidos += 1
+        self.espera_total += espera
+        self.espera_max_vista = max(self.espera_max_vista, espera)
+        return espera
+
+    def salir(self, duracion: Optional[float] = None) -> None:
+        if duracion is not None:
+            self.duracion_media += self.ALFA * (duracion - self.duracion_media)
+        while self._cola:
+            fut = self._cola.popleft()
+            if not fut.done():
+                fut.set_result(None)      # el cupo pasa al siguiente sin liberarse
+                return
+        self.en_curso -= 1
+
+    def _rechazar(self, motivo: str) -> None:
+        self.rechazados[motivo] += 1
+        raise Rechazo(motivo, max(1.0, self.espera_estimada()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limite": self.config.limite,
+            "cola_max": self.config.cola,
+            "espera_max_s": self.config.espera_max,
+            "en_curso": self.en_curso,
+            "en_cola": self.en_cola,
+            "admitidos": self.admitidos,
+            "rechazados": dict(self.rechazados),
+            "espera_total_s": round(self.espera_total, 6),
+            "espera_max_vista_s": round(self.espera_max_vista, 6),
+            "duracion_media_ms": round(self.duracion_media * 1000, 3),
+        }
+
+
+Regla = Tuple[Optional[str], "re.Pattern[str]", str]
+
+class Admision:
+    """
+    Clases de concurrencia y reglas (método, regex sobre el path) que les asignan requests.
+    Gana la primera regla que coincide; el resto va a `defecto`. Las clases con limite 0
+    (p. ej. /health y /metrics) pasan sin control.
+    """
+
+    def __init__(self, clases: Dict[str, ClaseConfig], reglas: Sequence[Tuple[Optional[str], str, str]], defecto: str):
+        self.clases = {n: ClaseConcurrencia(n, c) for n, c in clases.items()}
+        self.reglas: List[Regla] = [(m, re.compile(p), c) for m, p, c in reglas]
+        self.defecto = defecto
+        faltantes = {c for _, _, c in self.reglas} - set(self.clases) | ({defecto} - set(self.clases))
+        if faltantes:
+            raise ValueError(f"Reglas de admisión con clases inexistentes: {sorted(faltantes)}")
+
+    def clasificar(self, metodo: str, path: str) -> str:
+        for m, patron, clase in self.reglas:
+            if (m is None or m == metodo) and patron.match(path):
+                return clase
+        return self.defecto
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {n: c.stats() for n, c in self.clases.items()}
+
+    def metricas(self) -> Iterable[str]:
+        for n, c in self.clases.items():
+            yield f'admision_limite{{clase="{n}"}} {c.config.limite}'
+            yield f'admision_en_curso{{clase="{n}"}} {c.en_curso}'
+            yield f'admision_en_cola{{clase="{n}"}} {c.en_cola}'
+            yield f'admision_admitidos_total{{clase="{n}"}} {c.admitidos}'
+            for motivo, k in c.rechazados.items():
+                yield f'admision_rechazados_total{{clase="{n}",motivo="{motivo}"}} {k}'
+            yield f'admision_espera_seconds_total{{clase="{n}"}} {c.espera_total!r}'
+            yield f'admision_duracion_media_seconds{{clase="{n}"}} {c.duracion_media!r}'
+
+
+# --- Middleware ASGI (puro, como MetricsMiddleware: el cupo se retiene hasta terminar el body) ---
+class AdmisionMiddleware:
+    def __init__(self, app, admision: Admision):
+        self.app = app
+        self.admision = admision
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        clase = self.admision.clases[self.admision.clasificar(scope["method"], scope["path"])]
+        if clase.config.limite <= 0:
+            return await self.app(scope, receive, send)
+        try:
+            await clase.entrar()
+        except Rechazo as r:
+            respuesta = JSONResponse(
+                status_code=503,
+                content={"detail": f"Servidor saturado (clase {clase.nombre}: {r.motivo}), reintentar"},
+                headers={"Retry-After": str(math.ceil(r.retry_after))},
+            )
+            return await respuesta(scope, receive, send)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            clase.salir(time.perf_counter() - t0)
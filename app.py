@@ -1,17 +1,30 @@
 # app.py (limpio)
 
-from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi import FastAPI, Depends, HTTPException, Body, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse
 import sqlite3
 from datetime import date
-from typing import Any, Dict, Optional, List, Literal, Annotated
-from pydantic import BaseModel, Field, StringConstraints
-from db import get_db, DB_PATH, init_db, list_tables
+from typing import Any, AsyncIterator, Dict, Optional, List, Literal, Annotated, Tuple, get_args
+from pydantic import BaseModel, Field, StringConstraints, ValidationError
+from db import get_db, get_db_read, escribir, get_pool, close_pool, PoolTimeout, PoolConfig, DB_PATH, init_db, list_tables, reconciliar_contadores, fts_disponible, CountMode
+from db import tomar_snapshot, inicio_periodo, Granularidad
+from db import respaldar, restaurar, listar_respaldos, backup_dir, BACKUP_PAGINAS, BACKUP_PAUSA
+from db import internos_desde, archivar_lote, corte_archivo, ARCHIVO_ANTIGUEDAD_DIAS, ARCHIVO_LOTE
+from db import INDICES_SQL, ejecutar_script, sentencias, version_esquema, podar_eventos, marca_cambios, marcar_cambio
+from db import begin_immediate, es_bloqueo, init_db_una_vez, pausa_reintento, reintentos, REINTENTOS_BUSY
 from fastapi import FastAPI, Depends, HTTPException, Body
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from datetime import timedelta
-import io, csv
-
+import io, csv, json, base64, heapq, re, hashlib, uuid, os, asyncio, threading, time
+import anyio.to_thread
+from contextlib import ExitStack, asynccontextmanager
+from pathlib import Path
+from cache import resultados
+from metrics import MetricsMiddleware, registry as metricas
+from admision import Admision, AdmisionMiddleware, ClaseConfig
+from serializacion import dumps, respuesta_json
 
 # =========================
 # Schemas Celdas
@@ -109,13 +122,164 @@ class StatsResponse(BaseModel):
 # =========================
 # FastAPI app
 # =========================
-app = FastAPI(title="Servicio Penitenciario API", version="0.1.0")
+INIT_AL_INICIAR = os.environ.get("PENITENCIARIO_INIT_AL_INICIAR", "1") not in ("0", "false", "no")
+SNAPSHOT_INTERVALO = float(os.environ.get("PENITENCIARIO_SNAPSHOT_INTERVALO", 3600))  # segundos; 0 = desactivado
+
+def _snapshot() -> Dict[str, Any]:
+    resultado = escribir(tomar_snapshot)
+    return resultado
+
+async def _snapshots_periodicos() -> None:
+    """Refresca la foto del día cada SNAPSHOT_INTERVALO: la última del día queda como cierre."""
+    while True:
+        try:
+            await run_in_threadpool(_snapshot)
+        except (sqlite3.Error, PoolTimeout):
+            pass        # base sin inicializar (falta /db/init) u ocupada: se reintenta en el próximo ciclo
+        await asyncio.sleep(SNAPSHOT_INTERVALO)
+
+# --- Control de admisión por clase de ruta (ver admision.py) ---
+# Los handlers sync corren en el threadpool de anyio (HILOS hilos). Reportes y /stats
+# ("analitica") y las operaciones masivas ("masiva") tienen cupos propios; "interactiva"
+# se queda con el resto, así un export largo no deja al CRUD sin hilos. El cupo analítico
+# por defecto es la mitad de los lectores del pool: el resto queda para los GET interactivos.
+# Cada clase se ajusta con PENITENCIARIO_ADMISION_<CLASE>_{LIMITE,COLA,ESPERA}.
+HILOS = int(os.environ.get("PENITENCIARIO_HILOS", 40))
+
+def _admision() -> Admision:
+    analitica = ClaseConfig.from_env("analitica", ClaseConfig(
+        limite=max(1, PoolConfig.from_env().readers // 2), cola=32, espera_max=5.0))
+    masiva = ClaseConfig.from_env("masiva", ClaseConfig(limite=2, cola=8, espera_max=10.0))
+    interactiva = ClaseConfig.from_env("interactiva", ClaseConfig(
+        limite=max(1, HILOS - analitica.limite - masiva.limite), cola=256, espera_max=1.0))
+    return Admision(
+        clases={"sistema": ClaseConfig(limite=0), "analitica": analitica, "masiva": masiva, "interactiva": interactiva},
+        reglas=[
+            ("GET", r"^/(health|metrics|db/pool|db/cache|db/admision|eventos|docs|redoc|openapi\.json)?$", "sistema"),
+            ("GET", r"^/(reportes/|stats(/historico)?$|db/tables$)", "analitica"),
+            ("POST", r"^/[^/]+/bulk$", "masiva"),
+            ("POST", r"^/internos/asignar$", "masiva"),
+            ("POST", r"^/db/(init|indexes|backup|restore|archivar)$", "masiva"),
+            ("POST", r"^/stats/(reconciliar|snapshot)$", "masiva"),
+        ],
+        defecto="interactiva",
+    )
+
+admision = _admision()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El tamaño del threadpool tiene que cubrir la suma de los cupos para que la partición sirva
+    anyio.to_thread.current_default_thread_limiter().total_tokens = HILOS
+    if INIT_AL_INICIAR:
+        await run_in_threadpool(init_db_una_vez)   # un solo worker inicializa; el resto espera el lock
+    get_pool()          # abre y precalienta las conexiones antes del primer request
+    tarea = asyncio.create_task(_snapshots_periodicos()) if SNAPSHOT_INTERVALO > 0 else None
+    try:
+        await difusor.ciclo()      # posición inicial del feed antes de aceptar suscriptores
+    except (sqlite3.Error, PoolTimeout):
+        pass
+    feed = asyncio.create_task(difusor.correr())
+    try:
+        yield
+    finally:
+        if tarea:
+            tarea.cancel()
+        feed.cancel()
+        close_pool()
+
+app = FastAPI(title="Servicio Penitenciario API", version="0.1.0", lifespan=lifespan)
+
+class ReintentoBusyMiddleware:
+    """
+    Traduce SQLITE_BUSY/LOCKED que escapan de un handler. GET y HEAD son idempotentes:
+    se reintentan con backoff mientras no se haya enviado nada al cliente. Si se agotan
+    los reintentos (o el método no es idempotente) se responde 503 con Retry-After
+    en lugar de un 500.
+    """
+
+    IDEMPOTENTES = ("GET", "HEAD")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        intentos = REINTENTOS_BUSY if scope["method"] in self.IDEMPOTENTES else 0
+        iniciada = False
+
+        async def send_wrapper(message):
+            nonlocal iniciada
+            iniciada = True
+            await send(message)
+
+        for k in range(intentos + 1):
+            try:
+                return await self.app(scope, receive, send_wrapper)
+            except sqlite3.OperationalError as e:
+                if not es_bloqueo(e) or iniciada:
+                    raise
+                if k == intentos:
+                    reintentos.registrar("http", agotado=True)
+                    respuesta = JSONResponse(status_code=503, content={"detail": "Base de datos ocupada, reintentar"},
+                                             headers={"Retry-After": "1"})
+                    return await respuesta(scope, receive, send)
+                reintentos.registrar("lectura")
+                await asyncio.sleep(pausa_reintento(k))
+
+app.add_middleware(ReintentoBusyMiddleware)
+app.add_middleware(AdmisionMiddleware, admision=admision)   # los rechazos igual quedan en las métricas
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
 
 # --- Sistema / redirect
 @app.get("/health", tags=["Sistema"])
 def health():
     return {"status": "ok", "service": "servicio-penitenciario", "version": "0.1.0"}
 
+def _metricas_pool_y_cache():
+    """Estado del pool, del escritor y de la caché, leído al momento del scrape."""
+    pool = get_pool().stats()
+    for kind in ("read", "write"):
+        st = pool[kind]
+        yield f'db_pool_checkouts_total{{kind="{kind}"}} {st["checkouts"]}'
+        yield f'db_pool_timeouts_total{{kind="{kind}"}} {st["timeouts"]}'
+        yield f'db_pool_wait_seconds_total{{kind="{kind}"}} {st["wait_total_ms"] / 1000.0!r}'
+        yield f'db_pool_wait_seconds_max{{kind="{kind}"}} {st["wait_max_ms"] / 1000.0!r}'
+    yield f'db_pool_readers_idle {pool["readers_idle"]}'
+    w = pool["writer"]
+    yield f'db_writer_jobs_total {w["jobs"]}'
+    yield f'db_writer_batches_total {w["batches"]}'
+    yield f'db_writer_queue_depth {w["queue_depth"]}'
+    for tipo in ("reintentos", "agotados"):
+        for clase, n in sorted(pool["busy"][tipo].items()):
+            yield f'db_busy_{tipo}_total{{clase="{clase}"}} {n}'
+    cp = pool["checkpoint"]
+    if cp:
+        for modo, n in cp["checkpoints"].items():
+            yield f'db_wal_checkpoints_total{{modo="{modo.lower()}"}} {n}'
+        yield f'db_wal_checkpoints_incompletos_total {cp["ocupados"]}'
+        yield f'db_wal_checkpoint_errores_total {cp["errores"]}'
+        yield f'db_wal_checkpoint_paginas_total {cp["paginas"]}'
+        yield f'db_wal_checkpoint_ultimo_seconds {cp["ultimo_ms"] / 1000.0!r}'
+        yield f'db_wal_bytes {cp["wal_bytes"]}'
+    c = resultados.stats()
+    yield f'cache_hits_total {c["hits"]}'
+    yield f'cache_misses_total {c["misses"]}'
+    yield f'cache_entries {c["entries"]}'
+
+metricas.add_collector(_metricas_pool_y_cache)
+metricas.add_collector(admision.metricas)
+
+@app.get("/metrics", tags=["Sistema"], response_class=PlainTextResponse)
+def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(metricas.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/", include_in_schema=False)
 def root():
     return RedirectResponse("/docs")
@@ -131,15 +295,23 @@ def db_health(db: sqlite3.Connection = Depends(get_db)):
     return {"status": "ok", "sqlite_version": version, "db_path": str(DB_PATH), "last_write_test": ts}
 
 # --- DB init & tables
+# row_count exacto por defecto, como siempre; 'estimated' es la opción barata para tableros
+COUNT_MODE_DESCRIPCION = "exact: COUNT(*) por tabla; estimated: contadores/ANALYZE (puede ser null); none"
+
 @app.post("/db/init", tags=["Base de datos"])
-def db_init_endpoint(db: sqlite3.Connection = Depends(get_db)) -> Dict[str, Any]:
+def db_init_endpoint(
+    count_mode: CountMode = Query("exact", description=COUNT_MODE_DESCRIPCION),
+    db: sqlite3.Connection = Depends(get_db),
+) -> Dict[str, Any]:
     try:
-        init_db(db)
+        migraciones = init_db(db)
         from db import list_tables
-        tables = list_tables(db, include_system=False)
+        tables = list_tables(db, include_system=False, count_mode=count_mode)
         return {
             "status": "ok",
             "message": "Esquema inicializado/verificado.",
+            "version": version_esquema(db),
+            "migraciones": migraciones,
             "tables": tables,
             "tables_count": len(tables),
             "db_path": str(DB_PATH),
@@ -148,17 +320,23 @@ def db_init_endpoint(db: sqlite3.Connection = Depends(get_db)) -> Dict[str, Any]
         raise HTTPException(status_code=500, detail=f"Error al inicializar BD: {e!r}")
 
 @app.get("/db/tables", tags=["Base de datos"])
-def db_tables(db: sqlite3.Connection = Depends(get_db)) -> Dict[str, Any]:
+def db_tables(
+    count_mode: CountMode = Query("exact", description=COUNT_MODE_DESCRIPCION),
+    db: sqlite3.Connection = Depends(get_db_read),
+) -> Dict[str, Any]:
     try:
         from db import list_tables
-        tables = list_tables(db, include_system=False)
+        tables = resultados.get_or_compute(
+            ("db_tables", count_mode, marca_cambios(db)),
+            lambda: list_tables(db, include_system=False, count_mode=count_mode),
+        )
         return {"status": "ok", "db_path": str(DB_PATH), "tables_count": len(tables), "tables": tables}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al listar tablas: {e}")
 
 
 @app.get("/db/indexes", tags=["Base de datos"])
-def listar_indices(db: sqlite3.Connection = Depends(get_db)):
+def listar_indices(db: sqlite3.Connection = Depends(get_db_read)):
     rows = db.execute("""
         SELECT name, tbl_name
         FROM sqlite_master
@@ -168,20 +346,224 @@ def listar_indices(db: sqlite3.Connection = Depends(get_db)):
     return [dict(r) for r in rows]
 
 
+@app.get("/db/cache", tags=["Base de datos"])
+def db_cache_stats():
+    """Aciertos/fallos de la caché de resultados de /stats y /db/tables."""
+    return {"status": "ok", **resultados.stats()}
+
+
+@app.get("/db/pool", tags=["Base de datos"])
+def db_pool_stats():
+    """Estado del pool: conexiones libres y tiempos de espera de checkout."""
+    return {"status": "ok", **get_pool().stats()}
+
+
+@app.get("/db/admision", tags=["Base de datos"])
+def db_admision_stats():
+    """Cupos, colas y rechazos del control de admisión, por clase."""
+    return {"status": "ok", "hilos": HILOS, "clases": admision.stats()}
+
+
 @app.post("/db/indexes", tags=["Base de datos"])
 def crear_indices(db: sqlite3.Connection = Depends(get_db)):
-    stmts = [
-        "CREATE INDEX IF NOT EXISTS idx_internos_dni    ON internos(dni)",
-        "CREATE INDEX IF NOT EXISTS idx_internos_estado ON internos(estado)",
-        "CREATE INDEX IF NOT EXISTS idx_internos_celda  ON internos(celda_id)",
-        "CREATE INDEX IF NOT EXISTS idx_internos_fecha  ON internos(fecha_ingreso)",
-        "CREATE INDEX IF NOT EXISTS idx_celdas_pabellon ON celdas(pabellon)"
-    ]
-    for s in stmts:
-        db.execute(s)
+    """Los índices ya los crea la migración 8; esto los reaplica y refresca ANALYZE."""
+    stmts = list(sentencias(INDICES_SQL))
+    ejecutar_script(db, INDICES_SQL)
+    # Estadísticas acotadas para el planner y para count_mode=estimated de /db/tables
+    db.execute("PRAGMA analysis_limit = 1000")
+    db.execute("ANALYZE")
     db.commit()
     return {"status": "ok", "created_or_exists": len(stmts)}
 
+# --- Respaldos en caliente: corren en un hilo propio y se consultan por id
+RESPALDOS_TTL = 3600.0    # segundos que se conserva el estado de un respaldo terminado
+RESPALDOS_MAX = 100       # terminados que se conservan como mucho (se descartan los más viejos)
+_respaldos: Dict[str, Dict[str, Any]] = {}
+_respaldos_fin: Dict[str, float] = {}     # id -> time.monotonic() al terminar
+_respaldos_lock = threading.Lock()
+
+def _podar_respaldos() -> None:
+    """Descarta terminados vencidos o por encima de RESPALDOS_MAX. Con _respaldos_lock tomado."""
+    ahora = time.monotonic()
+    terminados = list(_respaldos_fin)     # en orden de finalización
+    sobran = len(terminados) - RESPALDOS_MAX
+    for i, rid in enumerate(terminados):
+        if i < sobran or ahora - _respaldos_fin[rid] > RESPALDOS_TTL:
+            del _respaldos_fin[rid], _respaldos[rid]
+
+def _correr_respaldo(estado: Dict[str, Any], paginas: int, pausa: float) -> None:
+    def progreso(hechas: int, total: int) -> None:
+        estado.update(paginas_copiadas=hechas, paginas_total=total,
+                      porcentaje=round(100 * hechas / total, 1) if total else 100.0)
+    try:
+        # Con la conexión escritora tomada mientras se abren las fotos, ningún archivado
+        # queda a medias entre la principal y `archivo`
+        fijar = lambda: get_pool().connection(write=True)
+        estado.update(respaldar(paginas=paginas, pausa=pausa, progreso=progreso, fijar=fijar), estado="ok")
+    except Exception as e:
+        estado.update(estado="error", error=str(e))
+    finally:
+        with _respaldos_lock:
+            _respaldos_fin[estado["id"]] = time.monotonic()
+
+@app.post("/db/backup", tags=["Base de datos"], status_code=202)
+def crear_respaldo(
+    paginas: int = Query(BACKUP_PAGINAS, ge=1, le=65536, description="Páginas copiadas por paso"),
+    pausa: float = Query(BACKUP_PAUSA, ge=0, le=1, description="Segundos de espera entre pasos"),
+    esperar: bool = Query(False, description="Responder recién cuando termina"),
+):
+    """
+    Respaldo consistente sin frenar a la API (backup API por pasos). Devuelve 202 con el id
+    para seguir el progreso en GET /db/backup/{id}; con esperar=true, el resultado final.
+    """
+    with _respaldos_lock:
+        _podar_respaldos()
+        if any(r["estado"] == "en_curso" for r in _respaldos.values()):
+            raise HTTPException(status_code=409, detail="Ya hay un respaldo en curso")
+        rid = uuid.uuid4().hex[:12]
+        estado = _respaldos[rid] = {"id": rid, "estado": "en_curso", "paginas_copiadas": 0,
+                                    "paginas_total": None, "porcentaje": 0.0}
+    if esperar:
+        _correr_respaldo(estado, paginas, pausa)
+        if estado["estado"] == "error":
+            raise HTTPException(status_code=500, detail=estado["error"])
+        return JSONResponse(status_code=200, content=estado)
+    threading.Thread(target=_correr_respaldo, args=(estado, paginas, pausa), daemon=True).start()
+    return JSONResponse(status_code=202, content=dict(estado), headers={"Location": f"/db/backup/{rid}"})
+
+@app.get("/db/backup/{respaldo_id}", tags=["Base de datos"])
+def estado_respaldo(respaldo_id: str):
+    with _respaldos_lock:
+        _podar_respaldos()
+        estado = _respaldos.get(respaldo_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Respaldo no encontrado")
+    return dict(estado)
+
+@app.get("/db/backups", tags=["Base de datos"])
+def respaldos_disponibles():
+    return {"directorio": str(backup_dir()), "respaldos": listar_respaldos()}
+
+@app.post("/db/restore", tags=["Base de datos"])
+def restaurar_respaldo(
+    archivo: str = Query(..., description="Nombre de un archivo de GET /db/backups"),
+    verificar: bool = Query(True, description="Exigir checksum .sha256 y quick_check"),
+):
+    """Reemplaza el contenido de la base por el respaldo. Mientras dura, las escrituras esperan."""
+    if Path(archivo).name != archivo or not archivo.endswith(".db"):
+        raise HTTPException(status_code=400, detail="Nombre de archivo inválido")
+    try:
+        with get_pool().connection(write=True) as db:
+            resultado = restaurar(backup_dir() / archivo, db, verificar=verificar)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    resultados.clear()
+    return {"status": "ok", **resultado}
+
+@app.post("/db/archivar", tags=["Base de datos"])
+def archivar_internos(
+    antiguedad_dias: int = Query(ARCHIVO_ANTIGUEDAD_DIAS, ge=0, description="Archivar ingresos anteriores a hoy menos estos días"),
+    lote: int = Query(ARCHIVO_LOTE, ge=1, le=50_000, description="Filas movidas por transacción"),
+):
+    """
+    Mueve a la base de archivo los internos Trasladados/Liberados con ingreso anterior al
+    corte. Cada lote es una escritura aparte: las demás escrituras se intercalan entre lotes.
+    """
+    corte, movidos = corte_archivo(antiguedad_dias), 0
+    while True:
+        n = escribir(lambda db: archivar_lote(db, corte, lote))
+        movidos += n
+        if n < lote:
+            break
+    return {"status": "ok", "corte": corte.isoformat(), "movidos": movidos}
+
+# =========================
+# Paginación por cursor (keyset)
+# =========================
+PAGE_LIMIT_DEFAULT = 100    # página cuando llega un cursor sin limit
+PAGE_LIMIT_MAX = 1000
+LIMIT_DESCRIPCION = (f"Filas por página (hasta {PAGE_LIMIT_MAX}). Sin limit ni cursor se devuelven todas; "
+                     "si hay más páginas, el header X-Next-Cursor trae el cursor de la siguiente")
+
+def _encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str, n: int) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(values, list) or len(values) != n:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
+def _paginar(
+    db: sqlite3.Connection,
+    query: str,
+    params: List[Any],
+    orden: List[str],
+    limit: Optional[int],
+    cursor: Optional[str],
+    response: Response,
+) -> List[sqlite3.Row]:
+    """
+    Aplica seek sobre las columnas de `orden` (la última debe ser única, p.ej. id)
+    en lugar de OFFSET: el costo no depende de la profundidad de la página.
+    Deja el cursor de la página siguiente en el header X-Next-Cursor. Sin limit ni
+    cursor devuelve todas las filas, como antes de paginar: paginar es opt-in.
+    """
+    cols = ", ".join(orden)
+    if cursor:
+        query += f" AND ({cols}) > ({', '.join('?' * len(orden))})"
+        params = params + _decode_cursor(cursor, len(orden))
+    elif limit is None:
+        return db.execute(query + f" ORDER BY {cols}", params).fetchall()
+    limit = limit or PAGE_LIMIT_DEFAULT
+    query += f" ORDER BY {cols} LIMIT ?"
+    rows = db.execute(query, params + [limit + 1]).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor([rows[-1][c] for c in orden])
+    return rows
+
+# =========================
+# ETag / If-None-Match
+# =========================
+# El ETag se arma con marca_cambios (db.py), que se lee de la base: cambia con lo que
+# escriba cualquier worker o el CLI, y sigue valiendo tras un reinicio si nada cambió.
+# Un contador en memoria no alcanza: un 304 sobre datos escritos por otro proceso no vencería nunca.
+
+def _etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match usa comparación débil: W/"x" coincide con "x"
+    return any(t.strip().removeprefix("W/") == etag for t in if_none_match.split(","))
+
+def etag_tablas(*tablas: str, diario: bool = False):
+    """
+    Dependencia que calcula un ETag fuerte con la marca de cambios de `tablas` y los query
+    params. Si coincide con If-None-Match corta con 304 antes de consultar o serializar. La
+    conexión lectora es la misma que recibe el handler (FastAPI cachea get_db_read por request).
+    `diario`: la respuesta depende de la fecha de hoy (rangos por defecto) y el ETag cambia
+    de un día a otro.
+    """
+    def dependencia(request: Request, response: Response, db: sqlite3.Connection = Depends(get_db_read)) -> str:
+        clave = (request.url.path, sorted(request.query_params.multi_items()),
+                 marca_cambios(db, *tablas), date.today().isoformat() if diario else None)
+        etag = '"' + hashlib.blake2b(repr(clave).encode("utf-8"), digest_size=16).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}   # el cliente puede guardar, pero revalida
+        if _etag_coincide(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return etag
+    return dependencia
+
 # =========================
 # Celdas CRUD
 # =========================
@@ -200,30 +582,35 @@ def crear_celda(
             }
         }
     ),
-    db: sqlite3.Connection = Depends(get_db),
 ):
-    try:
+    def _op(db: sqlite3.Connection) -> dict:
         db.execute("""
             INSERT INTO celdas (pabellon, numero, capacidad)
             VALUES (?, ?, ?)
         """, (payload.pabellon, payload.numero, payload.capacidad))
-        db.commit()
+        row = db.execute("""
+            SELECT id, pabellon, numero, capacidad
+            FROM celdas
+            WHERE rowid = last_insert_rowid()
+        """).fetchone()
+        return dict(row)
+
+    try:
+        celda = escribir(_op)
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
-
-    row = db.execute("""
-        SELECT id, pabellon, numero, capacidad
-        FROM celdas
-        WHERE rowid = last_insert_rowid()
-    """).fetchone()
-    return dict(row)
+    return celda
 
 
 @app.get("/celdas", response_model=List[CeldaOut], tags=["Celdas"])
 def listar_celdas(
+    response: Response,
     pabellon: Optional[str] = None,
     numero: Optional[str] = None,
-    db: sqlite3.Connection = Depends(get_db),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX, description=LIMIT_DESCRIPCION),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    _etag: str = Depends(etag_tablas("celdas")),
+    db: sqlite3.Connection = Depends(get_db_read),
 ):
     query = "SELECT id, pabellon, numero, capacidad FROM celdas WHERE 1=1"
     params: List[Any] = []
@@ -233,42 +620,128 @@ def listar_celdas(
     if numero:
         query += " AND numero = ?"
         params.append(numero)
-    query += " ORDER BY pabellon, numero"
-    rows = db.execute(query, params).fetchall()
-    return [dict(r) for r in rows]
+    rows = _paginar(db, query, params, ["pabellon", "numero", "id"], limit, cursor, response)
+    return respuesta_json(CeldaOut, rows, response)
 
 @app.get("/celdas/{celda_id}", response_model=CeldaOut, tags=["Celdas"])
-def obtener_celda(celda_id: int, db: sqlite3.Connection = Depends(get_db)):
+def obtener_celda(celda_id: int,
+                  response: Response,
+                  _etag: str = Depends(etag_tablas("celdas")),
+                  db: sqlite3.Connection = Depends(get_db_read)):
     row = db.execute("SELECT id, pabellon, numero, capacidad FROM celdas WHERE id = ?", (celda_id,)).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Celda no encontrada")
-    return dict(row)
+    return respuesta_json(CeldaOut, row, response)
 
 @app.put("/celdas/{celda_id}", response_model=CeldaOut, tags=["Celdas"])
-def actualizar_celda(celda_id: int, payload: CeldaIn, db: sqlite3.Connection = Depends(get_db)):
-    exists = db.execute("SELECT 1 FROM celdas WHERE id = ?", (celda_id,)).fetchone()
-    if not exists:
-        raise HTTPException(status_code=404, detail="Celda no encontrada")
-    try:
+def actualizar_celda(celda_id: int, payload: CeldaIn):
+    def _op(db: sqlite3.Connection) -> dict:
+        exists = db.execute("SELECT 1 FROM celdas WHERE id = ?", (celda_id,)).fetchone()
+        if not exists:
+            raise HTTPException(status_code=404, detail="Celda no encontrada")
         db.execute("UPDATE celdas SET pabellon = ?, numero = ?, capacidad = ? WHERE id = ?",
                    (payload.pabellon, payload.numero, payload.capacidad, celda_id))
-        db.commit()
+        row = db.execute("SELECT id, pabellon, numero, capacidad FROM celdas WHERE id = ?", (celda_id,)).fetchone()
+        return dict(row)
+
+    try:
+        celda = escribir(_op)
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
-    row = db.execute("SELECT id, pabellon, numero, capacidad FROM celdas WHERE id = ?", (celda_id,)).fetchone()
-    return dict(row)
+    return celda
 
 @app.delete("/celdas/{celda_id}", tags=["Celdas"])
-def eliminar_celda(celda_id: int, db: sqlite3.Connection = Depends(get_db)):
-    ref = db.execute("SELECT 1 FROM internos WHERE celda_id = ?", (celda_id,)).fetchone()
-    if ref:
-        raise HTTPException(status_code=409, detail="No se puede borrar: hay internos asignados a esta celda")
-    cur = db.execute("DELETE FROM celdas WHERE id = ?", (celda_id,))
-    db.commit()
-    if cur.rowcount == 0:
+def eliminar_celda(celda_id: int):
+    def _op(db: sqlite3.Connection) -> int:
+        ref = db.execute("SELECT 1 FROM internos WHERE celda_id = ?", (celda_id,)).fetchone()
+        if ref:
+            raise HTTPException(status_code=409, detail="No se puede borrar: hay internos asignados a esta celda")
+        return db.execute("DELETE FROM celdas WHERE id = ?", (celda_id,)).rowcount
+
+    if escribir(_op) == 0:
         raise HTTPException(status_code=404, detail="Celda no encontrada")
     return {"status": "ok", "deleted_id": celda_id}
 
+# =========================
+# Ocupación por pabellón (vista de planta)
+# =========================
+class Ocupante(BaseModel):
+    id: int
+    dni: Optional[str] = None
+    nombre: str
+    apellido: str
+    fecha_ingreso: date
+    causa: Optional[str] = None
+    condena_meses: Optional[int] = None
+
+class CeldaOcupacion(BaseModel):
+    id: int
+    numero: str
+    capacidad: int
+    ocupados: int
+    libres: int
+    internos: List[Ocupante]        # vacía si la celda está libre; orden apellido, nombre, id
+
+class PabellonOcupacion(BaseModel):
+    pabellon: str
+    capacidad: int
+    ocupados: int
+    libres: int
+    ocupacion: float                # 0..1
+    celdas: List[CeldaOcupacion]    # orden numero, id (el mismo de GET /celdas)
+
+_OCUPANTE_COLS = ("id", "dni", "nombre", "apellido", "fecha_ingreso", "causa", "condena_meses")
+
+@app.get("/pabellones/{pabellon}/ocupacion", response_model=PabellonOcupacion, tags=["Celdas"])
+def ocupacion_pabellon(
+    pabellon: str,
+    _etag: str = Depends(etag_tablas("celdas", "internos")),
+    db: sqlite3.Connection = Depends(get_db_read),
+):
+    """
+    Celdas del pabellón con capacidad, camas libres y sus internos Activos, en una sola
+    consulta: reemplaza GET /celdas?pabellon= más un GET /internos?celda_id= por celda.
+    """
+    key = ("ocupacion", pabellon, marca_cambios(db, "celdas", "internos"))
+    resultado = resultados.get_or_compute(key, lambda: _calcular_ocupacion(db, pabellon))
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="Pabellón sin celdas")
+    return resultado
+
+def _calcular_ocupacion(db: sqlite3.Connection, pabellon: str) -> Optional[PabellonOcupacion]:
+    # celdas por pabellón, internos por idx_internos_celda. El '+' saca a estado de la
+    # elección de índice: sin ANALYZE el planner puede ir por idx_internos_estado y
+    # recorrer todos los Activos por cada celda.
+    filas = db.execute("""
+        SELECT c.id, c.numero, c.capacidad,
+               i.id, i.dni, i.nombre, i.apellido, i.fecha_ingreso, i.causa, i.condena_meses
+        FROM celdas c
+        LEFT JOIN internos i ON i.celda_id = c.id AND +i.estado = 'Activo'
+        WHERE c.pabellon = ?
+        ORDER BY c.numero, c.id, i.apellido, i.nombre, i.id
+    """, (pabellon,))
+    celdas: List[CeldaOcupacion] = []
+    actual = None
+    for r in filas:                 # las filas de una celda llegan juntas: se agrupa al pasar
+        if actual is None or actual.id != r[0]:
+            actual = CeldaOcupacion(id=r[0], numero=r[1], capacidad=r[2], ocupados=0, libres=r[2], internos=[])
+            celdas.append(actual)
+        if r[3] is not None:
+            actual.internos.append(Ocupante(**dict(zip(_OCUPANTE_COLS, r[3:]))))
+    if not celdas:
+        return None
+    for c in celdas:
+        c.ocupados = len(c.internos)
+        c.libres = max(c.capacidad - c.ocupados, 0)
+    capacidad = sum(c.capacidad for c in celdas)
+    ocupados = sum(c.ocupados for c in celdas)
+    return PabellonOcupacion(
+        pabellon=pabellon, capacidad=capacidad, ocupados=ocupados,
+        libres=sum(c.libres for c in celdas),
+        ocupacion=round(ocupados / capacidad, 3) if capacidad else 0.0,
+        celdas=celdas,
+    )
+
 # =========================
 # Agentes CRUD
 # =========================
@@ -291,34 +764,39 @@ def crear_agente(
             }
         }
     ),
-    db: sqlite3.Connection = Depends(get_db),
 ):
-    try:
+    def _op(db: sqlite3.Connection) -> dict:
         db.execute("""
             INSERT INTO agentes (legajo, nombre, apellido, rango, activo)
             VALUES (?, ?, ?, ?, ?)
         """, (payload.legajo, payload.nombre, payload.apellido, payload.rango, int(payload.activo)))
-        db.commit()
+        row = db.execute("""
+            SELECT id, legajo, nombre, apellido, rango, (activo != 0) AS activo
+            FROM agentes
+            WHERE rowid = last_insert_rowid()
+        """).fetchone()
+        return dict(row)
+
+    try:
+        agente = escribir(_op)
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
-
-    row = db.execute("""
-        SELECT id, legajo, nombre, apellido, rango, (activo != 0) AS activo
-        FROM agentes
-        WHERE rowid = last_insert_rowid()
-    """).fetchone()
-    return dict(row)
+    return agente
 
 
 
 @app.get("/agentes", response_model=List[AgenteOut], tags=["Agentes"])
 def listar_agentes(
+    response: Response,
     legajo: Optional[str] = None,
     nombre: Optional[str] = None,
     apellido: Optional[str] = None,
     rango: Optional[RangoLiteral] = None,
     activo: Optional[bool] = None,
-    db: sqlite3.Connection = Depends(get_db),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX, description=LIMIT_DESCRIPCION),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    _etag: str = Depends(etag_tablas("agentes")),
+    db: sqlite3.Connection = Depends(get_db_read),
 ):
     query = """
         SELECT id, legajo, nombre, apellido, rango, (activo != 0) AS activo
@@ -341,15 +819,17 @@ def listar_agentes(
     if activo is not None:
         query += " AND activo = ?"
         params.append(int(activo))
-    query += " ORDER BY apellido, nombre"
-    rows = db.execute(query, params).fetchall()
-    return [dict(r) for r in rows]
+    rows = _paginar(db, query, params, ["apellido", "nombre", "id"], limit, cursor, response)
+    return respuesta_json(AgenteOut, rows, response)
 
 
 
 
 @app.get("/agentes/{agente_id}", response_model=AgenteOut, tags=["Agentes"])
-def obtener_agente(agente_id: int, db: sqlite3.Connection = Depends(get_db)):
+def obtener_agente(agente_id: int,
+                   response: Response,
+                   _etag: str = Depends(etag_tablas("agentes")),
+                   db: sqlite3.Connection = Depends(get_db_read)):
     row = db.execute("""
         SELECT id, legajo, nombre, apellido, rango, (activo != 0) AS activo
         FROM agentes
@@ -357,34 +837,36 @@ def obtener_agente(agente_id: int, db: sqlite3.Connection = Depends(get_db)):
     """, (agente_id,)).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Agente no encontrado")
-    return dict(row)
+    return respuesta_json(AgenteOut, row, response)
 
 @app.put("/agentes/{agente_id}", response_model=AgenteOut, tags=["Agentes"])
-def actualizar_agente(agente_id: int, payload: AgenteIn, db: sqlite3.Connection = Depends(get_db)):
-    existe = db.execute("SELECT 1 FROM agentes WHERE id = ?", (agente_id,)).fetchone()
-    if not existe:
-        raise HTTPException(status_code=404, detail="Agente no encontrado")
-    try:
+def actualizar_agente(agente_id: int, payload: AgenteIn):
+    def _op(db: sqlite3.Connection) -> dict:
+        existe = db.execute("SELECT 1 FROM agentes WHERE id = ?", (agente_id,)).fetchone()
+        if not existe:
+            raise HTTPException(status_code=404, detail="Agente no encontrado")
         db.execute("""
             UPDATE agentes
             SET legajo = ?, nombre = ?, apellido = ?, rango = ?, activo = ?
             WHERE id = ?
         """, (payload.legajo, payload.nombre, payload.apellido, payload.rango, int(payload.activo), agente_id))
-        db.commit()
+        row = db.execute("""
+            SELECT id, legajo, nombre, apellido, rango, (activo != 0) AS activo
+            FROM agentes
+            WHERE id = ?
+        """, (agente_id,)).fetchone()
+        return dict(row)
+
+    try:
+        agente = escribir(_op)
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
-    row = db.execute("""
-        SELECT id, legajo, nombre, apellido, rango, (activo != 0) AS activo
-        FROM agentes
-        WHERE id = ?
-    """, (agente_id,)).fetchone()
-    return dict(row)
+    return agente
 
 @app.delete("/agentes/{agente_id}", tags=["Agentes"])
-def eliminar_agente(agente_id: int, db: sqlite3.Connection = Depends(get_db)):
-    cur = db.execute("DELETE FROM agentes WHERE id = ?", (agente_id,))
-    db.commit()
-    if cur.rowcount == 0:
+def eliminar_agente(agente_id: int):
+    borrados = escribir(lambda db: db.execute("DELETE FROM agentes WHERE id = ?", (agente_id,)).rowcount)
+    if borrados == 0:
         raise HTTPException(status_code=404, detail="Agente no encontrado")
     return {"status": "ok", "deleted_id": agente_id}
 
@@ -411,14 +893,13 @@ def crear_interno(
             "condena_meses": 24
         }
     ),
-    db: sqlite3.Connection = Depends(get_db),
 ):
     if payload.estado != 'Activo' and payload.celda_id is not None:
         raise HTTPException(status_code=400, detail="Un interno no Activo no puede tener celda asignada")
-    if payload.celda_id is not None and not _celda_existe(db, payload.celda_id):
-        raise HTTPException(status_code=404, detail="Celda indicada no existe")
 
-    try:
+    def _op(db: sqlite3.Connection) -> dict:
+        if payload.celda_id is not None and not _celda_existe(db, payload.celda_id):
+            raise HTTPException(status_code=404, detail="Celda indicada no existe")
         db.execute("""
             INSERT INTO internos (dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -432,29 +913,38 @@ def crear_interno(
             payload.causa,
             payload.condena_meses
         ))
-        db.commit()
+        row = db.execute("""
+            SELECT id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses
+            FROM internos
+            WHERE rowid = last_insert_rowid()
+        """).fetchone()
+        return dict(row)
+
+    try:
+        interno = escribir(_op)
     except sqlite3.IntegrityError as e:
         raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
-
-    row = db.execute("""
-        SELECT id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses
-        FROM internos
-        WHERE rowid = last_insert_rowid()
-    """).fetchone()
-    return dict(row)
+    return interno
 
 @app.get("/internos", response_model=List[InternoOut], tags=["Internos"])
 def listar_internos(
+    response: Response,
     dni: Optional[str] = None,
     estado: Optional[EstadoLiteral] = None,
     celda_id: Optional[int] = None,
     apellido: Optional[str] = None,
     causa: Optional[str] = None,
-    db: sqlite3.Connection = Depends(get_db),
+    ids: Optional[List[int]] = Query(None, description=f"Multi-get: ?ids=1&ids=2 (hasta {PAGE_LIMIT_MAX})"),
+    celda_ids: Optional[List[int]] = Query(None, description=f"Internos de varias celdas (hasta {PAGE_LIMIT_MAX})"),
+    incluir_archivo: bool = Query(False, description="Sumar internos archivados (más lento)"),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX, description=LIMIT_DESCRIPCION),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    _etag: str = Depends(etag_tablas("internos")),
+    db: sqlite3.Connection = Depends(get_db_read),
 ):
-    query = """
+    query = f"""
         SELECT id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses
-        FROM internos
+        FROM {internos_desde(incluir_archivo)} AS internos
         WHERE 1=1
     """
     params: List[Any] = []
@@ -468,76 +958,617 @@ def listar_internos(
         query += " AND apellido = ?";   params.append(apellido)
     if causa:
         query += " AND causa = ?";      params.append(causa)
+    for col, valores in (("id", ids), ("celda_id", celda_ids)):
+        if valores:
+            valores = list(dict.fromkeys(valores))
+            if len(valores) > PAGE_LIMIT_MAX:
+                raise HTTPException(status_code=400, detail=f"'{col}s' admite hasta {PAGE_LIMIT_MAX} valores")
+            query += f" AND {col} IN ({','.join('?' * len(valores))})"
+            params.extend(valores)
 
-    query += " ORDER BY apellido, nombre"
-    rows = db.execute(query, params).fetchall()
-    return [dict(r) for r in rows]
+    rows = _paginar(db, query, params, ["apellido", "nombre", "id"], limit, cursor, response)
+    return respuesta_json(InternoOut, rows, response)
 
 
 
 
 @app.get("/internos/{interno_id}", response_model=InternoOut, tags=["Internos"])
-def obtener_interno(interno_id: int, db: sqlite3.Connection = Depends(get_db)):
-    row = db.execute("""
+def obtener_interno(interno_id: int,
+                    response: Response,
+                    incluir_archivo: bool = Query(False, description="Buscar también entre los archivados"),
+                    _etag: str = Depends(etag_tablas("internos")),
+                    db: sqlite3.Connection = Depends(get_db_read)):
+    row = db.execute(f"""
         SELECT id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses
-        FROM internos
+        FROM {internos_desde(incluir_archivo)} AS internos
         WHERE id = ?
     """, (interno_id,)).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Interno no encontrado")
+    return respuesta_json(InternoOut, row, response)
+
+class InternoPatch(BaseModel):
+    """Actualización parcial: solo se aplican los campos presentes en el cuerpo."""
+    dni: Optional[DniStr] = None
+    nombre:   Optional[Nombre80] = None
+    apellido: Optional[Apellido80] = None
+    fecha_ingreso: Optional[date] = None
+    estado:   Optional[EstadoLiteral] = None
+    celda_id: Optional[int] = None
+    causa:    Optional[str] = Field(None, min_length=1, max_length=200)
+    condena_meses: Optional[int] = Field(None, ge=0, le=600)
+
+def _reemplazar_interno(db: sqlite3.Connection, interno_id: int, payload: InternoIn) -> dict:
+    if payload.estado != 'Activo' and payload.celda_id is not None:
+        raise HTTPException(status_code=400, detail="Un interno no Activo no puede tener celda asignada")
+    if payload.celda_id is not None and not _celda_existe(db, payload.celda_id):
+        raise HTTPException(status_code=404, detail="Celda indicada no existe")
+    db.execute("""
+        UPDATE internos
+        SET dni = ?, nombre = ?, apellido = ?, fecha_ingreso = ?, estado = ?, celda_id = ?, causa = ?, condena_meses = ?
+        WHERE id = ?
+    """, (
+        payload.dni,
+        payload.nombre,
+        payload.apellido,
+        payload.fecha_ingreso.isoformat(),
+        payload.estado,
+        payload.celda_id,
+        payload.causa,
+        payload.condena_meses,
+        interno_id
+    ))
+    row = db.execute("""
+        SELECT id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses
+        FROM internos
+        WHERE id = ?
+    """, (interno_id,)).fetchone()
     return dict(row)
 
-@app.post("/celdas", response_model=CeldaOut, tags=["Celdas"])
-def crear_celda(
-    payload: CeldaIn = Body(
+@app.put("/internos/{interno_id}", response_model=InternoOut, tags=["Internos"])
+def actualizar_interno(interno_id: int, payload: InternoIn):
+    def _op(db: sqlite3.Connection) -> dict:
+        existe = db.execute("SELECT 1 FROM internos WHERE id = ?", (interno_id,)).fetchone()
+        if not existe:
+            raise HTTPException(status_code=404, detail="Interno no encontrado")
+        return _reemplazar_interno(db, interno_id, payload)
+
+    try:
+        interno = escribir(_op)
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
+    return interno
+
+@app.patch("/internos/{interno_id}", response_model=InternoOut, tags=["Internos"])
+def modificar_interno(interno_id: int, payload: InternoPatch):
+    cambios = payload.model_dump(exclude_unset=True)
+
+    def _op(db: sqlite3.Connection) -> dict:
+        row = db.execute("""
+            SELECT dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses
+            FROM internos
+            WHERE id = ?
+        """, (interno_id,)).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Interno no encontrado")
+        actual = dict(row)
+        # Pasar a Trasladado/Liberado sin indicar celda libera la cama
+        if cambios.get("estado", "Activo") != 'Activo' and "celda_id" not in cambios:
+            actual["celda_id"] = None
+        try:
+            # Se revalida el resultado completo: un null explícito en un campo obligatorio es 422
+            nuevo = InternoIn.model_validate({**actual, **cambios})
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=_formatear_validacion(e))
+        return _reemplazar_interno(db, interno_id, nuevo)
+
+    try:
+        interno = escribir(_op)
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
+    return interno
+
+@app.delete("/internos/{interno_id}", tags=["Internos"])
+def eliminar_interno(interno_id: int):
+    borrados = escribir(lambda db: db.execute("DELETE FROM internos WHERE id = ?", (interno_id,)).rowcount)
+    if borrados == 0:
+        raise HTTPException(status_code=404, detail="Interno no encontrado")
+    return {"status": "ok", "deleted_id": interno_id}
+
+# =========================
+# Carga masiva (POST /{entidad}/bulk)
+# =========================
+BULK_CHUNK = 500            # filas por INSERT multi-fila / transacción
+BULK_MAX_FILAS = 100_000    # tope por request
+
+class BulkError(BaseModel):
+    fila: int       # posición en el lote, empezando en 1 (sin contar el encabezado CSV)
+    error: str
+
+class BulkResultado(BaseModel):
+    recibidas: int
+    insertados: List[int]
+    errores: List[BulkError]
+
+# tabla -> (modelo de entrada, INSERT, parámetros a partir del modelo)
+_BULK: Dict[str, Tuple[Any, str, Any]] = {
+    "celdas": (
+        CeldaIn,
+        "INSERT INTO celdas (pabellon, numero, capacidad) VALUES (?, ?, ?)",
+        lambda p: (p.pabellon, p.numero, p.capacidad),
+    ),
+    "agentes": (
+        AgenteIn,
+        "INSERT INTO agentes (legajo, nombre, apellido, rango, activo) VALUES (?, ?, ?, ?, ?)",
+        lambda p: (p.legajo, p.nombre, p.apellido, p.rango, int(p.activo)),
+    ),
+    "internos": (
+        InternoIn,
+        "INSERT INTO internos (dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        lambda p: (p.dni, p.nombre, p.apellido, p.fecha_ingreso.isoformat(), p.estado,
+                   p.celda_id, p.causa, p.condena_meses),
+    ),
+}
+
+def _bulk_openapi(modelo: str) -> Dict[str, Any]:
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"type": "array", "items": {"$ref": f"#/components/schemas/{modelo}"}}},
+        "application/x-ndjson": {"schema": {"type": "string", "description": "Un objeto JSON por línea"}},
+        "text/csv": {"schema": {"type": "string", "description": "Encabezado con los nombres de campo"}},
+    }}}
+
+async def _iter_lineas(request: Request) -> AsyncIterator[str]:
+    pendiente = b""
+    async for chunk in request.stream():
+        pendiente += chunk
+        *lineas, pendiente = pendiente.split(b"\n")
+        for linea in lineas:
+            yield linea.decode("utf-8").rstrip("\r")
+    if pendiente:
+        yield pendiente.decode("utf-8").rstrip("\r")
+
+def _validar_encabezado_csv(encabezado: List[str], modelo: Any) -> None:
+    """Columnas desconocidas se descartarían en silencio (p.ej. 'documento' por 'dni'): mejor rechazar."""
+    campos = modelo.model_fields
+    problemas = []
+    repetidas = sorted({h for h in encabezado if encabezado.count(h) > 1})
+    if repetidas:
+        problemas.append(f"columnas repetidas: {', '.join(repetidas)}")
+    desconocidas = [h for h in dict.fromkeys(encabezado) if h not in campos]
+    if desconocidas:
+        problemas.append(f"columnas desconocidas: {', '.join(desconocidas)}")
+    faltan = [k for k, f in campos.items() if f.is_required() and k not in encabezado]
+    if faltan:
+        problemas.append(f"faltan columnas obligatorias: {', '.join(faltan)}")
+    if problemas:
+        raise HTTPException(status_code=400, detail=f"Encabezado CSV inválido: {'; '.join(problemas)}")
+
+async def _leer_lote(request: Request, modelo: Any) -> AsyncIterator[Any]:
+    """Devuelve los objetos del body a medida que llegan (JSON array, NDJSON o CSV)."""
+    ctype = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    if ctype in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        async for linea in _iter_lineas(request):
+            if not linea.strip():
+                continue
+            try:
+                yield json.loads(linea)
+            except ValueError as e:
+                yield ValueError(f"JSON inválido: {e}")
+    elif ctype == "text/csv":
+        encabezado: Optional[List[str]] = None
+        registro = ""
+        async for linea in _iter_lineas(request):
+            registro = f"{registro}\n{linea}" if registro else linea
+            if registro.count('"') % 2:
+                continue        # campo entre comillas con saltos de línea: falta el resto
+            if registro.strip():
+                valores = next(csv.reader([registro]))
+                if encabezado is None:
+                    encabezado = [h.strip() for h in valores]
+                    _validar_encabezado_csv(encabezado, modelo)
+                elif len(valores) != len(encabezado):
+                    yield ValueError(f"La fila tiene {len(valores)} campos y el encabezado {len(encabezado)}")
+                else:
+                    yield {k: (v if v != "" else None) for k, v in zip(encabezado, valores)}
+            registro = ""
+    elif ctype == "application/json":
+        try:
+            data = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"JSON inválido: {e}")
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="Se esperaba un arreglo JSON")
+        for obj in data:
+            yield obj
+    else:
+        raise HTTPException(status_code=415, detail=f"Content-Type no soportado: {ctype}")
+
+def _formatear_validacion(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())
+
+def _bulk_validar_internos(db: sqlite3.Connection, filas: List[Tuple[int, Any]], errores: List[BulkError]):
+    """Mismas reglas que crear_interno, pero la existencia de celdas se consulta en bloque."""
+    ids = sorted({p.celda_id for _, p in filas if p.celda_id is not None})
+    existentes = set()
+    for i in range(0, len(ids), BULK_CHUNK):
+        parte = ids[i:i + BULK_CHUNK]
+        existentes.update(r[0] for r in db.execute(
+            f"SELECT id FROM celdas WHERE id IN ({','.join('?' * len(parte))})", parte))
+    validas = []
+    for n, p in filas:
+        if p.estado != 'Activo' and p.celda_id is not None:
+            errores.append(BulkError(fila=n, error="Un interno no Activo no puede tener celda asignada"))
+        elif p.celda_id is not None and p.celda_id not in existentes:
+            errores.append(BulkError(fila=n, error="Celda indicada no existe"))
+        else:
+            validas.append((n, p))
+    return validas
+
+def _bulk_insertar_chunk(db: sqlite3.Connection, sql: str, params: List[tuple]) -> List[int]:
+    # Un INSERT multi-fila con RETURNING da los ids que asignó SQLite, sin suponerlos.
+    # El orden de RETURNING no está garantizado, pero dentro de una sentencia los rowid
+    # nuevos son crecientes: ordenados, siguen el orden de VALUES.
+    tupla = sql[sql.index(" VALUES ") + 8:]
+    multi = sql + (", " + tupla) * (len(params) - 1) + " RETURNING id"
+    return sorted(r[0] for r in db.execute(multi, [v for p in params for v in p]))
+
+def _bulk_insertar(tabla: str, filas: List[Tuple[int, Any]], errores: List[BulkError], atomico: bool) -> List[int]:
+    _, sql, a_params = _BULK[tabla]
+    insertados: List[int] = []
+    with get_pool().connection(write=True) as db:
+        if tabla == "internos":
+            filas = _bulk_validar_internos(db, filas, errores)
+        if atomico and errores:
+            return []
+        for i in range(0, len(filas), BULK_CHUNK):
+            chunk = filas[i:i + BULK_CHUNK]
+            if not db.in_transaction:
+                begin_immediate(db)
+            db.execute("SAVEPOINT bulk_chunk")
+            try:
+                insertados += _bulk_insertar_chunk(db, sql, [a_params(p) for _, p in chunk])
+            except sqlite3.IntegrityError:
+                # Alguna fila viola UNIQUE/CHECK: se deshace el chunk y se reintenta
+                # fila por fila (misma transacción) para identificar cuáles fallan
+                db.execute("ROLLBACK TO bulk_chunk")
+                for n, p in chunk:
+                    try:
+                        insertados += _bulk_insertar_chunk(db, sql, [a_params(p)])
+                    except sqlite3.IntegrityError as e:
+                        errores.append(BulkError(fila=n, error=f"Violación de integridad: {e}"))
+            db.execute("RELEASE bulk_chunk")
+            if atomico and errores:
+                db.rollback()
+                return []
+            if not atomico:
+                db.commit()
+        if db.in_transaction:
+            db.commit()
+    return insertados
+
+async def _bulk(request: Request, tabla: str, atomico: bool) -> JSONResponse:
+    modelo = _BULK[tabla][0]
+    filas: List[Tuple[int, Any]] = []
+    errores: List[BulkError] = []
+    n = 0
+    async for obj in _leer_lote(request, modelo):
+        n += 1
+        if n > BULK_MAX_FILAS:
+            raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_FILAS} filas por request")
+        if isinstance(obj, Exception):
+            errores.append(BulkError(fila=n, error=str(obj)))
+            continue
+        try:
+            filas.append((n, modelo.model_validate(obj)))
+        except ValidationError as e:
+            errores.append(BulkError(fila=n, error=_formatear_validacion(e)))
+
+    # La escritura va al threadpool y toma la conexión escritora recién ahora,
+    # no mientras el cliente todavía está subiendo el archivo.
+    insertados = [] if (atomico and errores) else await run_in_threadpool(_bulk_insertar, tabla, filas, errores, atomico)
+    errores.sort(key=lambda e: e.fila)
+    resultado = BulkResultado(recibidas=n, insertados=insertados, errores=errores)
+    status = 422 if (atomico and errores) else 200
+    return JSONResponse(status_code=status, content=resultado.model_dump())
+
+@app.post("/celdas/bulk", response_model=BulkResultado, tags=["Celdas"], openapi_extra=_bulk_openapi("CeldaIn"))
+async def crear_celdas_bulk(request: Request, atomico: bool = Query(False, description="Todo o nada")):
+    return await _bulk(request, "celdas", atomico)
+
+@app.post("/agentes/bulk", response_model=BulkResultado, tags=["Agentes"], openapi_extra=_bulk_openapi("AgenteIn"))
+async def crear_agentes_bulk(request: Request, atomico: bool = Query(False, description="Todo o nada")):
+    return await _bulk(request, "agentes", atomico)
+
+@app.post("/internos/bulk", response_model=BulkResultado, tags=["Internos"], openapi_extra=_bulk_openapi("InternoIn"))
+async def crear_internos_bulk(request: Request, atomico: bool = Query(False, description="Todo o nada")):
+    return await _bulk(request, "internos", atomico)
+
+# =========================
+# Transiciones masivas (POST /internos/transiciones)
+# =========================
+class TransicionIn(BaseModel):
+    # Selección: exactamente uno de ids / celda_id / pabellon
+    ids: Optional[List[int]] = Field(None, max_length=BULK_MAX_FILAS, description="Internos por id")
+    celda_id: Optional[int] = Field(None, description="Los Activos alojados en esta celda")
+    pabellon: Optional[PabellonStr] = Field(None, description="Los Activos alojados en este pabellón")
+    desde_estado: Optional[EstadoLiteral] = Field(None, description="Solo los que estén en este estado")
+    # Cambio
+    estado: EstadoLiteral = Field(..., description="Estado destino; si no es Activo se libera la celda")
+    celda_destino: Optional[int] = Field(None, description="Solo con estado Activo: mover la selección a esta celda")
+
+class TransicionResultado(BaseModel):
+    actualizados: int
+    ids: List[int]
+
+@app.post("/internos/transiciones", response_model=TransicionResultado, tags=["Internos"])
+def transicionar_internos(
+    payload: TransicionIn = Body(
         ...,
         examples={
-            "valido": {
-                "summary": "Válido",
-                "value": {"pabellon": "A", "numero": "1", "capacidad": 6}
+            "evacuar": {
+                "summary": "Trasladar a todo un pabellón",
+                "value": {"pabellon": "A", "estado": "Trasladado"}
             },
-            "duplicado": {
-                "summary": "Conflicto UNIQUE (pabellon+numero)",
-                "value": {"pabellon": "A", "numero": "1", "capacidad": 6}
+            "mudar": {
+                "summary": "Mover los ocupantes de una celda a otra",
+                "value": {"celda_id": 1, "estado": "Activo", "celda_destino": 2}
             }
         }
     ),
-    db: sqlite3.Connection = Depends(get_db),
 ):
+    """
+    Aplica un cambio de estado (y opcionalmente de celda) a toda la selección con un único
+    UPDATE, en una transacción: o cambian todos o ninguno. Los triggers mantienen los
+    contadores de ocupación y rechazan el lote entero si la celda destino no tiene lugar.
+    """
+    selectores = [s for s in (payload.ids, payload.celda_id, payload.pabellon) if s is not None]
+    if len(selectores) != 1:
+        raise HTTPException(status_code=400, detail="Indicar exactamente uno de: ids, celda_id, pabellon")
+    if payload.estado != 'Activo' and payload.celda_destino is not None:
+        raise HTTPException(status_code=400, detail="Un interno no Activo no puede tener celda asignada")
+
+    if payload.ids is not None:
+        ids = list(dict.fromkeys(payload.ids))
+        if not ids:
+            return {"actualizados": 0, "ids": []}
+        # json_each evita el límite de variables de SQLite con selecciones grandes
+        where, params = "id IN (SELECT value FROM json_each(?))", [json.dumps(ids)]
+    elif payload.celda_id is not None:
+        where, params = "estado = 'Activo' AND celda_id = ?", [payload.celda_id]
+    else:
+        where, params = ("estado = 'Activo' AND celda_id IN (SELECT id FROM celdas WHERE pabellon = ?)",
+                         [payload.pabellon])
+    if payload.desde_estado is not None:
+        where += " AND estado = ?"
+        params.append(payload.desde_estado)
+
+    if payload.estado != 'Activo':
+        nueva_celda, celda_params = "NULL", []
+    elif payload.celda_destino is not None:
+        nueva_celda, celda_params = "?", [payload.celda_destino]
+    else:
+        nueva_celda, celda_params = "celda_id", []
+    # Las filas que ya están en el destino no se tocan (ni disparan triggers)
+    where += f" AND NOT (estado = ? AND celda_id IS {nueva_celda})"
+    params += [payload.estado] + celda_params
+
+    def _op(db: sqlite3.Connection) -> List[int]:
+        if payload.celda_id is not None and not _celda_existe(db, payload.celda_id):
+            raise HTTPException(status_code=404, detail="Celda indicada no existe")
+        if payload.celda_destino is not None and not _celda_existe(db, payload.celda_destino):
+            raise HTTPException(status_code=404, detail="Celda destino no existe")
+        if payload.pabellon is not None and not db.execute(
+                "SELECT 1 FROM celdas WHERE pabellon = ? LIMIT 1", (payload.pabellon,)).fetchone():
+            raise HTTPException(status_code=404, detail="Pabellón sin celdas")
+        afectados = [r[0] for r in db.execute(f"SELECT id FROM internos WHERE {where} ORDER BY id", params)]
+        if afectados:
+            db.execute(f"UPDATE internos SET estado = ?, celda_id = {nueva_celda} WHERE {where}",
+                       [payload.estado] + celda_params + params)
+        return afectados
+
     try:
-        db.execute("""
-            INSERT INTO celdas (pabellon, numero, capacidad)
-            VALUES (?, ?, ?)
-        """, (payload.pabellon, payload.numero, payload.capacidad))
+        afectados = escribir(_op)
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
+    return {"actualizados": len(afectados), "ids": afectados}
+
+# =========================
+# Asignación de celdas (POST /internos/asignar)
+# =========================
+class AsignacionIn(BaseModel):
+    interno_ids: List[int] = Field(default_factory=list, description="Internos existentes, Activos y sin celda")
+    nuevos: List[InternoIn] = Field(default_factory=list, description="Ingresos a dar de alta y ubicar (celda_id se ignora)")
+    pabellones: Optional[List[PabellonStr]] = Field(None, description="Limitar a estos pabellones")
+    politica: Literal["llenar", "repartir"] = Field(
+        "llenar", description="llenar: completa primero las celdas más ocupadas; repartir: ocupación pareja")
+    parcial: bool = Field(False, description="Si faltan camas, ubicar los que entren en vez de fallar")
+
+class Asignacion(BaseModel):
+    interno_id: int
+    celda_id: int
+    pabellon: str
+    numero: str
+
+class AsignacionResultado(BaseModel):
+    asignados: List[Asignacion]
+    sin_asignar: List[int]
+    camas_libres_restantes: int
+
+def _camas_libres(db: sqlite3.Connection, pabellones: Optional[List[str]], politica: str) -> List[list]:
+    """
+    Heap de celdas con camas libres (desde contador_celda, sin recorrer internos).
+    Cada entrada es [prioridad, celda_id, pabellon, numero, capacidad, ocupados].
+    """
+    sql = """
+        SELECT cc.celda_id, cc.pabellon, c.numero, cc.capacidad, cc.ocupados
+        FROM contador_celda cc
+        JOIN celdas c ON c.id = cc.celda_id
+        WHERE cc.ocupados < cc.capacidad
+    """
+    params: List[Any] = []
+    if pabellones:
+        sql += f" AND cc.pabellon IN ({','.join('?' * len(pabellones))})"
+        params += pabellones
+    heap = [[_prioridad(politica, cap, occ), cid, pab, num, cap, occ]
+            for cid, pab, num, cap, occ in db.execute(sql, params)]
+    heapq.heapify(heap)
+    return heap
+
+def _prioridad(politica: str, capacidad: int, ocupados: int) -> tuple:
+    if politica == "llenar":
+        return (capacidad - ocupados,)          # menos camas libres primero
+    return (ocupados / capacidad, -(capacidad - ocupados))  # menor ocupación relativa primero
+
+def _asignar(heap: List[list], n: int, politica: str) -> List[Tuple[int, str, str]]:
+    """Toma hasta n camas del heap; O(n log celdas)."""
+    camas = []
+    while heap and len(camas) < n:
+        celda = heap[0]
+        _, cid, pab, num, cap, occ = celda
+        camas.append((cid, pab, num))
+        occ += 1
+        if occ < cap:
+            celda[0] = _prioridad(politica, cap, occ)
+            celda[5] = occ
+            heapq.heapreplace(heap, celda)
+        else:
+            heapq.heappop(heap)
+    return camas
+
+@app.post("/internos/asignar", response_model=AsignacionResultado, tags=["Internos"])
+def asignar_celdas(payload: AsignacionIn, db: sqlite3.Connection = Depends(get_db)):
+    if any(p.estado != 'Activo' for p in payload.nuevos):
+        raise HTTPException(status_code=400, detail="Solo se pueden ubicar internos en estado Activo")
+    ids = list(dict.fromkeys(payload.interno_ids))
+
+    begin_immediate(db)             # ocupación leída y escrita en la misma transacción
+    try:
+        validos = set()
+        for i in range(0, len(ids), BULK_CHUNK):
+            parte = ids[i:i + BULK_CHUNK]
+            validos.update(r[0] for r in db.execute(
+                f"SELECT id FROM internos WHERE id IN ({','.join('?' * len(parte))})"
+                " AND estado = 'Activo' AND celda_id IS NULL", parte))
+        invalidos = [i for i in ids if i not in validos]
+        if invalidos:
+            raise HTTPException(status_code=409, detail={
+                "mensaje": "Internos inexistentes, no Activos o ya ubicados",
+                "interno_ids": invalidos[:100]})
+
+        heap = _camas_libres(db, payload.pabellones, payload.politica)
+        libres = sum(c[4] - c[5] for c in heap)
+        pedidos = len(ids) + len(payload.nuevos)
+        if pedidos > libres and not payload.parcial:
+            raise HTTPException(status_code=409, detail=f"Camas insuficientes: se piden {pedidos}, hay {libres} libres")
+        camas = _asignar(heap, pedidos, payload.politica)
+
+        # Existentes primero, luego los nuevos; los que no entran quedan sin celda
+        asignados: List[Asignacion] = []
+        db.executemany("UPDATE internos SET celda_id = ? WHERE id = ?",
+                       [(cama[0], iid) for iid, cama in zip(ids, camas)])
+        asignados += [Asignacion(interno_id=iid, celda_id=c, pabellon=p, numero=n)
+                      for iid, (c, p, n) in zip(ids, camas)]
+        sin_asignar = ids[len(camas):]
+
+        camas_nuevos = camas[len(ids):]
+        if payload.nuevos:
+            _, sql, a_params = _BULK["internos"]
+            filas = []
+            for k, p in enumerate(payload.nuevos):
+                celda_id = camas_nuevos[k][0] if k < len(camas_nuevos) else None
+                filas.append(a_params(p.model_copy(update={"celda_id": celda_id})))
+            nuevos_ids: List[int] = []
+            for i in range(0, len(filas), BULK_CHUNK):
+                nuevos_ids += _bulk_insertar_chunk(db, sql, filas[i:i + BULK_CHUNK])
+            asignados += [Asignacion(interno_id=iid, celda_id=c, pabellon=p, numero=n)
+                          for iid, (c, p, n) in zip(nuevos_ids, camas_nuevos)]
+            sin_asignar += nuevos_ids[len(camas_nuevos):]
         db.commit()
     except sqlite3.IntegrityError as e:
+        db.rollback()
         raise HTTPException(status_code=409, detail=f"Violación de integridad: {e}")
+    except BaseException:
+        db.rollback()
+        raise
+    return AsignacionResultado(asignados=asignados, sin_asignar=sin_asignar,
+                               camas_libres_restantes=libres - len(camas))
 
-    row = db.execute("""
-        SELECT id, pabellon, numero, capacidad
-        FROM celdas
-        WHERE rowid = last_insert_rowid()
-    """).fetchone()
-    return dict(row)
+# =========================
+# Búsqueda (/buscar)
+# =========================
+class ResultadoBusqueda(BaseModel):
+    tipo: Literal["interno", "agente"]
+    id: int
+    nombre: str
+    apellido: str
+    dni: Optional[str] = None
+    causa: Optional[str] = None
+    legajo: Optional[str] = None
+    rank: float  # bm25: más negativo = más relevante
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def _fts_query(q: str) -> str:
+    """'pere jua' -> '"pere"* "jua"*': AND de prefijos, sin operadores FTS del usuario."""
+    tokens = _TOKEN_RE.findall(q)
+    return " ".join(f'"{t}"*' for t in tokens[:8])
+
+@app.get("/buscar", response_model=List[ResultadoBusqueda], tags=["Búsqueda"])
+def buscar(
+    q: str = Query(..., min_length=1, max_length=100, description="Texto o prefijos: nombre, apellido, dni, causa, legajo"),
+    tipo: Literal["todos", "internos", "agentes"] = "todos",
+    limit: int = Query(20, ge=1, le=100),
+    db: sqlite3.Connection = Depends(get_db_read),
+):
+    if not fts_disponible(db):
+        raise HTTPException(status_code=501, detail="Búsqueda no disponible: ejecutar /db/init con SQLite con FTS5")
+    match = _fts_query(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="La búsqueda no contiene términos")
+
+    resultados: List[ResultadoBusqueda] = []
+    if tipo in ("todos", "internos"):
+        rows = db.execute("""
+            SELECT i.id, i.nombre, i.apellido, i.dni, i.causa,
+                   bm25(internos_fts, 10.0, 10.0, 5.0, 1.0) AS rank
+            FROM internos_fts
+            JOIN internos i ON i.id = internos_fts.rowid
+            WHERE internos_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """, (match, limit)).fetchall()
+        resultados += [ResultadoBusqueda(tipo="interno", **dict(r)) for r in rows]
+    if tipo in ("todos", "agentes"):
+        rows = db.execute("""
+            SELECT a.id, a.nombre, a.apellido, a.legajo,
+                   bm25(agentes_fts, 10.0, 10.0, 5.0) AS rank
+            FROM agentes_fts
+            JOIN agentes a ON a.id = agentes_fts.rowid
+            WHERE agentes_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """, (match, limit)).fetchall()
+        resultados += [ResultadoBusqueda(tipo="agente", **dict(r)) for r in rows]
+
+    resultados.sort(key=lambda r: r.rank)
+    return resultados[:limit]
 
-@app.delete("/internos/{interno_id}", tags=["Internos"])
-def eliminar_interno(interno_id: int, db: sqlite3.Connection = Depends(get_db)):
-    cur = db.execute("DELETE FROM internos WHERE id = ?", (interno_id,))
-    db.commit()
-    if cur.rowcount == 0:
-        raise HTTPException(status_code=404, detail="Interno no encontrado")
-    return {"status": "ok", "deleted_id": interno_id}
 # =========================
 # Stats (/stats)
 # =========================
 from fastapi import Query
 from datetime import timedelta
 
+STATS_TABLAS = ("internos", "celdas", "agentes", "contadores")  # tablas que invalidan /stats
+
 @app.get("/stats", response_model=StatsResponse, tags=["Stats"])
 def get_stats(
     desde: Optional[date] = Query(None, description="YYYY-MM-DD (incluido)"),
     hasta: Optional[date] = Query(None, description="YYYY-MM-DD (incluido)"),
-    db: sqlite3.Connection = Depends(get_db),
+    incluir_archivo: bool = Query(False, description="Sumar internos archivados (más lento)"),
+    _etag: str = Depends(etag_tablas(*STATS_TABLAS, diario=True)),
+    db: sqlite3.Connection = Depends(get_db_read),
 ):
     # Rango por defecto: últimos 30 días hasta hoy
     if not hasta:
@@ -547,74 +1578,58 @@ def get_stats(
     if desde > hasta:
         raise HTTPException(status_code=400, detail="Parámetros inválidos: 'desde' no puede ser mayor que 'hasta'.")
 
-    cur = db.cursor()
-
-    # ---- Totales
-    cur.execute("SELECT COUNT(*) FROM internos")
-    total_internos = cur.fetchone()[0]
+    key = ("stats", desde, hasta, incluir_archivo, marca_cambios(db, *STATS_TABLAS))
+    return resultados.get_or_compute(key, lambda: _calcular_stats(db, desde, hasta, incluir_archivo))
 
-    cur.execute("SELECT COUNT(*) FROM celdas")
-    total_celdas = cur.fetchone()[0]
-
-    try:
-        cur.execute("SELECT COUNT(*) FROM agentes")
-        total_agentes = cur.fetchone()[0]
-    except Exception:
-        total_agentes = 0  # por si aún no existe la tabla
-
-    # ---- Capacidad
-    cur.execute("SELECT COALESCE(SUM(capacidad),0) FROM celdas")
-    capacidad_total = cur.fetchone()[0]
+def _calcular_stats(db: sqlite3.Connection, desde: date, hasta: date, incluir_archivo: bool = False) -> StatsResponse:
+    cur = db.cursor()
 
-    cur.execute("""
-        SELECT COUNT(*)
-        FROM internos
-        WHERE estado='Activo' AND celda_id IS NOT NULL
-    """)
-    camas_ocupadas = cur.fetchone()[0]
+    # ---- Totales y capacidad (contadores mantenidos por triggers, ver db.CONTADORES_SQL)
+    cur.execute("SELECT clave, valor FROM contadores")
+    contadores = dict(cur.fetchall())
+    total_internos = contadores.get("internos", 0)
+    total_celdas = contadores.get("celdas", 0)
+    total_agentes = contadores.get("agentes", 0)
+    capacidad_total = contadores.get("capacidad_total", 0)
+    camas_ocupadas = contadores.get("camas_ocupadas", 0)
 
     tasa_ocupacion = round((camas_ocupadas / capacidad_total), 3) if capacidad_total else 0.0
 
     # ---- Nuevos en rango
-    cur.execute("""
+    cur.execute(f"""
         SELECT COUNT(*)
-        FROM internos
-        WHERE date(fecha_ingreso) BETWEEN date(?) AND date(?)
+        FROM {internos_desde(incluir_archivo)} AS internos
+        WHERE fecha_ingreso BETWEEN ? AND ?
     """, (desde.isoformat(), hasta.isoformat()))
     nuevos_periodo = cur.fetchone()[0]
 
-    # ---- Por pabellón (a partir de celdas.pabellon)
+    # ---- Por pabellón
     cur.execute("""
-        SELECT c.pabellon,
-               SUM(c.capacidad) AS capacidad,
-               SUM(
-                   CASE
-                       WHEN i.estado='Activo' THEN 1
-                       ELSE 0
-                   END
-               ) AS ocupados
-        FROM celdas c
-        LEFT JOIN internos i ON i.celda_id = c.id
-        GROUP BY c.pabellon
-        ORDER BY c.pabellon
+        SELECT pabellon, capacidad, ocupados
+        FROM contador_pabellon
+        ORDER BY pabellon
     """)
     por_pabellon: List[PabellonStat] = []
     for pab, cap, occ in cur.fetchall():
-        cap = cap or 0
-        occ = occ or 0
         por = round((occ / cap), 3) if cap else 0.0
         por_pabellon.append(PabellonStat(pabellon=pab, capacidad=cap, ocupados=occ, ocupacion=por))
 
     # ---- Estados (Activo / Trasladado / Liberado)
-    cur.execute("SELECT estado, COUNT(*) FROM internos GROUP BY estado")
+    cur.execute("SELECT estado, n FROM contador_estado ORDER BY estado")
     estados = { (k or "Desconocido"): v for k, v in cur.fetchall() }
+    if incluir_archivo:
+        # Los archivados no están en los contadores (salieron de `internos`)
+        cur.execute("SELECT estado, COUNT(*) FROM archivo.internos GROUP BY estado")
+        for k, v in cur.fetchall():
+            estados[k] = estados.get(k, 0) + v
+            total_internos += v
 
     # ---- Últimos ingresos (10)
     cur.execute("""
         SELECT i.id, i.nombre, i.apellido, i.fecha_ingreso, c.pabellon, c.numero
         FROM internos i
         LEFT JOIN celdas c ON c.id = i.celda_id
-        ORDER BY date(i.fecha_ingreso) DESC, i.id DESC
+        ORDER BY i.fecha_ingreso DESC, i.id DESC
         LIMIT 10
     """)
     ultimos = [
@@ -633,17 +1648,265 @@ def get_stats(
         estados=estados,
         ultimos_ingresos=ultimos
     )
+
+@app.post("/stats/reconciliar", tags=["Stats"])
+def reconciliar_stats(db: sqlite3.Connection = Depends(get_db)):
+    """Reconstruye los contadores de /stats desde las tablas e informa los desvíos encontrados."""
+    desvios = reconciliar_contadores(db, commit=False)
+    marcar_cambio(db, "contadores")
+    db.commit()
+    return {"status": "ok", "desvios": desvios, "total": len(desvios)}
+
+# =========================
+# Histórico (/stats/historico)
+# =========================
+class HistoricoPabellon(BaseModel):
+    pabellon: str
+    capacidad: float        # promedio del período
+    ocupados: float         # promedio del período
+    ocupados_max: int
+    ocupacion: float        # 0..1, sobre los promedios
+
+class PuntoHistorico(BaseModel):
+    periodo: str            # inicio del período: el día, el lunes de la semana o el 1° del mes
+    dias: int               # días con foto dentro del período
+    capacidad: float
+    ocupados: float
+    tasa_ocupacion: float
+    por_pabellon: List[HistoricoPabellon]
+    estados: Dict[str, float]
+
+class HistoricoResponse(BaseModel):
+    granularidad: Granularidad
+    desde: str
+    hasta: str
+    puntos: List[PuntoHistorico]
+
+@app.get("/stats/historico", response_model=HistoricoResponse, tags=["Stats"])
+def stats_historico(
+    desde: Optional[date] = Query(None, description="YYYY-MM-DD (por defecto, un año antes de 'hasta')"),
+    hasta: Optional[date] = Query(None, description="YYYY-MM-DD (por defecto, hoy)"),
+    granularidad: Granularidad = "mes",
+    pabellon: Optional[str] = None,
+    _etag: str = Depends(etag_tablas("historico", diario=True)),
+    db: sqlite3.Connection = Depends(get_db_read),
+):
+    """Ocupación y estados por día, semana o mes, leídos de los rollups (sin recorrer internos)."""
+    if not hasta:
+        hasta = date.today()
+    if not desde:
+        desde = hasta - timedelta(days=365)
+    if desde > hasta:
+        raise HTTPException(status_code=400, detail="'desde' no puede ser mayor que 'hasta'")
+    # El período que contiene a 'desde' entra completo
+    rango = [granularidad, inicio_periodo(desde, granularidad).isoformat(), hasta.isoformat()]
+
+    sql = ("SELECT periodo, pabellon, dias, capacidad, ocupados, ocupados_max FROM historico_pabellon"
+           " WHERE granularidad = ? AND periodo BETWEEN ? AND ?")
+    params = list(rango)
+    if pabellon:
+        sql += " AND pabellon = ?"
+        params.append(pabellon)
+    puntos: Dict[str, Dict[str, Any]] = {}
+    def punto(periodo: str, dias: int) -> Dict[str, Any]:
+        p = puntos.setdefault(periodo, {"periodo": periodo, "dias": 0, "capacidad": 0.0, "ocupados": 0.0,
+                                        "por_pabellon": [], "estados": {}})
+        p["dias"] = max(p["dias"], dias)
+        return p
+
+    for periodo, pab, dias, cap, occ, occ_max in db.execute(sql + " ORDER BY periodo, pabellon", params):
+        p = punto(periodo, dias)
+        p["capacidad"] += cap
+        p["ocupados"] += occ
+        p["por_pabellon"].append(HistoricoPabellon(
+            pabellon=pab, capacidad=round(cap, 2), ocupados=round(occ, 2), ocupados_max=occ_max,
+            ocupacion=round(occ / cap, 3) if cap else 0.0))
+
+    if not pabellon:    # los estados no se desagregan por pabellón
+        for periodo, estado, dias, n in db.execute(
+            "SELECT periodo, estado, dias, n FROM historico_estado"
+            " WHERE granularidad = ? AND periodo BETWEEN ? AND ?", rango):
+            punto(periodo, dias)["estados"][estado] = round(n, 2)
+
+    resultado = []
+    for _, p in sorted(puntos.items()):
+        cap, occ = p["capacidad"], p["ocupados"]
+        resultado.append(PuntoHistorico(
+            **{**p, "capacidad": round(cap, 2), "ocupados": round(occ, 2)},
+            tasa_ocupacion=round(occ / cap, 3) if cap else 0.0))
+    return HistoricoResponse(granularidad=granularidad, desde=rango[1], hasta=rango[2], puntos=resultado)
+
+@app.post("/stats/snapshot", tags=["Stats"])
+def stats_snapshot():
+    """Toma ahora la foto del día (además de la periódica) y recalcula su semana y su mes."""
+    return {"status": "ok", **_snapshot()}
+
 # =========================
 # Reportes (/reportes)
 # =========================
+REPORTE_BATCH = 1000  # filas por fetchmany / chunk emitido
+
+REPORTE_CSV_HEADERS = [
+    "id","dni","nombre","apellido","fecha_ingreso","estado",
+    "celda_id","pabellon","celda_numero"
+]
+
+def _abrir_reporte(sql: str, params: List[Any], tuplas: bool = False) -> Tuple[ExitStack, sqlite3.Cursor]:
+    """
+    Toma la conexión lectora y ejecuta la consulta en el handler, antes de armar la
+    StreamingResponse: sin conexión (PoolTimeout) o con un error de SQL todavía se puede
+    responder 503/500 en lugar de cortar un 200 a medias. La conexión vive tanto como la
+    respuesta; la devuelve el generador al terminar o, si nunca arrancó, la tarea de fondo.
+    """
+    pila = ExitStack()
+    try:
+        conn = pila.enter_context(get_pool().connection(write=False))
+        cur = conn.cursor()
+        if tuplas:
+            cur.row_factory = None      # se transponen a columnas: no hace falta sqlite3.Row
+        cur.execute(sql, params)
+    except BaseException:
+        pila.close()
+        raise
+    return pila, cur
+
+def _iter_reporte(pila: ExitStack, cur: sqlite3.Cursor, formato: str):
+    """
+    Genera el reporte por lotes: lee con fetchmany y emite cada lote ya
+    formateado, así la memoria no depende de la cantidad de filas.
+    """
+    with pila:
+        cols = [d[0] for d in cur.description]
+
+        if formato == "csv":
+            buf = io.StringIO(newline="")
+            writer = csv.writer(buf)
+            writer.writerow(REPORTE_CSV_HEADERS)
+            yield buf.getvalue()
+        elif formato == "json":
+            yield "["
+
+        primero = True
+        while True:
+            batch = cur.fetchmany(REPORTE_BATCH)
+            if not batch:
+                break
+            if formato == "csv":
+                buf.seek(0)
+                buf.truncate()
+                writer.writerows(tuple(r) for r in batch)
+                yield buf.getvalue()
+            else:
+                dumps = [json.dumps(dict(zip(cols, r)), ensure_ascii=False, separators=(",", ":")) for r in batch]
+                if formato == "ndjson":
+                    yield "\n".join(dumps) + "\n"
+                else:
+                    yield ("" if primero else ",") + ",".join(dumps)
+            primero = False
+
+        if formato == "json":
+            yield "]"
+
+# --- Formatos columnares (Arrow IPC stream / Parquet), requieren pyarrow
+REPORTE_BATCH_COLUMNAR = 65_536   # filas por record batch / row group
+
+def _pyarrow():
+    """
+    Importa pyarrow recién con el primer reporte columnar: cargado al arrancar suma ~40 MB
+    de RSS a cada worker aunque nunca se pida arrow/parquet. Opcional: sin él, 501.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute  # noqa: F401  (pa.compute)
+        import pyarrow.parquet  # noqa: F401  (pa.parquet)
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Formato no disponible: falta instalar pyarrow")
+    return pa
+
+def _esquema_reporte(pa) -> "pa.Schema":
+    return pa.schema([
+        ("id", pa.int64()),
+        ("dni", pa.string()),
+        ("nombre", pa.string()),
+        ("apellido", pa.string()),
+        ("fecha_ingreso", pa.date32()),
+        ("estado", pa.dictionary(pa.int8(), pa.string())),
+        ("celda_id", pa.int64()),
+        ("pabellon", pa.string()),
+        ("celda_numero", pa.string()),
+    ])
+
+class _SalidaPorPartes(io.RawIOBase):
+    """Sumidero para los writers de pyarrow: acumula lo escrito hasta que el generador lo emite."""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._partes.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:      # ParquetWriter lo consulta; no hay seek
+        return self._pos
+
+    def vaciar(self) -> bytes:
+        data = b"".join(self._partes)
+        self._partes.clear()
+        return data
+
+def _lote_arrow(pa, filas: List[tuple], esquema: "pa.Schema") -> "pa.RecordBatch":
+    cols = list(zip(*filas))
+    # Diccionario fijo de estados: igual en todos los lotes, sin reemplazos en el stream
+    estados = pa.array(get_args(EstadoLiteral))
+    return pa.record_batch([
+        pa.array(cols[0], pa.int64()),
+        pa.array(cols[1], pa.string()),
+        pa.array(cols[2], pa.string()),
+        pa.array(cols[3], pa.string()),
+        pa.array(cols[4], pa.string()).cast(pa.date32()),     # ISO garantizado por trg_internos_fecha_*
+        pa.DictionaryArray.from_arrays(
+            pa.compute.index_in(pa.array(cols[5], pa.string()), value_set=estados).cast(pa.int8()), estados),
+        pa.array(cols[6], pa.int64()),
+        pa.array(cols[7], pa.string()),
+        pa.array(cols[8], pa.string()),
+    ], schema=esquema)
+
+def _iter_reporte_columnar(pa, pila: ExitStack, cur: sqlite3.Cursor, formato: str):
+    """Como _iter_reporte, pero arma record batches tipados y emite lo que el writer va produciendo."""
+    esquema = _esquema_reporte(pa)
+    salida = _SalidaPorPartes()
+    with pila:
+        if formato == "arrow":
+            opciones = pa.ipc.IpcWriteOptions(compression="zstd")
+            writer = pa.ipc.new_stream(salida, esquema, options=opciones)
+        else:
+            writer = pa.parquet.ParquetWriter(salida, esquema, compression="zstd")
+        try:
+            while True:
+                batch = cur.fetchmany(REPORTE_BATCH_COLUMNAR)
+                if not batch:
+                    break
+                writer.write_batch(_lote_arrow(pa, batch, esquema))
+                datos = salida.vaciar()
+                if datos:
+                    yield datos
+        finally:
+            writer.close()      # fin de stream (Arrow) o footer (Parquet)
+    yield salida.vaciar()
+
 @app.get("/reportes/internos", tags=["Reportes"])
 def reporte_internos(
-    formato: Literal["csv", "json"] = "csv",
+    formato: Literal["csv", "json", "ndjson", "arrow", "parquet"] = "csv",
     desde: Optional[date] = None,
     hasta: Optional[date] = None,
     estado: Optional[EstadoLiteral] = None,     # 'Activo', 'Trasladado', 'Liberado'
     pabellon: Optional[str] = None,             # ej: 'A'
-    db: sqlite3.Connection = Depends(get_db),
+    incluir_archivo: bool = False,              # sumar internos archivados
 ):
     # Rango por defecto: últimos 30 días
     if not hasta:
@@ -654,13 +1917,13 @@ def reporte_internos(
         raise HTTPException(status_code=400, detail="'desde' no puede ser mayor que 'hasta'")
 
     # Query base
-    sql = """
+    sql = f"""
         SELECT i.id, i.dni, i.nombre, i.apellido, i.fecha_ingreso, i.estado,
                i.celda_id,
                c.pabellon, c.numero
-        FROM internos i
+        FROM {internos_desde(incluir_archivo)} AS i
         LEFT JOIN celdas c ON c.id = i.celda_id
-        WHERE date(i.fecha_ingreso) BETWEEN date(?) AND date(?)
+        WHERE i.fecha_ingreso BETWEEN ? AND ?
     """
     params: list[Any] = [desde.isoformat(), hasta.isoformat()]
 
@@ -671,33 +1934,272 @@ def reporte_internos(
         sql += " AND c.pabellon = ?"
         params.append(pabellon)
 
-    sql += " ORDER BY date(i.fecha_ingreso) DESC, i.apellido, i.nombre, i.id DESC"
+    sql += " ORDER BY i.fecha_ingreso DESC, i.apellido, i.nombre, i.id DESC"
 
-    rows = db.execute(sql, params).fetchall()
-    data = [dict(r) for r in rows]
-
-    # Si pide JSON
+    columnar = formato in ("arrow", "parquet")
+    pa = _pyarrow() if columnar else None       # 501 antes de tomar la conexión
+    pila, cur = _abrir_reporte(sql, params, tuplas=columnar)
+    cerrar = BackgroundTask(pila.close)         # no-op si el generador ya la devolvió
     if formato == "json":
-        return JSONResponse(content=data)
+        return StreamingResponse(_iter_reporte(pila, cur, formato), media_type="application/json", background=cerrar)
 
-    # Si pide CSV
-    headers = [
-        "id","dni","nombre","apellido","fecha_ingreso","estado",
-        "celda_id","pabellon","celda_numero"
-    ]
-    buf = io.StringIO(newline="")
-    writer = csv.writer(buf)
-    writer.writerow(headers)
-    for r in data:
-        writer.writerow([
-            r["id"], r["dni"], r["nombre"], r["apellido"], r["fecha_ingreso"], r["estado"],
-            r["celda_id"], r["pabellon"], r["numero"]
-        ])
-    buf.seek(0)
-    filename = f"reporte_internos_{desde.isoformat()}_{hasta.isoformat()}.csv"
+    if columnar:
+        generador = _iter_reporte_columnar(pa, pila, cur, formato)
+    else:
+        generador = _iter_reporte(pila, cur, formato)
+
+    ext, media_type = {
+        "csv": ("csv", "text/csv"),
+        "ndjson": ("ndjson", "application/x-ndjson"),
+        "arrow": ("arrows", "application/vnd.apache.arrow.stream"),
+        "parquet": ("parquet", "application/vnd.apache.parquet"),
+    }[formato]
+    filename = f"reporte_internos_{desde.isoformat()}_{hasta.isoformat()}.{ext}"
+
+    return StreamingResponse(
+        generador,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        background=cerrar,
+    )
 
+# =========================
+# Feed de cambios (GET /eventos, Server-Sent Events)
+# =========================
+# Un solo Difusor por proceso consulta la tabla `eventos` cada EVENTOS_INTERVALO (en reposo,
+# un MAX(id) sobre la clave primaria) y reparte cada lote ya formateado a las colas de los
+# suscriptores. Un suscriptor inactivo es una corutina y una cola en el event loop: no
+# ocupa hilos ni conexiones, así que miles de tableros abiertos no cargan la base.
+EVENTOS_INTERVALO = float(os.environ.get("PENITENCIARIO_EVENTOS_INTERVALO", 0.5))   # segundos
+EVENTOS_MAX_SUSCRIPTORES = int(os.environ.get("PENITENCIARIO_EVENTOS_MAX_SUSCRIPTORES", 10_000))
+EVENTOS_KEEPALIVE = 15.0    # comentario SSE para que proxies no corten la conexión
+EVENTOS_PENDIENTES = 256    # lotes sin leer tolerados; más atrás, se corta y el cliente retoma
+EVENTOS_LOTE = 1000
+EVENTOS_PODA = 60.0         # segundos entre podas de la tabla
+TablaEvento = Literal["celdas", "agentes", "internos"]
+
+def _sse(evento: str, data: Any, id_: Optional[int] = None) -> bytes:
+    cabecera = f"id: {id_}\nevent: {evento}\n" if id_ is not None else f"event: {evento}\n"
+    return cabecera.encode() + b"data: " + dumps(data) + b"\n\n"
+
+def _sse_cambio(fila) -> Tuple[int, str, bytes]:
+    id_, ts, tabla, op, fila_id = fila
+    return id_, tabla, _sse("cambio", {"id": id_, "ts": ts, "tabla": tabla, "op": op, "fila_id": fila_id}, id_)
+
+def _leer_ocupacion(db: sqlite3.Connection) -> Dict[str, Tuple[int, int]]:
+    return {p: (cap, occ) for p, cap, occ in db.execute(
+        "SELECT pabellon, capacidad, ocupados FROM contador_pabellon ORDER BY pabellon")}
+
+def _sse_ocupacion(ocupacion: Dict[str, Tuple[int, int]], previa: Optional[Dict[str, Tuple[int, int]]] = None,
+                   id_: Optional[int] = None) -> Optional[bytes]:
+    """Pabellones cuyo conteo cambió respecto de `previa` (todos si no hay previa), con el delta."""
+    filas = []
+    for pab in sorted(ocupacion.keys() | (previa or {}).keys()):
+        cap, occ = ocupacion.get(pab, (0, 0))
+        if previa is None:
+            filas.append({"pabellon": pab, "capacidad": cap, "ocupados": occ})
+        elif previa.get(pab) != (cap, occ):
+            filas.append({"pabellon": pab, "capacidad": cap, "ocupados": occ, "delta": occ - previa.get(pab, (0, 0))[1]})
+    return _sse("ocupacion", filas, id_) if filas else None
+
+class LoteEventos:
+    """Lo que el Difusor leyó en un ciclo: eventos (id, tabla, bytes) ya formateados."""
+    __slots__ = ("desde", "eventos", "todo", "ocupacion", "reinicio")
+
+    def __init__(self, desde: int, eventos: List[Tuple[int, str, bytes]], ocupacion: Optional[bytes] = None,
+                 reinicio: bool = False):
+        self.desde = desde
+        self.eventos = eventos
+        self.todo = b"".join(e[2] for e in eventos)
+        self.ocupacion = ocupacion
+        self.reinicio = reinicio
+
+class Difusor:
+    def __init__(self):
+        self.suscriptores: set = set()
+        self.ultimo: Optional[int] = None                  # último id repartido
+        self.ocupacion: Dict[str, Tuple[int, int]] = {}
+        self.lotes = 0
+        self.cortados = 0
+        self._ocupacion_pendiente = False       # hubo cambios de ocupación aún no leída
+
+    def suscribir(self) -> asyncio.Queue:
+        cola: asyncio.Queue = asyncio.Queue()
+        self.suscriptores.add(cola)
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue) -> None:
+        self.suscriptores.discard(cola)
+
+    def _repartir(self, lote: LoteEventos) -> None:
+        self.lotes += 1
+        for cola in list(self.suscriptores):
+            if cola.qsize() >= EVENTOS_PENDIENTES:
+                # Cliente lento: se lo corta en vez de acumular memoria; retoma con Last-Event-ID
+                self.suscriptores.discard(cola)
+                self.cortados += 1
+                cola.put_nowait(None)
+            else:
+                cola.put_nowait(lote)
+
+    def _leer(self, ultimo: Optional[int], pendiente: bool = False
+              ) -> Tuple[int, List[tuple], Optional[Dict[str, Tuple[int, int]]]]:
+        """
+        Un lote de eventos y, si el lote llega al último, la ocupación: todo en una misma
+        transacción de lectura. Con más de EVENTOS_LOTE pendientes, la ocupación de ahora ya
+        incluiría eventos que no salieron; se lee recién con el lote que alcanza a `maximo`
+        (`pendiente`: lotes anteriores traían cambios que la afectan).
+        """
+        with get_pool().connection(write=False) as db:
+            db.execute("BEGIN")
+            try:
+                maximo = db.execute("SELECT COALESCE(MAX(id), 0) FROM eventos").fetchone()[0]
+                if ultimo is None or maximo < ultimo:       # arranque, o base restaurada desde un respaldo
+                    return maximo, [], _leer_ocupacion(db)
+                if maximo == ultimo:
+                    return ultimo, [], None
+                filas = [tuple(f) for f in db.execute(
+                    "SELECT id, ts, tabla, op, fila_id FROM eventos WHERE id > ? ORDER BY id LIMIT ?",
+                    (ultimo, EVENTOS_LOTE))]
+                cambia = pendiente or any(f[2] != "agentes" for f in filas)
+                ocupacion = _leer_ocupacion(db) if cambia and filas[-1][0] == maximo else None
+                return filas[-1][0], filas, ocupacion
+            finally:
+                db.rollback()
+
+    async def ciclo(self) -> None:
+        previo = self.ultimo
+        ultimo, filas, ocupacion = await run_in_threadpool(self._leer, previo, self._ocupacion_pendiente)
+        if previo is not None and ultimo < previo:
+            self._repartir(LoteEventos(ultimo, [], _sse_ocupacion(ocupacion), reinicio=True))
+        elif filas:
+            self._repartir(LoteEventos(previo, [_sse_cambio(f) for f in filas],
+                                       _sse_ocupacion(ocupacion, self.ocupacion) if ocupacion is not None else None))
+        self.ultimo = ultimo
+        self._ocupacion_pendiente = ocupacion is None and (
+            self._ocupacion_pendiente or any(f[2] != "agentes" for f in filas))
+        if ocupacion is not None:
+            self.ocupacion = ocupacion
+
+    async def correr(self) -> None:
+        ultima_poda = time.monotonic()
+        while True:
+            try:
+                await self.ciclo()
+                if time.monotonic() - ultima_poda > EVENTOS_PODA:
+                    ultima_poda = time.monotonic()
+                    await run_in_threadpool(escribir, podar_eventos)
+            except (sqlite3.Error, PoolTimeout):
+                pass        # base sin migrar u ocupada: se reintenta en el próximo ciclo
+            await asyncio.sleep(EVENTOS_INTERVALO)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"suscriptores": len(self.suscriptores), "ultimo_id": self.ultimo,
+                "lotes": self.lotes, "cortados": self.cortados}
+
+difusor = Difusor()
+
+def _metricas_eventos():
+    yield f"eventos_suscriptores {len(difusor.suscriptores)}"
+    yield f"eventos_lotes_total {difusor.lotes}"
+    yield f"eventos_cortados_total {difusor.cortados}"
+
+metricas.add_collector(_metricas_eventos)
+
+def _estado_actual() -> Tuple[int, Dict[str, Tuple[int, int]]]:
+    """Último id de `eventos` y ocupación leídos en una misma transacción: la foto coincide con el id."""
+    with get_pool().connection(write=False) as db:
+        db.execute("BEGIN")
+        try:
+            maximo = db.execute("SELECT COALESCE(MAX(id), 0) FROM eventos").fetchone()[0]
+            return maximo, _leer_ocupacion(db)
+        finally:
+            db.rollback()
+
+def _historial(desde: int, hasta: int) -> Tuple[bool, List[tuple]]:
+    """Eventos (desde, hasta] para ponerse al día; False si ya se podaron o la base se restauró."""
+    with get_pool().connection(write=False) as db:
+        minimo, maximo = db.execute("SELECT MIN(id), MAX(id) FROM eventos").fetchone()
+        if desde > (maximo or 0) or (minimo is not None and minimo > desde + 1):
+            return False, []
+        return True, [tuple(f) for f in db.execute(
+            "SELECT id, ts, tabla, op, fila_id FROM eventos WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+            (desde, hasta, EVENTOS_LOTE))]
+
+async def _stream_eventos(cola: asyncio.Queue, desde: Optional[int], tablas: Optional[set],
+                          seguir: bool) -> AsyncIterator[bytes]:
+    try:
+        # Estado inicial leído de la base, no del Difusor (que va hasta EVENTOS_INTERVALO atrás):
+        # ocupación completa, con el id desde el que sigue el stream. La cola ya está suscripta,
+        # así que lo posterior a `ultimo` llega por ella; lo anterior se descarta por id.
+        ultimo, ocupacion = await run_in_threadpool(_estado_actual)
+        yield b"retry: 2000\n\n" + (_sse_ocupacion(ocupacion, None, ultimo) or _sse("ocupacion", [], ultimo))
+        if desde is not None and desde > ultimo:
+            # Id de antes de una restauración (o inventado): no hay forma de retomar
+            yield _sse("reinicio", {"motivo": "historial no disponible: recargar el estado completo"})
+        elif desde is not None:
+            # Ponerse al día desde la tabla hasta `ultimo`
+            while desde < ultimo:
+                completo, filas = await run_in_threadpool(_historial, desde, ultimo)
+                if not completo:
+                    yield _sse("reinicio", {"motivo": "historial no disponible: recargar el estado completo"})
+                    break
+                if not filas:
+                    break
+                yield b"".join(b for i, t, b in map(_sse_cambio, filas) if tablas is None or t in tablas)
+                desde = filas[-1][0]
+        enviado = ultimo
+        if not seguir:
+            return
+        while True:
+            try:
+                lote = await asyncio.wait_for(cola.get(), EVENTOS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if lote is None:
+                return      # cortado por lento
+            if lote.reinicio:
+                enviado = lote.desde
+                yield _sse("reinicio", {"motivo": "base restaurada: recargar el estado completo"})
+            elif lote.desde >= enviado and tablas is None:
+                yield lote.todo
+            else:
+                yield b"".join(b for i, t, b in lote.eventos if i > enviado and (tablas is None or t in tablas))
+            if lote.eventos:
+                enviado = max(enviado, lote.eventos[-1][0])
+            if lote.ocupacion:
+                yield lote.ocupacion
+    finally:
+        difusor.desuscribir(cola)
+
+@app.get("/eventos", tags=["Sistema"], response_class=StreamingResponse)
+async def eventos(
+    request: Request,
+    tablas: Optional[List[TablaEvento]] = Query(None, description="Solo cambios de estas tablas"),
+    desde: Optional[int] = Query(None, ge=0, description="Retomar después de este id (o header Last-Event-ID)"),
+    seguir: bool = Query(True, description="False: enviar lo pendiente desde `desde` y cerrar"),
+):
+    """
+    Stream SSE de cambios. `event: cambio` trae {id, ts, tabla, op, fila_id} por cada alta,
+    cambio o baja; `event: ocupacion` trae los pabellones cuyo conteo cambió, con el delta
+    (al conectar, la ocupación completa). Con Last-Event-ID se reciben primero los cambios
+    perdidos; si ya no están en la tabla llega `event: reinicio` y hay que recargar todo.
+    """
+    ultimo_id = request.headers.get("last-event-id")
+    if ultimo_id is not None:
+        try:
+            desde = int(ultimo_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID inválido")
+    if difusor.ultimo is None:
+        raise HTTPException(status_code=503, detail="Feed de eventos no disponible (base sin migrar)",
+                            headers={"Retry-After": "5"})
+    if len(difusor.suscriptores) >= EVENTOS_MAX_SUSCRIPTORES:
+        raise HTTPException(status_code=503, detail="Demasiados suscriptores", headers={"Retry-After": "5"})
+    cola = difusor.suscribir()
     return StreamingResponse(
-        buf,
-        media_type="text/csv",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        _stream_eventos(cola, desde, set(tablas) if tablas else None, seguir),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
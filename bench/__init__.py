@@ -0,0 +1,10 @@
+"""
+Benchmarks reproducibles de la API.
+
+    python -m bench seed --escala 100k            # genera (o reutiliza) el dataset
+    python -m bench run --escala 10k              # corre todas las rutas y compara con el baseline
+    python -m bench run --escala 10k --guardar    # actualiza bench/baselines/10k.json
+    python -m bench serializacion                 # JSON rápido vs. validación de FastAPI, por 10k filas
+
+El dataset se genera con semilla fija: la misma escala produce siempre los mismos datos.
+"""
@@ -0,0 +1,63 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from bench.seed import ESCALAS, SEMILLA, generar, ruta_dataset
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmarks de la API del Servicio Penitenciario")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_seed = sub.add_parser("seed", help="Genera el dataset sintético de una escala")
+    p_seed.add_argument("--escala", choices=sorted(ESCALAS), default="10k")
+    p_seed.add_argument("--semilla", type=int, default=SEMILLA)
+    p_seed.add_argument("--db", type=Path, help="Ruta de salida (por defecto, el directorio temporal del sistema)")
+
+    p_run = sub.add_parser("run", help="Corre los escenarios y compara con el baseline")
+    p_run.add_argument("--escala", choices=sorted(ESCALAS), default="10k")
+    p_run.add_argument("--semilla", type=int, default=SEMILLA)
+    p_run.add_argument("--factor", type=float, default=1.0, help="Multiplica las iteraciones de cada escenario")
+    p_run.add_argument("--solo", nargs="+", metavar="ESCENARIO", help="Correr solo estos escenarios")
+    p_run.add_argument("--umbral", type=float, default=None, help="Regresión tolerada sobre el p95 (0.5 = 50%%)")
+    p_run.add_argument("--guardar", action="store_true", help="Guardar el resultado como nuevo baseline")
+    p_run.add_argument("--salida", type=Path, help="Escribir el resultado completo en este JSON")
+    p_ser = sub.add_parser("serializacion", help="Microbenchmark del JSON rápido contra la validación de FastAPI")
+    p_ser.add_argument("--filas", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    if args.comando == "serializacion":
+        from bench.serializacion import micro
+        print(json.dumps(micro(args.filas), ensure_ascii=False, indent=2))
+        return 0
+
+    if args.comando == "seed":
+        path = args.db or ruta_dataset(args.escala, args.semilla)
+        tiempos = generar(path, ESCALAS[args.escala], args.semilla)
+        print(json.dumps({"db": str(path), **tiempos}, ensure_ascii=False))
+        return 0
+
+    from bench.run import UMBRAL, comparar, correr, guardar_baseline, ruta_baseline, tabla
+
+    resultado = correr(args.escala, args.semilla, args.factor, args.solo)
+    base_path = ruta_baseline(args.escala)
+    base = json.loads(base_path.read_text(encoding="utf-8")) if base_path.exists() else None
+    print(tabla(resultado, base))
+    if args.salida:
+        args.salida.write_text(json.dumps(resultado, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    if args.guardar:
+        print(f"Baseline guardado en {guardar_baseline(resultado)}")
+        return 0
+    if base is None:
+        print(f"Sin baseline para {args.escala}: correr con --guardar para crearlo")
+        return 0
+    regresiones = comparar(resultado, base, UMBRAL if args.umbral is None else args.umbral)
+    for r in regresiones:
+        print(f"REGRESIÓN {r}", file=sys.stderr)
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,343 @@
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bench.seed import ESCALAS, FECHA_REFERENCIA, SEMILLA, ruta_dataset
+
+BASELINES_DIR = Path(__file__).resolve().parent / "baselines"
+UMBRAL = 0.5        # regresión: p95 más de un 50% por encima del baseline...
+PISO_MS = 2.0       # ...y al menos 2 ms más lento (debajo de eso es ruido del scheduler)
+MIN_MUESTRAS_P95 = 50
+
+
+# =========================
+# Contexto compartido entre escenarios
+# =========================
+@dataclass
+class Contexto:
+    rng: random.Random
+    interno_ids: List[int]
+    celda_ids: List[int]
+    agente_ids: List[int]
+    apellidos: List[str]
+    pabellones: List[str]
+    creados: Dict[str, List[int]] = field(default_factory=lambda: {"celdas": [], "agentes": [], "internos": []})
+    secuencia: int = 0
+
+    def siguiente(self) -> int:
+        self.secuencia += 1
+        return self.secuencia
+
+    def ventana(self, dias: int = 30) -> Dict[str, str]:
+        hasta = FECHA_REFERENCIA - timedelta(days=self.rng.randrange(365))
+        return {"desde": (hasta - timedelta(days=dias)).isoformat(), "hasta": hasta.isoformat()}
+
+
+def _contexto(path: Path, semilla: int) -> Contexto:
+    conn = sqlite3.connect(path)
+    try:
+        muestra = lambda sql: [r[0] for r in conn.execute(sql)]
+        return Contexto(
+            rng=random.Random(semilla),
+            interno_ids=muestra("SELECT id FROM internos ORDER BY random() LIMIT 2000"),
+            celda_ids=muestra("SELECT id FROM celdas ORDER BY random() LIMIT 2000"),
+            agente_ids=muestra("SELECT id FROM agentes ORDER BY random() LIMIT 2000"),
+            apellidos=muestra("SELECT DISTINCT apellido FROM internos"),
+            pabellones=muestra("SELECT DISTINCT pabellon FROM celdas"),
+        )
+    finally:
+        conn.close()
+
+
+# =========================
+# Escenarios: uno o más por ruta de app.py
+# =========================
+@dataclass
+class Escenario:
+    nombre: str
+    metodo: str
+    ruta: str                                       # plantilla tal como figura en app.routes
+    request: Callable[[Contexto], Dict[str, Any]]   # kwargs para TestClient.request (url, params, json, ...)
+    iteraciones: int = 200
+    esperado: Tuple[int, ...] = (200,)
+
+def _celda_nueva(ctx: Contexto) -> Dict[str, Any]:
+    return {"pabellon": "BENCH", "numero": str(ctx.siguiente()), "capacidad": ctx.rng.randint(1, 12)}
+
+def _agente_nuevo(ctx: Contexto) -> Dict[str, Any]:
+    return {"legajo": f"BENCH-{ctx.siguiente()}", "nombre": "Bench", "apellido": ctx.rng.choice(ctx.apellidos),
+            "rango": "Oficial", "activo": True}
+
+def _interno_nuevo(ctx: Contexto, estado: str = "Liberado") -> Dict[str, Any]:
+    return {"dni": str(900_000_000 + ctx.siguiente()), "nombre": "Bench", "apellido": ctx.rng.choice(ctx.apellidos),
+            "fecha_ingreso": FECHA_REFERENCIA.isoformat(), "estado": estado, "causa": "Hurto", "condena_meses": 12}
+
+def _ultimo_respaldo() -> str:
+    from db import listar_respaldos
+    respaldos = listar_respaldos()
+    return respaldos[0]["archivo"] if respaldos else "inexistente.db"
+
+def _pop(ctx: Contexto, tabla: str) -> int:
+    return ctx.creados[tabla].pop() if ctx.creados[tabla] else 0
+
+ESCENARIOS: List[Escenario] = [
+    # --- Sistema / base de datos
+    Escenario("health", "GET", "/health", lambda c: {"url": "/health"}),
+    Escenario("metrics", "GET", "/metrics", lambda c: {"url": "/metrics"}, iteraciones=50),
+    Escenario("db_health", "GET", "/db/health", lambda c: {"url": "/db/health"}, iteraciones=50),
+    Escenario("db_tables", "GET", "/db/tables", lambda c: {"url": "/db/tables", "params": {"count_mode": "estimated"}}),
+    Escenario("db_indexes", "GET", "/db/indexes", lambda c: {"url": "/db/indexes"}, iteraciones=50),
+    Escenario("db_cache", "GET", "/db/cache", lambda c: {"url": "/db/cache"}, iteraciones=50),
+    Escenario("db_pool", "GET", "/db/pool", lambda c: {"url": "/db/pool"}, iteraciones=50),
+    Escenario("db_admision", "GET", "/db/admision", lambda c: {"url": "/db/admision"}, iteraciones=50),
+    # El stream queda abierto: se mide ponerse al día desde el principio y cerrar
+    Escenario("eventos_historial", "GET", "/eventos",
+              lambda c: {"url": "/eventos", "params": {"desde": 0, "seguir": False}}, iteraciones=50),
+    Escenario("db_init", "POST", "/db/init", lambda c: {"url": "/db/init"}, iteraciones=5),
+    Escenario("db_indexes_crear", "POST", "/db/indexes", lambda c: {"url": "/db/indexes"}, iteraciones=5),
+    Escenario("db_backup", "POST", "/db/backup",
+              lambda c: {"url": "/db/backup", "params": {"esperar": True, "pausa": 0}}, iteraciones=3),
+    Escenario("db_backup_estado", "GET", "/db/backup/{respaldo_id}", lambda c: {"url": "/db/backup/inexistente"},
+              iteraciones=20, esperado=(404,)),
+    Escenario("db_backups", "GET", "/db/backups", lambda c: {"url": "/db/backups"}, iteraciones=20),
+    Escenario("db_restore", "POST", "/db/restore",
+              lambda c: {"url": "/db/restore", "params": {"archivo": _ultimo_respaldo()}}, iteraciones=3),
+    # --- Lecturas
+    Escenario("celdas_listar", "GET", "/celdas",
+              lambda c: {"url": "/celdas", "params": {"pabellon": c.rng.choice(c.pabellones)}}),
+    Escenario("celdas_obtener", "GET", "/celdas/{celda_id}",
+              lambda c: {"url": f"/celdas/{c.rng.choice(c.celda_ids)}"}),
+    Escenario("agentes_listar", "GET", "/agentes",
+              lambda c: {"url": "/agentes", "params": {"apellido": c.rng.choice(c.apellidos)}}),
+    Escenario("agentes_obtener", "GET", "/agentes/{agente_id}",
+              lambda c: {"url": f"/agentes/{c.rng.choice(c.agente_ids)}"}),
+    Escenario("internos_listar", "GET", "/internos", lambda c: {"url": "/internos", "params": {"limit": 100}}),
+    Escenario("internos_listar_filtro", "GET", "/internos",
+              lambda c: {"url": "/internos", "params": {"apellido": c.rng.choice(c.apellidos), "estado": "Activo"}}),
+    Escenario("internos_listar_archivo", "GET", "/internos",
+              lambda c: {"url": "/internos", "params": {"apellido": c.rng.choice(c.apellidos), "incluir_archivo": True}}),
+    Escenario("internos_multiget", "GET", "/internos",
+              lambda c: {"url": "/internos", "params": {"ids": c.rng.sample(c.interno_ids, 50)}}),
+    Escenario("internos_por_celdas", "GET", "/internos",
+              lambda c: {"url": "/internos", "params": {"celda_ids": c.rng.sample(c.celda_ids, 20), "estado": "Activo"}}),
+    Escenario("pabellon_ocupacion", "GET", "/pabellones/{pabellon}/ocupacion",
+              lambda c: {"url": f"/pabellones/{c.rng.choice(c.pabellones)}/ocupacion"}),
+    Escenario("internos_obtener", "GET", "/internos/{interno_id}",
+              lambda c: {"url": f"/internos/{c.rng.choice(c.interno_ids)}"}),
+    Escenario("buscar", "GET", "/buscar",
+              lambda c: {"url": "/buscar", "params": {"q": c.rng.choice(c.apellidos)[:4]}}),
+    Escenario("stats", "GET", "/stats", lambda c: {"url": "/stats", "params": c.ventana()}),
+    Escenario("stats_archivo", "GET", "/stats", lambda c: {"url": "/stats", "params": {**c.ventana(), "incluir_archivo": True}}),
+    Escenario("reporte_csv", "GET", "/reportes/internos",
+              lambda c: {"url": "/reportes/internos", "params": {**c.ventana(), "formato": "csv"}}, iteraciones=20),
+    Escenario("reporte_json", "GET", "/reportes/internos",
+              lambda c: {"url": "/reportes/internos", "params": {**c.ventana(), "formato": "json"}}, iteraciones=20),
+    Escenario("reporte_arrow", "GET", "/reportes/internos",
+              lambda c: {"url": "/reportes/internos", "params": {**c.ventana(), "formato": "arrow"}},
+              iteraciones=20, esperado=(200, 501)),
+    Escenario("reporte_parquet", "GET", "/reportes/internos",
+              lambda c: {"url": "/reportes/internos", "params": {**c.ventana(), "formato": "parquet"}},
+              iteraciones=20, esperado=(200, 501)),
+    # --- Escrituras: alta, modificación y baja sobre las mismas filas
+    Escenario("celdas_crear", "POST", "/celdas", lambda c: {"url": "/celdas", "json": _celda_nueva(c)}, iteraciones=100),
+    Escenario("celdas_actualizar", "PUT", "/celdas/{celda_id}",
+              lambda c: {"url": f"/celdas/{c.rng.choice(c.creados['celdas'])}", "json": _celda_nueva(c)}, iteraciones=100),
+    Escenario("celdas_eliminar", "DELETE", "/celdas/{celda_id}",
+              lambda c: {"url": f"/celdas/{_pop(c, 'celdas')}"}, iteraciones=100),
+    Escenario("agentes_crear", "POST", "/agentes", lambda c: {"url": "/agentes", "json": _agente_nuevo(c)}, iteraciones=100),
+    Escenario("agentes_actualizar", "PUT", "/agentes/{agente_id}",
+              lambda c: {"url": f"/agentes/{c.rng.choice(c.creados['agentes'])}", "json": _agente_nuevo(c)}, iteraciones=100),
+    Escenario("agentes_eliminar", "DELETE", "/agentes/{agente_id}",
+              lambda c: {"url": f"/agentes/{_pop(c, 'agentes')}"}, iteraciones=100),
+    Escenario("internos_crear", "POST", "/internos", lambda c: {"url": "/internos", "json": _interno_nuevo(c)}, iteraciones=100),
+    Escenario("internos_actualizar", "PUT", "/internos/{interno_id}",
+              lambda c: {"url": f"/internos/{c.rng.choice(c.creados['internos'])}", "json": _interno_nuevo(c)},
+              iteraciones=100),
+    Escenario("internos_modificar", "PATCH", "/internos/{interno_id}",
+              lambda c: {"url": f"/internos/{c.rng.choice(c.creados['internos'])}",
+                         "json": {"estado": c.rng.choice(("Trasladado", "Liberado")), "condena_meses": c.rng.randint(6, 360)}},
+              iteraciones=100),
+    Escenario("internos_transiciones", "POST", "/internos/transiciones",
+              lambda c: {"url": "/internos/transiciones",
+                         "json": {"ids": c.creados["internos"], "estado": c.rng.choice(("Trasladado", "Liberado"))}},
+              iteraciones=20),
+    Escenario("internos_eliminar", "DELETE", "/internos/{interno_id}",
+              lambda c: {"url": f"/internos/{_pop(c, 'internos')}"}, iteraciones=100),
+    # --- Carga masiva, asignación y mantenimiento
+    Escenario("celdas_bulk", "POST", "/celdas/bulk",
+              lambda c: {"url": "/celdas/bulk", "json": [_celda_nueva(c) for _ in range(500)]}, iteraciones=10),
+    Escenario("agentes_bulk", "POST", "/agentes/bulk",
+              lambda c: {"url": "/agentes/bulk", "json": [_agente_nuevo(c) for _ in range(500)]}, iteraciones=10),
+    Escenario("internos_bulk", "POST", "/internos/bulk",
+              lambda c: {"url": "/internos/bulk", "json": [_interno_nuevo(c) for _ in range(500)]}, iteraciones=10),
+    Escenario("internos_asignar", "POST", "/internos/asignar",
+              lambda c: {"url": "/internos/asignar",
+                         "json": {"nuevos": [_interno_nuevo(c, "Activo") for _ in range(5)], "parcial": True}},
+              iteraciones=20),
+    Escenario("stats_reconciliar", "POST", "/stats/reconciliar", lambda c: {"url": "/stats/reconciliar"}, iteraciones=5),
+    Escenario("stats_snapshot", "POST", "/stats/snapshot", lambda c: {"url": "/stats/snapshot"}, iteraciones=5),
+    Escenario("stats_historico", "GET", "/stats/historico",
+              lambda c: {"url": "/stats/historico", "params": {"granularidad": c.rng.choice(("dia", "semana", "mes"))}}),
+    # Vacía pabellones enteros: después de los escenarios que leen ocupación
+    Escenario("internos_evacuar", "POST", "/internos/transiciones",
+              lambda c: {"url": "/internos/transiciones", "json": {"pabellon": c.rng.choice(c.pabellones), "estado": "Trasladado"}},
+              iteraciones=3),
+    # Al final: saca filas de `internos` que los escenarios anteriores usan
+    Escenario("db_archivar", "POST", "/db/archivar",
+              lambda c: {"url": "/db/archivar", "params": {"antiguedad_dias": 365}}, iteraciones=3),
+]
+
+
+# =========================
+# Medición
+# =========================
+def _percentil(valores: List[float], p: int) -> float:
+    if len(valores) == 1:
+        return valores[0]
+    return statistics.quantiles(valores, n=100, method="inclusive")[p - 1]
+
+def _rss_pico_mb() -> float:
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KiB; macOS, bytes
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _medir(client, ctx: Contexto, esc: Escenario, iteraciones: int) -> Dict[str, Any]:
+    if esc.metodo == "GET":
+        for _ in range(min(3, iteraciones)):        # calentamiento: caché de páginas y de sentencias
+            client.request(esc.metodo, **esc.request(ctx))
+    lat: List[float] = []
+    errores, primer_error = 0, None
+    t_total = time.perf_counter()
+    for _ in range(iteraciones):
+        kwargs = esc.request(ctx)
+        t0 = time.perf_counter()
+        r = client.request(esc.metodo, **kwargs)
+        lat.append((time.perf_counter() - t0) * 1000)
+        if r.status_code not in esc.esperado:
+            errores += 1
+            primer_error = primer_error or f"{r.status_code}: {r.text[:200]}"
+        elif esc.metodo == "POST" and esc.ruta in ("/celdas", "/agentes", "/internos"):
+            ctx.creados[esc.ruta.strip("/")].append(r.json()["id"])
+    t_total = time.perf_counter() - t_total
+    res = {
+        "n": iteraciones,
+        "p50_ms": round(_percentil(lat, 50), 3),
+        "p95_ms": round(_percentil(lat, 95), 3),
+        "p99_ms": round(_percentil(lat, 99), 3),
+        "media_ms": round(statistics.fmean(lat), 3),
+        "rps": round(iteraciones / t_total, 1),
+        "errores": errores,
+    }
+    if primer_error:
+        res["primer_error"] = primer_error
+    return res
+
+def _rutas_sin_escenario(app) -> List[str]:
+    from fastapi.routing import APIRoute
+    cubiertas = {(e.metodo, e.ruta) for e in ESCENARIOS}
+    faltan = []
+    for r in app.routes:
+        if isinstance(r, APIRoute) and r.include_in_schema:
+            faltan += [f"{m} {r.path}" for m in sorted(r.methods) if (m, r.path) not in cubiertas]
+    return sorted(set(faltan))
+
+def correr(escala: str, semilla: int = SEMILLA, factor: float = 1.0, solo: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Corre los escenarios en proceso contra una copia del dataset (las escrituras no lo alteran)."""
+    origen = ruta_dataset(escala, semilla)
+    if not origen.exists():
+        # En un subproceso: la generación no debe contar en el RSS pico de la corrida
+        subprocess.run([sys.executable, "-m", "bench", "seed", "--escala", escala, "--semilla", str(semilla)],
+                       check=True, cwd=Path(__file__).resolve().parent.parent)
+    from db import PoolConfig, connect, init_db
+    trabajo = origen.with_name(origen.stem + ".corrida.db")
+    archivo = PoolConfig(path=trabajo).ruta_archivo()   # el archivo de la corrida anterior no vale para esta copia
+    for base in (trabajo, archivo):
+        for sufijo in ("", "-wal", "-shm"):
+            Path(str(base) + sufijo).unlink(missing_ok=True)
+    shutil.copyfile(origen, trabajo)
+    os.environ["PENITENCIARIO_DB_PATH"] = str(trabajo)
+    if "PENITENCIARIO_BACKUP_DIR" not in os.environ:
+        respaldos = trabajo.parent / "backups"
+        shutil.rmtree(respaldos, ignore_errors=True)     # los de corridas anteriores no se acumulan
+        os.environ["PENITENCIARIO_BACKUP_DIR"] = str(respaldos)
+    conn = connect(PoolConfig(path=trabajo, sql_metrics=False))
+    try:
+        init_db(conn)       # un dataset generado con un esquema anterior se pone al día
+    finally:
+        conn.close()
+
+    from fastapi.testclient import TestClient
+    import app as app_module
+
+    ctx = _contexto(trabajo, semilla)
+    escenarios = [e for e in ESCENARIOS if not solo or e.nombre in solo]
+    resultados: Dict[str, Any] = {}
+    t0 = time.perf_counter()
+    with TestClient(app_module.app) as client:
+        for esc in escenarios:
+            resultados[esc.nombre] = _medir(client, ctx, esc, max(1, int(esc.iteraciones * factor)))
+    return {
+        "escala": escala,
+        "semilla": semilla,
+        "fecha": date.today().isoformat(),
+        "entorno": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                    "plataforma": platform.platform()},
+        "duracion_s": round(time.perf_counter() - t0, 2),
+        "rss_pico_mb": _rss_pico_mb(),
+        "escenarios": resultados,
+        "sin_escenario": _rutas_sin_escenario(app_module.app),
+    }
+
+
+# =========================
+# Baselines
+# =========================
+def ruta_baseline(escala: str) -> Path:
+    return BASELINES_DIR / f"{escala}.json"
+
+def guardar_baseline(resultado: Dict[str, Any]) -> Path:
+    path = ruta_baseline(resultado["escala"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(resultado, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    return path
+
+def comparar(actual: Dict[str, Any], base: Dict[str, Any], umbral: float = UMBRAL, piso_ms: float = PISO_MS) -> List[str]:
+    """Lista de regresiones (vacía si no hay). Compara p95 (o p50) por escenario y el RSS pico."""
+    regresiones = []
+    for nombre, a in actual["escenarios"].items():
+        if a["errores"]:
+            regresiones.append(f"{nombre}: {a['errores']} respuestas inesperadas ({a.get('primer_error')})")
+        b = base["escenarios"].get(nombre)
+        if not b:
+            continue
+        # Con pocas muestras el p95 es prácticamente el máximo: se compara la mediana
+        k = "p95_ms" if min(a["n"], b["n"]) >= MIN_MUESTRAS_P95 else "p50_ms"
+        if a[k] > b[k] * (1 + umbral) and a[k] - b[k] > piso_ms:
+            regresiones.append(f"{nombre}: {k[:3]} {a[k]} ms vs {b[k]} ms de baseline "
+                               f"(+{(a[k] / b[k] - 1) * 100:.0f}%)")
+    if actual["rss_pico_mb"] > base["rss_pico_mb"] * (1 + umbral):
+        regresiones.append(f"rss_pico_mb: {actual['rss_pico_mb']} vs {base['rss_pico_mb']} de baseline")
+    return regresiones
+
+def tabla(resultado: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> str:
+    filas = [f"{'escenario':<24}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'base p95':>10}{'err':>5}"]
+    for nombre, r in resultado["escenarios"].items():
+        b = (base or {}).get("escenarios", {}).get(nombre, {}).get("p95_ms", "")
+        filas.append(f"{nombre:<24}{r['n']:>6}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+                     f"{r['rps']:>10}{b:>10}{r['errores']:>5}")
+    filas.append(f"RSS pico: {resultado['rss_pico_mb']} MB   duración: {resultado['duracion_s']} s")
+    if resultado["sin_escenario"]:
+        filas.append("Rutas sin escenario: " + ", ".join(resultado["sin_escenario"]))
+    return "\n".join(filas)
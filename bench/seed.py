@@ -0,0 +1,145 @@
+import random
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from db import SCHEMA_SQL, PoolConfig, connect, init_db
+
+# =========================
+# Escalas predefinidas
+# =========================
+@dataclass(frozen=True)
+class Escala:
+    internos: int
+    celdas: int
+    agentes: int
+
+ESCALAS: Dict[str, Escala] = {
+    "1k":   Escala(internos=1_000,     celdas=150,     agentes=50),
+    "10k":  Escala(internos=10_000,    celdas=1_500,   agentes=500),
+    "100k": Escala(internos=100_000,   celdas=12_000,  agentes=2_000),
+    "1m":   Escala(internos=1_000_000, celdas=100_000, agentes=10_000),
+}
+
+SEMILLA = 20240501
+FECHA_REFERENCIA = date(2025, 6, 30)   # fija, para que el dataset no dependa del día en que se genera
+DATA_DIR = Path(tempfile.gettempdir()) / "penitenciario-bench"
+
+NOMBRES = ("Juan", "María", "José", "Ana", "Luis", "Carlos", "Lucía", "Jorge", "Sofía", "Martín",
+           "Diego", "Valeria", "Pablo", "Camila", "Miguel", "Florencia", "Raúl", "Inés", "Héctor", "Julián")
+APELLIDOS = ("González", "Rodríguez", "Gómez", "Fernández", "López", "Díaz", "Martínez", "Pérez",
+             "García", "Sánchez", "Romero", "Sosa", "Torres", "Álvarez", "Ruiz", "Ramírez", "Flores",
+             "Benítez", "Acosta", "Medina", "Herrera", "Suárez", "Aguirre", "Giménez", "Gutiérrez",
+             "Pereyra", "Rojas", "Molina", "Castro", "Ortiz", "Silva", "Núñez", "Luna", "Juárez")
+CAUSAS = ("Robo simple", "Robo agravado", "Hurto", "Estafa", "Homicidio", "Lesiones",
+          "Tenencia de estupefacientes", "Comercialización de estupefacientes", "Amenazas",
+          "Defraudación", "Encubrimiento", "Portación de arma")
+RANGOS = ("Auxiliar", "Oficial", "Sargento", "Suboficial", "Inspector")
+# Distribución de estados: mayoría activos, como en un padrón real
+ESTADOS = ("Activo",) * 7 + ("Trasladado",) + ("Liberado",) * 2
+
+CHUNK = 10_000
+
+
+def ruta_dataset(escala: str, semilla: int = SEMILLA) -> Path:
+    return DATA_DIR / f"{escala}-{semilla}.db"
+
+
+def _celdas(rng: random.Random, n: int) -> Iterator[Tuple[str, str, int]]:
+    # Pabellones de ~200 celdas: A..Z, luego AA, AB, ...
+    for k in range(n):
+        p = k // 200
+        pabellon = chr(65 + p % 26) * (1 + p // 26)
+        yield pabellon, str(k % 200 + 1), rng.randint(1, 12)
+
+
+def _agentes(rng: random.Random, n: int) -> Iterator[tuple]:
+    for k in range(n):
+        yield (f"SP-{k + 1:06d}", rng.choice(NOMBRES), rng.choice(APELLIDOS),
+               rng.choice(RANGOS), int(rng.random() < 0.9))
+
+
+def _internos(rng: random.Random, n: int, capacidades: list) -> Iterator[tuple]:
+    """Internos con ocupación válida: los Activos ocupan camas libres mientras haya."""
+    dias = 5 * 365
+    libres = [(cid, cap) for cid, cap in enumerate(capacidades, start=1)]
+    rng.shuffle(libres)
+    ocupacion = [0] * (len(capacidades) + 1)
+    for k in range(n):
+        estado = rng.choice(ESTADOS)
+        celda_id = None
+        if estado == "Activo" and libres:
+            cid, cap = libres[-1]
+            celda_id = cid
+            ocupacion[cid] += 1
+            if ocupacion[cid] >= cap:
+                libres.pop()
+            elif rng.random() < 0.5:
+                # Alterna celdas para no llenarlas en bloques contiguos
+                i = rng.randrange(len(libres))
+                libres[i], libres[-1] = libres[-1], libres[i]
+        yield (str(20_000_000 + k), rng.choice(NOMBRES), rng.choice(APELLIDOS),
+               (FECHA_REFERENCIA - timedelta(days=rng.randrange(dias))).isoformat(), estado, celda_id,
+               rng.choice(CAUSAS), rng.randint(6, 360))
+
+
+def _en_lotes(conn: sqlite3.Connection, sql: str, filas: Iterator[tuple]) -> None:
+    lote = []
+    for f in filas:
+        lote.append(f)
+        if len(lote) >= CHUNK:
+            conn.executemany(sql, lote)
+            lote.clear()
+    if lote:
+        conn.executemany(sql, lote)
+
+
+def generar(path: Path, escala: Escala, semilla: int = SEMILLA) -> Dict[str, float]:
+    """
+    Crea la base en `path` desde cero. Inserta sin triggers de contadores ni FTS
+    (init_db los crea al final y los siembra en una sola pasada), con el journal apagado.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for sufijo in ("", "-wal", "-shm"):
+        Path(str(path) + sufijo).unlink(missing_ok=True)
+
+    t0 = time.perf_counter()
+    rng = random.Random(semilla)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -262144")
+        conn.executescript(SCHEMA_SQL)
+        capacidades = []
+
+        def celdas():
+            for fila in _celdas(rng, escala.celdas):
+                capacidades.append(fila[2])
+                yield fila
+
+        conn.execute("BEGIN")
+        _en_lotes(conn, "INSERT INTO celdas (pabellon, numero, capacidad) VALUES (?, ?, ?)", celdas())
+        _en_lotes(conn, "INSERT INTO agentes (legajo, nombre, apellido, rango, activo) VALUES (?, ?, ?, ?, ?)",
+                  _agentes(rng, escala.agentes))
+        _en_lotes(conn, "INSERT INTO internos (dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                  _internos(rng, escala.internos, capacidades))
+        conn.commit()
+    finally:
+        conn.close()
+    t_carga = time.perf_counter() - t0
+
+    conn = connect(PoolConfig(path=path, sql_metrics=False))
+    try:
+        init_db(conn)                     # contadores + FTS sobre los datos ya cargados
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return {"carga_s": round(t_carga, 2), "total_s": round(time.perf_counter() - t0, 2)}
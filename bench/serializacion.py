@@ -0,0 +1,60 @@
+import random
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List
+
+from bench.seed import APELLIDOS, CAUSAS, ESTADOS, NOMBRES, FECHA_REFERENCIA
+from serializacion import codificador, json_validado, orjson
+
+# Microbenchmark del camino rápido de serialización (serializacion.py) contra el de FastAPI:
+# dict(row) -> validación del response_model -> dump_json. Mide ms por cada 10k filas.
+
+def _filas(n: int, semilla: int) -> Dict[str, List[sqlite3.Row]]:
+    rng = random.Random(semilla)
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE internos (id INTEGER PRIMARY KEY, dni TEXT, nombre TEXT, apellido TEXT,"
+                 " fecha_ingreso TEXT, estado TEXT, celda_id INTEGER, causa TEXT, condena_meses INTEGER)")
+    conn.execute("CREATE TABLE agentes (id INTEGER PRIMARY KEY, legajo TEXT, nombre TEXT, apellido TEXT,"
+                 " rango TEXT, activo INTEGER)")
+    conn.executemany("INSERT INTO internos VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)", [
+        (str(20_000_000 + k), rng.choice(NOMBRES), rng.choice(APELLIDOS), FECHA_REFERENCIA.isoformat(),
+         rng.choice(ESTADOS), rng.choice((None, rng.randint(1, 5000))), rng.choice((None,) + CAUSAS),
+         rng.choice((None, rng.randint(6, 360))))
+        for k in range(n)])
+    conn.executemany("INSERT INTO agentes VALUES (NULL, ?, ?, ?, 'Oficial', ?)", [
+        (f"SP-{k:06d}", rng.choice(NOMBRES), rng.choice(APELLIDOS), rng.randint(0, 1)) for k in range(n)])
+    return {
+        "internos": conn.execute("SELECT id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa,"
+                                 " condena_meses FROM internos").fetchall(),
+        "agentes": conn.execute("SELECT id, legajo, nombre, apellido, rango, (activo != 0) AS activo"
+                                " FROM agentes").fetchall(),
+    }
+
+def _mejor_de(fn: Callable[[], Any], repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor * 1000
+
+def micro(n: int = 10_000, repeticiones: int = 7, semilla: int = 1) -> Dict[str, Any]:
+    from app import AgenteOut, InternoOut
+
+    datos = _filas(n, semilla)
+    res: Dict[str, Any] = {"filas": n, "orjson": orjson is not None}
+    for nombre, modelo in (("internos", InternoOut), ("agentes", AgenteOut)):
+        filas = datos[nombre]
+        c = codificador(modelo)
+        if c.lista(filas) != json_validado(modelo, filas):
+            raise AssertionError(f"{nombre}: la salida rápida difiere de la de FastAPI")
+        lento = _mejor_de(lambda: json_validado(modelo, filas), repeticiones)
+        rapido = _mejor_de(lambda: c.lista(filas), repeticiones)
+        por_10k = 10_000 / n
+        res[nombre] = {
+            "validado_ms_10k": round(lento * por_10k, 2),
+            "rapido_ms_10k": round(rapido * por_10k, 2),
+            "aceleracion": round(lento / rapido, 1),
+        }
+    return res
@@ -1,23 +1,555 @@
 from pathlib import Path
+import hashlib
+import os
+import queue
+import random
 import sqlite3
-from typing import Generator
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Callable, ContextManager, Dict, Generator, Iterator, List, Literal, Optional
 
-# Carpeta y archivo de base de datos
-DB_DIR = Path(__file__).resolve().parent / "data"
-DB_PATH = DB_DIR / "penitenciario.db"
+from metrics import InstrumentedConnection
 
-def get_db() -> Generator[sqlite3.Connection, None, None]:
-    DB_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+try:
+    import fcntl
+except ImportError:   # sin fcntl (Windows) el lock de arranque solo coordina hilos del proceso
+    fcntl = None
+
+# Carpeta y archivo de base de datos (sobreescribibles por entorno)
+DB_DIR = Path(os.environ.get("PENITENCIARIO_DB_DIR", Path(__file__).resolve().parent / "data"))
+DB_PATH = Path(os.environ.get("PENITENCIARIO_DB_PATH", DB_DIR / "penitenciario.db"))
+
+
+# --- Pool de conexiones ---
+@dataclass
+class PoolConfig:
+    """Parámetros del pool. Se leen del entorno con `PoolConfig.from_env()`."""
+    path: Path = DB_PATH
+    readers: int = 4                 # conexiones de solo lectura
+    timeout: float = 10.0            # segundos máximos esperando una conexión
+    busy_timeout_ms: int = 5000
+    cache_size_kib: int = 16384      # PRAGMA cache_size (negativo = KiB)
+    mmap_size: int = 256 * 1024 * 1024
+    cached_statements: int = 256     # caché de sentencias preparadas por conexión
+    sql_metrics: bool = True         # instrumentación de sentencias para /metrics
+    journal_size_limit: int = 64 * 1024 * 1024   # tamaño al que se recorta el WAL tras un checkpoint
+    checkpoint_intervalo: float = 30.0           # segundos entre checkpoints PASSIVE; 0 = solo autocheckpoint
+    checkpoint_inactividad: float = 10.0         # segundos sin escrituras para hacer TRUNCATE
+    archivo_path: Optional[Path] = None          # base adjunta `archivo`; por defecto <db>-archivo.db
+
+    def ruta_archivo(self) -> Path:
+        return self.archivo_path or self.path.with_name(self.path.stem + "-archivo" + self.path.suffix)
+
+    @classmethod
+    def from_env(cls) -> "PoolConfig":
+        env = os.environ
+        return cls(
+            path=Path(env.get("PENITENCIARIO_DB_PATH", DB_PATH)),
+            readers=int(env.get("PENITENCIARIO_POOL_READERS", cls.readers)),
+            timeout=float(env.get("PENITENCIARIO_POOL_TIMEOUT", cls.timeout)),
+            busy_timeout_ms=int(env.get("PENITENCIARIO_BUSY_TIMEOUT_MS", cls.busy_timeout_ms)),
+            cache_size_kib=int(env.get("PENITENCIARIO_CACHE_SIZE_KIB", cls.cache_size_kib)),
+            mmap_size=int(env.get("PENITENCIARIO_MMAP_SIZE", cls.mmap_size)),
+            sql_metrics=env.get("PENITENCIARIO_SQL_METRICS", "1") not in ("0", "false", "no"),
+            journal_size_limit=int(env.get("PENITENCIARIO_JOURNAL_SIZE_LIMIT", cls.journal_size_limit)),
+            checkpoint_intervalo=float(env.get("PENITENCIARIO_CHECKPOINT_INTERVALO", cls.checkpoint_intervalo)),
+            checkpoint_inactividad=float(env.get("PENITENCIARIO_CHECKPOINT_INACTIVIDAD", cls.checkpoint_inactividad)),
+            archivo_path=Path(env["PENITENCIARIO_ARCHIVO_PATH"]) if env.get("PENITENCIARIO_ARCHIVO_PATH") else None,
+        )
+
+
+def connect(config: Optional[PoolConfig] = None, readonly: bool = False) -> sqlite3.Connection:
+    """Abre una conexión con los PRAGMAs del proyecto (la usan el pool y los comandos CLI)."""
+    cfg = config or PoolConfig.from_env()
+    cfg.path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        cfg.path,
+        check_same_thread=False,          # la conexión viaja entre hilos del threadpool
+        cached_statements=cfg.cached_statements,
+        factory=InstrumentedConnection if cfg.sql_metrics else sqlite3.Connection,
+    )
     conn.row_factory = sqlite3.Row
+    # Internos egresados antiguos (ver archivar_internos): las consultas de todos los días
+    # no los recorren, y quedan a mano como `archivo.internos` cuando se piden.
+    conn.execute("ATTACH DATABASE ? AS archivo", (str(cfg.ruta_archivo()),))
+    if not readonly:
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA archivo.journal_mode = WAL;")
     conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA busy_timeout = 5000;")
-    try:
+    conn.execute(f"PRAGMA busy_timeout = {int(cfg.busy_timeout_ms)};")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA archivo.synchronous = NORMAL;")
+    conn.execute(f"PRAGMA cache_size = {-abs(int(cfg.cache_size_kib))};")
+    conn.execute(f"PRAGMA mmap_size = {int(cfg.mmap_size)};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute(f"PRAGMA journal_size_limit = {int(cfg.journal_size_limit)};")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON;")
+    return conn
+
+
+class PoolTimeout(Exception):
+    """No se obtuvo una conexión del pool dentro de `PoolConfig.timeout`."""
+
+
+# --- Reintentos ante SQLITE_BUSY / SQLITE_LOCKED ---
+# Con varios workers sobre el mismo archivo, `busy_timeout` no alcanza: SQLite devuelve
+# BUSY sin esperar cuando esperar podría trabarse (upgrade de lock, recuperación del WAL,
+# un TRUNCATE en curso). Solo se reintenta lo que no repite efectos: adquirir el lock de
+# escritura, el COMMIT y las lecturas (GET/HEAD, ver app.py).
+REINTENTOS_BUSY = int(os.environ.get("PENITENCIARIO_REINTENTOS_BUSY", 5))
+REINTENTO_BASE = 0.01    # segundos; se duplica en cada intento
+REINTENTO_TOPE = 0.5
+
+_CODIGOS_BLOQUEO = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+
+def es_bloqueo(e: BaseException) -> bool:
+    """True si `e` es un SQLITE_BUSY/SQLITE_LOCKED (incluidos los códigos extendidos)."""
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    codigo = getattr(e, "sqlite_errorcode", None)
+    if codigo is not None:
+        return codigo & 0xFF in _CODIGOS_BLOQUEO
+    msg = str(e)
+    return "locked" in msg or "busy" in msg
+
+def pausa_reintento(intento: int) -> float:
+    """Backoff exponencial con jitter completo: los workers que chocaron no vuelven juntos."""
+    return random.uniform(0, min(REINTENTO_TOPE, REINTENTO_BASE * (2 ** intento)))
+
+
+class _ReintentoStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reintentos: Dict[str, int] = {}
+        self.agotados: Dict[str, int] = {}
+
+    def registrar(self, clase: str, agotado: bool = False) -> None:
+        d = self.agotados if agotado else self.reintentos
+        with self._lock:
+            d[clase] = d.get(clase, 0) + 1
+
+    def as_dict(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {"reintentos": dict(self.reintentos), "agotados": dict(self.agotados)}
+
+reintentos = _ReintentoStats()
+
+def reintentar_busy(fn: Callable[[], Any], clase: str = "escritura", intentos: Optional[int] = None) -> Any:
+    """Llama a `fn()` y la repite ante BUSY/LOCKED. `fn` tiene que ser segura de repetir."""
+    n = REINTENTOS_BUSY if intentos is None else intentos
+    for k in range(n + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not es_bloqueo(e):
+                raise
+            if k == n:
+                reintentos.registrar(clase, agotado=True)
+                raise
+            reintentos.registrar(clase)
+            time.sleep(pausa_reintento(k))
+
+def begin_immediate(db: sqlite3.Connection) -> None:
+    """BEGIN IMMEDIATE con reintentos: si no se obtiene el lock no se ejecutó nada."""
+    reintentar_busy(lambda: db.execute("BEGIN IMMEDIATE"))
+
+
+@dataclass
+class _WaitStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_total_ms: float = 0.0
+    wait_max_ms: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, waited_ms: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total_ms += waited_ms
+            if waited_ms > self.wait_max_ms:
+                self.wait_max_ms = waited_ms
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            avg = self.wait_total_ms / self.checkouts if self.checkouts else 0.0
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(avg, 3),
+                "wait_max_ms": round(self.wait_max_ms, 3),
+                "wait_total_ms": round(self.wait_total_ms, 3),
+            }
+
+
+class WriterThread:
+    """
+    Hilo dueño de la conexión escritora. Las operaciones encoladas con `submit`
+    se agrupan: todo lo pendiente se ejecuta en una sola transacción (un SAVEPOINT
+    por operación) y se confirma con un único commit (group commit). Cada Future
+    recibe su propio resultado o excepción.
+
+    `prestar` entrega la conexión completa a quien la pide (bulk, init, etc.):
+    el hilo confirma el lote en curso y espera a que se la devuelvan.
+    """
+
+    _STOP = object()
+
+    def __init__(self, conn: sqlite3.Connection, max_batch: int = 128):
+        self.conn = conn
+        self.max_batch = max_batch
+        self._q: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.batches = 0
+        self.batch_max = 0
+        self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]) -> Future:
+        fut: Future = Future()
+        self._q.put((fn, fut, None))
+        return fut
+
+    @contextmanager
+    def prestar(self, timeout: float) -> Iterator[sqlite3.Connection]:
+        listo, liberar = threading.Event(), threading.Event()
+        fut: Future = Future()
+        self._q.put((None, fut, (listo, liberar)))
+        if not listo.wait(timeout):
+            if fut.cancel():
+                raise PoolTimeout(f"Sin conexión 'write' disponible tras {timeout}s")
+            listo.wait()  # el hilo la tomó justo ahora
+        try:
+            yield self.conn
+        finally:
+            # Nunca devolvemos la conexión con una transacción a medias
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            liberar.set()
+
+    def _loop(self) -> None:
+        pendiente = None
+        while True:
+            item = pendiente if pendiente is not None else self._q.get()
+            pendiente = None
+            if item is self._STOP:
+                return
+            if item[2] is not None:
+                self._prestamo(item)
+                continue
+            lote = [item]
+            while len(lote) < self.max_batch:
+                try:
+                    sig = self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if sig is self._STOP or sig[2] is not None:
+                    pendiente = sig       # se atiende después de confirmar este lote
+                    break
+                lote.append(sig)
+            self._ejecutar(lote)
+
+    def _prestamo(self, item) -> None:
+        _, fut, (listo, liberar) = item
+        if not fut.set_running_or_notify_cancel():
+            return
+        listo.set()
+        liberar.wait()
+        fut.set_result(None)
+
+    def _ejecutar(self, lote: List[tuple]) -> None:
+        lote = [it for it in lote if it[1].set_running_or_notify_cancel()]
+        if not lote:
+            return
+        conn = self.conn
+        resultados: List[tuple] = []
+        try:
+            begin_immediate(conn)
+            for fn, fut, _ in lote:
+                conn.execute("SAVEPOINT op")
+                try:
+                    resultados.append((fut, fn(conn), None))
+                except Exception as e:  # HTTPException, IntegrityError, ...
+                    conn.execute("ROLLBACK TO op")
+                    resultados.append((fut, None, e))
+                conn.execute("RELEASE op")
+            reintentar_busy(conn.commit)    # un COMMIT con BUSY deja la transacción abierta
+        except sqlite3.Error as e:
+            # Falló BEGIN o COMMIT: nada del lote quedó escrito
+            if conn.in_transaction:
+                conn.rollback()
+            for _, fut, _ in lote:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        with self._lock:
+            self.jobs += len(lote)
+            self.batches += 1
+            self.batch_max = max(self.batch_max, len(lote))
+        for fut, res, exc in resultados:
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "jobs": self.jobs,
+                "batches": self.batches,
+                "batch_avg": round(self.jobs / self.batches, 2) if self.batches else 0.0,
+                "batch_max": self.batch_max,
+                "queue_depth": self._q.qsize(),
+            }
+
+    def stop(self) -> None:
+        self._q.put(self._STOP)
+        self._thread.join(timeout=5)
+
+
+class CheckpointManager:
+    """
+    Hilo que controla el tamaño del WAL. Cada `intervalo` segundos hace un checkpoint
+    PASSIVE (no bloquea a nadie); si la base lleva `inactividad` segundos sin commits de
+    ningún proceso (PRAGMA data_version) hace TRUNCATE, que deja el WAL en cero bytes.
+    Usa su propia conexión con busy_timeout corto: si hay lectores, el TRUNCATE se
+    resigna rápido en vez de frenar a los escritores.
+    """
+
+    MODOS = ("PASSIVE", "TRUNCATE")
+
+    def __init__(self, conn: sqlite3.Connection, intervalo: float, inactividad: float):
+        self.conn = conn
+        self.intervalo = intervalo
+        self.inactividad = inactividad
+        conn.execute("PRAGMA busy_timeout = 100;")
+        self._wal = Path(str(conn.execute("PRAGMA database_list").fetchone()[2]) + "-wal")
+        self._lock = threading.Lock()
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        self._ultimo_cambio = time.monotonic()
+        self._pendiente = True
+        self.checkpoints = {m: 0 for m in self.MODOS}
+        self.ocupados = 0          # checkpoints que no llegaron a copiar todo el WAL
+        self.errores = 0
+        self.paginas = 0           # páginas copiadas del WAL a la base
+        self.duracion_ms = 0.0     # último checkpoint
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="sqlite-checkpoint", daemon=True)
+        self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.intervalo):
+            try:
+                self.checkpoint()
+            except sqlite3.Error:
+                with self._lock:
+                    self.errores += 1
+
+    def checkpoint(self, modo: Optional[str] = None) -> Dict[str, Any]:
+        """Un ciclo del manager; con `modo` se fuerza PASSIVE o TRUNCATE."""
+        ahora = time.monotonic()
+        dv = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if dv != self._data_version:
+            self._data_version, self._ultimo_cambio, self._pendiente = dv, ahora, True
+        if modo is None:
+            if not self._pendiente:
+                return {"modo": None}            # nada escrito desde el último TRUNCATE
+            inactivo = ahora - self._ultimo_cambio >= self.inactividad
+            modo = "TRUNCATE" if inactivo else "PASSIVE"
+        t0 = time.perf_counter()
+        ocupado, frames, copiados = self.conn.execute(f"PRAGMA wal_checkpoint({modo})").fetchone()
+        ms = (time.perf_counter() - t0) * 1000.0
+        if modo == "TRUNCATE" and not ocupado:
+            self._pendiente = False
+        with self._lock:
+            self.checkpoints[modo] += 1
+            self.ocupados += int(bool(ocupado) or copiados < frames)
+            self.paginas += max(copiados, 0)
+            self.duracion_ms = ms
+        return {"modo": modo, "ocupado": bool(ocupado), "frames": frames, "copiados": copiados,
+                "duracion_ms": round(ms, 3)}
+
+    def wal_bytes(self) -> int:
+        try:
+            return self._wal.stat().st_size
+        except OSError:
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkpoints": dict(self.checkpoints),
+                "ocupados": self.ocupados,
+                "errores": self.errores,
+                "paginas": self.paginas,
+                "ultimo_ms": round(self.duracion_ms, 3),
+                "wal_bytes": self.wal_bytes(),
+            }
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+
+class ConnectionPool:
+    """
+    Conexiones SQLite de larga vida: N lectoras (query_only) y una única escritora,
+    propiedad de un `WriterThread`. Cada conexión se configura una sola vez (WAL,
+    synchronous=NORMAL, cache_size, mmap_size) y conserva su caché de sentencias.
+    """
+
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig.from_env()
+        self._all: List[sqlite3.Connection] = []
+        # La escritora se abre primero: es la que fija journal_mode=WAL en el archivo.
+        self._writer = WriterThread(self._connect(readonly=False))
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(max(1, self.config.readers)):
+            self._readers.put(self._connect(readonly=True))
+        self._stats = {"read": _WaitStats(), "write": _WaitStats()}
+        self._checkpoints: Optional[CheckpointManager] = None
+        if self.config.checkpoint_intervalo > 0:
+            self._checkpoints = CheckpointManager(
+                self._connect(readonly=False), self.config.checkpoint_intervalo, self.config.checkpoint_inactividad)
+        self._closed = False
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        conn = connect(self.config, readonly=readonly)
+        self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        """Conexión de uso exclusivo. Para escrituras cortas preferir `escribir`."""
+        if write:
+            t0 = time.perf_counter()
+            try:
+                with self._writer.prestar(self.config.timeout) as conn:
+                    self._stats["write"].record((time.perf_counter() - t0) * 1000.0)
+                    yield conn
+            except PoolTimeout:
+                self._stats["write"].record_timeout()
+                raise
+            return
+
+        stats = self._stats["read"]
+        t0 = time.perf_counter()
+        try:
+            conn = self._readers.get(timeout=self.config.timeout)
+        except queue.Empty:
+            stats.record_timeout()
+            raise PoolTimeout(f"Sin conexiones 'read' disponibles tras {self.config.timeout}s")
+        stats.record((time.perf_counter() - t0) * 1000.0)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def escribir(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Ejecuta `fn(conn)` en el hilo escritor, agrupada con otras escrituras
+        concurrentes en una misma transacción. `fn` no debe hacer commit; si lanza
+        una excepción solo se deshace su propio SAVEPOINT y la excepción se relanza acá.
+        """
+        fut = self._writer.submit(fn)
+        try:
+            return fut.result(timeout=self.config.timeout)
+        except FutureTimeout:
+            if fut.cancel():
+                self._stats["write"].record_timeout()
+                raise PoolTimeout(f"La escritura no se ejecutó tras {self.config.timeout}s")
+            return fut.result()   # ya estaba corriendo: esperamos su resultado
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "db_path": str(self.config.path),
+            "readers": self.config.readers,
+            "readers_idle": self._readers.qsize(),
+            "read": self._stats["read"].as_dict(),
+            "write": self._stats["write"].as_dict(),
+            "writer": self._writer.stats(),
+            "checkpoint": self._checkpoints.stats() if self._checkpoints else None,
+            "busy": reintentos.as_dict(),
+        }
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._checkpoints:
+            self._checkpoints.stop()
+        self._writer.stop()
+        for conn in self._all:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Pool global, creado perezosamente en el primer uso."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def get_db() -> Generator[sqlite3.Connection, None, None]:
+    """Dependencia con la conexión escritora en exclusiva (init, bulk, mantenimiento)."""
+    with get_pool().connection(write=True) as conn:
+        yield conn
+
+def escribir(fn: Callable[[sqlite3.Connection], Any]) -> Any:
+    """Atajo a `get_pool().escribir(fn)` para los handlers de escritura."""
+    return get_pool().escribir(fn)
+
+def get_db_read() -> Generator[sqlite3.Connection, None, None]:
+    """Dependencia para endpoints de solo lectura: conexión lectora del pool."""
+    with get_pool().connection(write=False) as conn:
         yield conn
-    finally:
-        conn.close()
 
 # Esquema (sin comillas triples para evitar pegado con indentación)
+CHECK_CELDA_ACTIVO = "CHECK (estado = 'Activo' OR celda_id IS NULL)"   # ver migración 9
+
+# AUTOINCREMENT: un id borrado (o archivado) no se vuelve a asignar. Sin él, SQLite reusa
+# el máximo tras un DELETE y el id nuevo puede chocar con uno que ya está en el archivo.
+INTERNOS_DEF = (
+    "\n  id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    "\n  dni TEXT UNIQUE,"
+    "\n  nombre   TEXT NOT NULL,"
+    "\n  apellido TEXT NOT NULL,"
+    "\n  fecha_ingreso TEXT NOT NULL,"
+    "\n  estado   TEXT NOT NULL DEFAULT 'Activo' CHECK (estado IN ('Activo','Trasladado','Liberado')),"
+    "\n  celda_id INTEGER,"
+    "\n  causa TEXT,"
+    "\n  condena_meses INTEGER CHECK (condena_meses >= 0),"
+    f"\n  {CHECK_CELDA_ACTIVO},"
+    "\n  FOREIGN KEY (celda_id) REFERENCES celdas(id) ON UPDATE CASCADE ON DELETE SET NULL"
+)
+
 SCHEMA_SQL = (
     "PRAGMA foreign_keys = ON;"
     "\n\nCREATE TABLE IF NOT EXISTS celdas ("
@@ -35,34 +567,936 @@ SCHEMA_SQL = (
     "\n  rango    TEXT NOT NULL CHECK (rango IN ('Auxiliar','Oficial','Sargento','Suboficial','Inspector')),"
     "\n  activo   INTEGER NOT NULL DEFAULT 1"
     "\n);"
-    "\n\nCREATE TABLE IF NOT EXISTS internos ("
-    "\n  id INTEGER PRIMARY KEY,"
-    "\n  dni TEXT UNIQUE,"
-    "\n  nombre   TEXT NOT NULL,"
-    "\n  apellido TEXT NOT NULL,"
-    "\n  fecha_ingreso TEXT NOT NULL,"
-    "\n  estado   TEXT NOT NULL DEFAULT 'Activo' CHECK (estado IN ('Activo','Trasladado','Liberado')),"
-    "\n  celda_id INTEGER,"
-    "\n  causa TEXT,"                                  
-    "\n  condena_meses INTEGER CHECK (condena_meses >= 0),"  
-    "\n  FOREIGN KEY (celda_id) REFERENCES celdas(id) ON UPDATE CASCADE ON DELETE SET NULL"
+    "\n\nCREATE TABLE IF NOT EXISTS internos (" + INTERNOS_DEF + "\n);"
+    # Índices compuestos para la paginación por cursor (ORDER BY apellido, nombre, id)
+    "\n\nCREATE INDEX IF NOT EXISTS idx_internos_orden ON internos(apellido, nombre, id);"
+    "\nCREATE INDEX IF NOT EXISTS idx_agentes_orden  ON agentes(apellido, nombre, id);"
+    # fecha_ingreso se guarda siempre como 'YYYY-MM-DD': los filtros comparan texto
+    # directamente y pueden usar estos índices (rango + orden del reporte)
+    "\n\nCREATE INDEX IF NOT EXISTS idx_internos_fecha   ON internos(fecha_ingreso);"
+    "\nCREATE INDEX IF NOT EXISTS idx_internos_reporte ON internos(fecha_ingreso DESC, apellido, nombre, id DESC);"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_fecha_bi BEFORE INSERT ON internos"
+    "\n  WHEN NEW.fecha_ingreso IS NOT date(NEW.fecha_ingreso) BEGIN"
+    "\n  SELECT RAISE(ABORT, 'fecha_ingreso debe tener formato YYYY-MM-DD');"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_fecha_bu BEFORE UPDATE OF fecha_ingreso ON internos"
+    "\n  WHEN NEW.fecha_ingreso IS NOT date(NEW.fecha_ingreso) BEGIN"
+    "\n  SELECT RAISE(ABORT, 'fecha_ingreso debe tener formato YYYY-MM-DD');"
+    "\nEND;"
+)
+
+
+# Contadores de ocupación mantenidos por triggers: /stats lee O(pabellones) filas
+# en lugar de recorrer internos/celdas. Un cambio de id de celda (ON UPDATE CASCADE)
+# no se sigue con exactitud; `reconciliar_contadores` corrige cualquier desvío.
+CONTADORES_SQL = (
+    "CREATE TABLE IF NOT EXISTS contadores ("
+    "\n  clave TEXT PRIMARY KEY,"
+    "\n  valor INTEGER NOT NULL DEFAULT 0"
+    "\n);"
+    "\n\nCREATE TABLE IF NOT EXISTS contador_pabellon ("
+    "\n  pabellon  TEXT PRIMARY KEY,"
+    "\n  celdas    INTEGER NOT NULL DEFAULT 0,"
+    "\n  capacidad INTEGER NOT NULL DEFAULT 0,"
+    "\n  ocupados  INTEGER NOT NULL DEFAULT 0"
     "\n);"
+    "\n\nCREATE TABLE IF NOT EXISTS contador_celda ("
+    "\n  celda_id  INTEGER PRIMARY KEY,"
+    "\n  pabellon  TEXT NOT NULL,"
+    "\n  capacidad INTEGER NOT NULL,"
+    "\n  ocupados  INTEGER NOT NULL DEFAULT 0"
+    "\n);"
+    "\n\nCREATE TABLE IF NOT EXISTS contador_estado ("
+    "\n  estado TEXT PRIMARY KEY,"
+    "\n  n      INTEGER NOT NULL DEFAULT 0"
+    "\n);"
+    # --- agentes
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_agentes_ai AFTER INSERT ON agentes BEGIN"
+    "\n  UPDATE contadores SET valor = valor + 1 WHERE clave = 'agentes';"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_agentes_ad AFTER DELETE ON agentes BEGIN"
+    "\n  UPDATE contadores SET valor = valor - 1 WHERE clave = 'agentes';"
+    "\nEND;"
+    # --- celdas
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_celdas_ai AFTER INSERT ON celdas BEGIN"
+    "\n  INSERT INTO contador_celda (celda_id, pabellon, capacidad, ocupados) VALUES (NEW.id, NEW.pabellon, NEW.capacidad, 0);"
+    "\n  INSERT INTO contador_pabellon (pabellon, celdas, capacidad, ocupados) VALUES (NEW.pabellon, 1, NEW.capacidad, 0)"
+    "\n    ON CONFLICT(pabellon) DO UPDATE SET celdas = celdas + 1, capacidad = capacidad + excluded.capacidad;"
+    "\n  UPDATE contadores SET valor = valor + 1 WHERE clave = 'celdas';"
+    "\n  UPDATE contadores SET valor = valor + NEW.capacidad WHERE clave = 'capacidad_total';"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_celdas_ad AFTER DELETE ON celdas BEGIN"
+    "\n  UPDATE contador_pabellon SET celdas = celdas - 1, capacidad = capacidad - OLD.capacidad,"
+    "\n    ocupados = ocupados - COALESCE((SELECT ocupados FROM contador_celda WHERE celda_id = OLD.id), 0)"
+    "\n    WHERE pabellon = OLD.pabellon;"
+    "\n  DELETE FROM contador_celda WHERE celda_id = OLD.id;"
+    "\n  DELETE FROM contador_pabellon WHERE pabellon = OLD.pabellon AND celdas <= 0;"
+    "\n  UPDATE contadores SET valor = valor - 1 WHERE clave = 'celdas';"
+    "\n  UPDATE contadores SET valor = valor - OLD.capacidad WHERE clave = 'capacidad_total';"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_celdas_au AFTER UPDATE OF id, pabellon, capacidad ON celdas BEGIN"
+    "\n  UPDATE contador_pabellon SET celdas = celdas - 1, capacidad = capacidad - OLD.capacidad,"
+    "\n    ocupados = ocupados - COALESCE((SELECT ocupados FROM contador_celda WHERE celda_id = OLD.id), 0)"
+    "\n    WHERE pabellon = OLD.pabellon;"
+    "\n  INSERT INTO contador_pabellon (pabellon, celdas, capacidad, ocupados)"
+    "\n    VALUES (NEW.pabellon, 1, NEW.capacidad, COALESCE((SELECT ocupados FROM contador_celda WHERE celda_id = OLD.id), 0))"
+    "\n    ON CONFLICT(pabellon) DO UPDATE SET celdas = celdas + 1, capacidad = capacidad + excluded.capacidad,"
+    "\n      ocupados = ocupados + excluded.ocupados;"
+    "\n  DELETE FROM contador_pabellon WHERE pabellon = OLD.pabellon AND celdas <= 0;"
+    "\n  UPDATE contador_celda SET celda_id = NEW.id, pabellon = NEW.pabellon, capacidad = NEW.capacidad"
+    "\n    WHERE celda_id = OLD.id;"
+    "\n  UPDATE contadores SET valor = valor - OLD.capacidad + NEW.capacidad WHERE clave = 'capacidad_total';"
+    "\nEND;"
+    # --- internos (ocupa cama: estado 'Activo' con celda asignada)
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_ai AFTER INSERT ON internos BEGIN"
+    "\n  UPDATE contadores SET valor = valor + 1 WHERE clave = 'internos';"
+    "\n  INSERT INTO contador_estado (estado, n) VALUES (NEW.estado, 1)"
+    "\n    ON CONFLICT(estado) DO UPDATE SET n = n + 1;"
+    "\n  UPDATE contadores SET valor = valor + 1"
+    "\n    WHERE clave = 'camas_ocupadas' AND NEW.estado = 'Activo' AND NEW.celda_id IS NOT NULL;"
+    "\n  UPDATE contador_pabellon SET ocupados = ocupados + 1"
+    "\n    WHERE NEW.estado = 'Activo' AND pabellon = (SELECT pabellon FROM contador_celda WHERE celda_id = NEW.celda_id);"
+    "\n  UPDATE contador_celda SET ocupados = ocupados + 1 WHERE NEW.estado = 'Activo' AND celda_id = NEW.celda_id;"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_ad AFTER DELETE ON internos BEGIN"
+    "\n  UPDATE contadores SET valor = valor - 1 WHERE clave = 'internos';"
+    "\n  UPDATE contador_estado SET n = n - 1 WHERE estado = OLD.estado;"
+    "\n  DELETE FROM contador_estado WHERE estado = OLD.estado AND n <= 0;"
+    "\n  UPDATE contadores SET valor = valor - 1"
+    "\n    WHERE clave = 'camas_ocupadas' AND OLD.estado = 'Activo' AND OLD.celda_id IS NOT NULL;"
+    "\n  UPDATE contador_pabellon SET ocupados = ocupados - 1"
+    "\n    WHERE OLD.estado = 'Activo' AND pabellon = (SELECT pabellon FROM contador_celda WHERE celda_id = OLD.celda_id);"
+    "\n  UPDATE contador_celda SET ocupados = ocupados - 1 WHERE OLD.estado = 'Activo' AND celda_id = OLD.celda_id;"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_au AFTER UPDATE OF estado, celda_id ON internos BEGIN"
+    "\n  UPDATE contador_estado SET n = n - 1 WHERE estado = OLD.estado;"
+    "\n  DELETE FROM contador_estado WHERE estado = OLD.estado AND n <= 0;"
+    "\n  INSERT INTO contador_estado (estado, n) VALUES (NEW.estado, 1)"
+    "\n    ON CONFLICT(estado) DO UPDATE SET n = n + 1;"
+    "\n  UPDATE contadores SET valor = valor - 1"
+    "\n    WHERE clave = 'camas_ocupadas' AND OLD.estado = 'Activo' AND OLD.celda_id IS NOT NULL;"
+    "\n  UPDATE contadores SET valor = valor + 1"
+    "\n    WHERE clave = 'camas_ocupadas' AND NEW.estado = 'Activo' AND NEW.celda_id IS NOT NULL;"
+    "\n  UPDATE contador_pabellon SET ocupados = ocupados - 1"
+    "\n    WHERE OLD.estado = 'Activo' AND pabellon = (SELECT pabellon FROM contador_celda WHERE celda_id = OLD.celda_id);"
+    "\n  UPDATE contador_celda SET ocupados = ocupados - 1 WHERE OLD.estado = 'Activo' AND celda_id = OLD.celda_id;"
+    "\n  UPDATE contador_pabellon SET ocupados = ocupados + 1"
+    "\n    WHERE NEW.estado = 'Activo' AND pabellon = (SELECT pabellon FROM contador_celda WHERE celda_id = NEW.celda_id);"
+    "\n  UPDATE contador_celda SET ocupados = ocupados + 1 WHERE NEW.estado = 'Activo' AND celda_id = NEW.celda_id;"
+    "\nEND;"
+    # --- capacidad: ninguna escritura puede dejar una celda con más internos activos que camas
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_capacidad_bi BEFORE INSERT ON internos"
+    "\n  WHEN NEW.estado = 'Activo' AND NEW.celda_id IS NOT NULL"
+    "\n   AND (SELECT ocupados >= capacidad FROM contador_celda WHERE celda_id = NEW.celda_id) BEGIN"
+    "\n  SELECT RAISE(ABORT, 'Celda sin capacidad disponible');"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_capacidad_bu BEFORE UPDATE OF estado, celda_id ON internos"
+    "\n  WHEN NEW.estado = 'Activo' AND NEW.celda_id IS NOT NULL"
+    "\n   AND NOT (OLD.estado = 'Activo' AND OLD.celda_id IS NEW.celda_id)"
+    "\n   AND (SELECT ocupados >= capacidad FROM contador_celda WHERE celda_id = NEW.celda_id) BEGIN"
+    "\n  SELECT RAISE(ABORT, 'Celda sin capacidad disponible');"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_celdas_capacidad_bu BEFORE UPDATE OF capacidad ON celdas"
+    "\n  WHEN NEW.capacidad < (SELECT ocupados FROM contador_celda WHERE celda_id = OLD.id) BEGIN"
+    "\n  SELECT RAISE(ABORT, 'La capacidad no puede ser menor a la ocupación actual');"
+    "\nEND;"
 )
 
 
-def _ensure_internos_extra_columns(db: sqlite3.Connection) -> None:
+# Búsqueda de texto (FTS5, external content): índices sobre internos y agentes
+# mantenidos por triggers. remove_diacritics hace que "perez" encuentre "Pérez".
+_FTS_TOKENIZE = "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4'"
+BUSQUEDA_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS internos_fts USING fts5("
+    "\n  nombre, apellido, dni, causa,"
+    f"\n  content = 'internos', content_rowid = 'id', {_FTS_TOKENIZE}"
+    "\n);"
+    "\n\nCREATE VIRTUAL TABLE IF NOT EXISTS agentes_fts USING fts5("
+    "\n  nombre, apellido, legajo,"
+    f"\n  content = 'agentes', content_rowid = 'id', {_FTS_TOKENIZE}"
+    "\n);"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_fts_ai AFTER INSERT ON internos BEGIN"
+    "\n  INSERT INTO internos_fts (rowid, nombre, apellido, dni, causa)"
+    "\n    VALUES (NEW.id, NEW.nombre, NEW.apellido, NEW.dni, NEW.causa);"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_fts_ad AFTER DELETE ON internos BEGIN"
+    "\n  INSERT INTO internos_fts (internos_fts, rowid, nombre, apellido, dni, causa)"
+    "\n    VALUES ('delete', OLD.id, OLD.nombre, OLD.apellido, OLD.dni, OLD.causa);"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_internos_fts_au AFTER UPDATE OF id, nombre, apellido, dni, causa ON internos BEGIN"
+    "\n  INSERT INTO internos_fts (internos_fts, rowid, nombre, apellido, dni, causa)"
+    "\n    VALUES ('delete', OLD.id, OLD.nombre, OLD.apellido, OLD.dni, OLD.causa);"
+    "\n  INSERT INTO internos_fts (rowid, nombre, apellido, dni, causa)"
+    "\n    VALUES (NEW.id, NEW.nombre, NEW.apellido, NEW.dni, NEW.causa);"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_agentes_fts_ai AFTER INSERT ON agentes BEGIN"
+    "\n  INSERT INTO agentes_fts (rowid, nombre, apellido, legajo)"
+    "\n    VALUES (NEW.id, NEW.nombre, NEW.apellido, NEW.legajo);"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_agentes_fts_ad AFTER DELETE ON agentes BEGIN"
+    "\n  INSERT INTO agentes_fts (agentes_fts, rowid, nombre, apellido, legajo)"
+    "\n    VALUES ('delete', OLD.id, OLD.nombre, OLD.apellido, OLD.legajo);"
+    "\nEND;"
+    "\n\nCREATE TRIGGER IF NOT EXISTS trg_agentes_fts_au AFTER UPDATE OF id, nombre, apellido, legajo ON agentes BEGIN"
+    "\n  INSERT INTO agentes_fts (agentes_fts, rowid, nombre, apellido, legajo)"
+    "\n    VALUES ('delete', OLD.id, OLD.nombre, OLD.apellido, OLD.legajo);"
+    "\n  INSERT INTO agentes_fts (rowid, nombre, apellido, legajo)"
+    "\n    VALUES (NEW.id, NEW.nombre, NEW.apellido, NEW.legajo);"
+    "\nEND;"
+)
+
+
+def _columnas_extra_internos(db: sqlite3.Connection) -> None:
     """Agrega columnas nuevas si faltan (idempotente)."""
     cols = {r["name"] for r in db.execute("PRAGMA table_info('internos')").fetchall()}
     if "causa" not in cols:
         db.execute("ALTER TABLE internos ADD COLUMN causa TEXT")
     if "condena_meses" not in cols:
         db.execute("ALTER TABLE internos ADD COLUMN condena_meses INTEGER CHECK (condena_meses >= 0)")
+
+def normalizar_fechas_ingreso(db: sqlite3.Connection) -> Dict[str, int]:
+    """
+    Reescribe fecha_ingreso a 'YYYY-MM-DD' donde SQLite la puede interpretar
+    (p.ej. '2025-08-20 10:00:00'). Devuelve cuántas se normalizaron y cuántas
+    quedaron sin poder interpretarse (requieren corrección manual). No hace commit.
+    """
+    cur = db.execute("""
+        UPDATE internos SET fecha_ingreso = date(fecha_ingreso)
+        WHERE fecha_ingreso IS NOT date(fecha_ingreso) AND date(fecha_ingreso) IS NOT NULL
+    """)
+    invalidas = db.execute(
+        "SELECT COUNT(*) FROM internos WHERE date(fecha_ingreso) IS NULL"
+    ).fetchone()[0]
+    return {"normalizadas": cur.rowcount, "invalidas": invalidas}
+
+# Índices de consulta (también los reaplica POST /db/indexes). dni ya tiene el índice de su UNIQUE.
+INDICES_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_internos_estado ON internos(estado);"
+    "\nCREATE INDEX IF NOT EXISTS idx_internos_celda  ON internos(celda_id);"
+    "\nCREATE INDEX IF NOT EXISTS idx_internos_fecha  ON internos(fecha_ingreso);"
+    "\nCREATE INDEX IF NOT EXISTS idx_internos_reporte ON internos(fecha_ingreso DESC, apellido, nombre, id DESC);"
+    "\nCREATE INDEX IF NOT EXISTS idx_celdas_pabellon ON celdas(pabellon);"
+    "\nCREATE INDEX IF NOT EXISTS idx_internos_orden  ON internos(apellido, nombre, id);"
+    "\nCREATE INDEX IF NOT EXISTS idx_agentes_orden   ON agentes(apellido, nombre, id);"
+)
+
+
+def fts_disponible(db: sqlite3.Connection) -> bool:
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'internos_fts'"
+    ).fetchone() is not None
+
+def _init_busqueda(db: sqlite3.Connection) -> None:
+    """Crea los índices FTS5 (si SQLite los soporta) y los llena la primera vez."""
+    nuevo = not fts_disponible(db)
+    try:
+        ejecutar_script(db, BUSQUEDA_SQL)
+    except sqlite3.OperationalError:
+        return                            # SQLite compilado sin FTS5: /buscar responde 501
+    if nuevo:
+        db.execute("INSERT INTO internos_fts (internos_fts) VALUES ('rebuild')")
+        db.execute("INSERT INTO agentes_fts (agentes_fts) VALUES ('rebuild')")
+
+
+# --- Contadores de ocupación ---
+CONTADORES_CLAVES = ("internos", "celdas", "agentes", "capacidad_total", "camas_ocupadas")
+
+def _contadores_esperados(db: sqlite3.Connection) -> Dict[str, Dict[Any, tuple]]:
+    """Recalcula desde cero lo que los triggers deberían haber acumulado."""
+    totales = db.execute("""
+        SELECT (SELECT COUNT(*) FROM internos),
+               (SELECT COUNT(*) FROM celdas),
+               (SELECT COUNT(*) FROM agentes),
+               (SELECT COALESCE(SUM(capacidad), 0) FROM celdas),
+               (SELECT COUNT(*) FROM internos WHERE estado = 'Activo' AND celda_id IS NOT NULL)
+    """).fetchone()
+    celdas = db.execute("""
+        SELECT c.id, c.pabellon, c.capacidad,
+               COALESCE(SUM(CASE WHEN i.estado = 'Activo' THEN 1 ELSE 0 END), 0)
+        FROM celdas c
+        LEFT JOIN internos i ON i.celda_id = c.id
+        GROUP BY c.id
+    """).fetchall()
+    pabellones: Dict[Any, tuple] = {}
+    for _, pab, cap, occ in celdas:
+        n, c, o = pabellones.get(pab, (0, 0, 0))
+        pabellones[pab] = (n + 1, c + cap, o + occ)
+    estados = db.execute("SELECT estado, COUNT(*) FROM internos GROUP BY estado").fetchall()
+    return {
+        "contadores": {k: (v,) for k, v in zip(CONTADORES_CLAVES, totales)},
+        "contador_celda": {r[0]: (r[1], r[2], r[3]) for r in celdas},
+        "contador_pabellon": pabellones,
+        "contador_estado": {e: (n,) for e, n in estados},
+    }
+
+_CONTADORES_TABLAS = {
+    # tabla: (columna clave, columnas de valor)
+    "contadores": ("clave", ("valor",)),
+    "contador_celda": ("celda_id", ("pabellon", "capacidad", "ocupados")),
+    "contador_pabellon": ("pabellon", ("celdas", "capacidad", "ocupados")),
+    "contador_estado": ("estado", ("n",)),
+}
+
+def reconciliar_contadores(db: sqlite3.Connection, commit: bool = True) -> List[Dict[str, Any]]:
+    """
+    Reconstruye las tablas contador_* a partir de los datos y devuelve los desvíos
+    encontrados (lista vacía si los triggers estaban al día). Hace commit salvo con
+    commit=False (dentro de una migración, que confirma junto con user_version).
+    """
+    if not db.in_transaction:
+        begin_immediate(db)               # lectura y reescritura sobre la misma foto
+    esperados = _contadores_esperados(db)
+    desvios: List[Dict[str, Any]] = []
+    for tabla, (clave, valores) in _CONTADORES_TABLAS.items():
+        cols = ", ".join((clave,) + valores)
+        actuales = {r[0]: tuple(r[1:]) for r in db.execute(f"SELECT {cols} FROM {tabla}")}
+        esperado = esperados[tabla]
+        for k in sorted(set(actuales) | set(esperado), key=str):
+            if actuales.get(k) != esperado.get(k):
+                desvios.append({
+                    "tabla": tabla,
+                    "clave": k,
+                    "actual": dict(zip(valores, actuales[k])) if k in actuales else None,
+                    "esperado": dict(zip(valores, esperado[k])) if k in esperado else None,
+                })
+        db.execute(f"DELETE FROM {tabla}")
+        db.executemany(
+            f"INSERT INTO {tabla} ({cols}) VALUES ({', '.join('?' * (1 + len(valores)))})",
+            [(k,) + v for k, v in esperado.items()],
+        )
+    if commit:
+        db.commit()
+    return desvios
+
+def celdas_sobre_capacidad(db: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """Celdas con más internos activos que camas: datos cargados antes de los triggers de capacidad."""
+    return [dict(zip(("celda_id", "pabellon", "numero", "capacidad", "ocupados"), r)) for r in db.execute(
+        "SELECT c.id, c.pabellon, c.numero, c.capacidad, COUNT(*)"
+        "\nFROM celdas c JOIN internos i ON i.celda_id = c.id AND i.estado = 'Activo'"
+        "\nGROUP BY c.id HAVING COUNT(*) > c.capacidad ORDER BY c.id")]
+
+
+# --- Histórico de ocupación ---
+# Una fila por día (foto de contador_pabellon / contador_estado) y rollups semanales y mensuales
+# con promedios y máximos. La clave (granularidad, periodo, ...) hace que un rango de un año
+# sea un range scan de ~12 filas por pabellón en vez de recorrer internos.
+HISTORICO_SQL = (
+    "CREATE TABLE IF NOT EXISTS historico_pabellon ("
+    "\n  granularidad TEXT NOT NULL CHECK (granularidad IN ('dia','semana','mes')),"
+    "\n  periodo   TEXT NOT NULL,"             # YYYY-MM-DD: el día, el lunes de la semana o el 1° del mes
+    "\n  pabellon  TEXT NOT NULL,"
+    "\n  dias      INTEGER NOT NULL,"          # días con foto dentro del período
+    "\n  capacidad REAL NOT NULL,"             # promedio en el período
+    "\n  ocupados  REAL NOT NULL,"             # promedio en el período
+    "\n  ocupados_max INTEGER NOT NULL,"
+    "\n  PRIMARY KEY (granularidad, periodo, pabellon)"
+    "\n) WITHOUT ROWID;"
+    "\n\nCREATE TABLE IF NOT EXISTS historico_estado ("
+    "\n  granularidad TEXT NOT NULL CHECK (granularidad IN ('dia','semana','mes')),"
+    "\n  periodo TEXT NOT NULL,"
+    "\n  estado  TEXT NOT NULL,"
+    "\n  dias    INTEGER NOT NULL,"
+    "\n  n       REAL NOT NULL,"                # promedio en el período
+    "\n  n_max   INTEGER NOT NULL,"
+    "\n  PRIMARY KEY (granularidad, periodo, estado)"
+    "\n) WITHOUT ROWID;"
+)
+
+Granularidad = Literal["dia", "semana", "mes"]
+
+def inicio_periodo(fecha: date, granularidad: Granularidad) -> date:
+    if granularidad == "semana":
+        return fecha - timedelta(days=fecha.weekday())
+    if granularidad == "mes":
+        return fecha.replace(day=1)
+    return fecha
+
+def _fin_periodo(inicio: date, granularidad: Granularidad) -> date:
+    if granularidad == "semana":
+        return inicio + timedelta(days=6)
+    if granularidad == "mes":
+        siguiente = (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return siguiente - timedelta(days=1)
+    return inicio
+
+def tomar_snapshot(db: sqlite3.Connection, fecha: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Guarda la foto del día (por defecto hoy) desde los contadores y recalcula la semana
+    y el mes que la contienen. Los estados suman los internos archivados, para que la
+    serie no salte cuando se archiva. Idempotente: repetirla en el día reemplaza la foto con el
+    estado más reciente. No hace commit (corre dentro de `escribir` o del CLI).
+    """
+    fecha = fecha or date.today()
+    dia = fecha.isoformat()
+    db.execute("DELETE FROM historico_pabellon WHERE granularidad = 'dia' AND periodo = ?", (dia,))
+    db.execute("DELETE FROM historico_estado WHERE granularidad = 'dia' AND periodo = ?", (dia,))
+    pabellones = db.execute(
+        "INSERT INTO historico_pabellon (granularidad, periodo, pabellon, dias, capacidad, ocupados, ocupados_max)"
+        " SELECT 'dia', ?, pabellon, 1, capacidad, ocupados, ocupados FROM contador_pabellon",
+        (dia,)).rowcount
+    estados = db.execute(
+        "INSERT INTO historico_estado (granularidad, periodo, estado, dias, n, n_max)"
+        " SELECT 'dia', ?, estado, 1, SUM(n), SUM(n) FROM ("
+        "   SELECT estado, n FROM contador_estado"
+        "   UNION ALL SELECT estado, COUNT(*) FROM archivo.internos GROUP BY estado"
+        " ) GROUP BY estado",
+        (dia,)).rowcount
+    for g in ("semana", "mes"):
+        ini = inicio_periodo(fecha, g)
+        rango = (ini.isoformat(), _fin_periodo(ini, g).isoformat())
+        db.execute("DELETE FROM historico_pabellon WHERE granularidad = ? AND periodo = ?", (g, rango[0]))
+        db.execute("DELETE FROM historico_estado WHERE granularidad = ? AND periodo = ?", (g, rango[0]))
+        db.execute(
+            "INSERT INTO historico_pabellon (granularidad, periodo, pabellon, dias, capacidad, ocupados, ocupados_max)"
+            " SELECT ?, ?, pabellon, COUNT(*), AVG(capacidad), AVG(ocupados), MAX(ocupados_max)"
+            " FROM historico_pabellon WHERE granularidad = 'dia' AND periodo BETWEEN ? AND ?"
+            " GROUP BY pabellon",
+            (g, rango[0]) + rango)
+        db.execute(
+            "INSERT INTO historico_estado (granularidad, periodo, estado, dias, n, n_max)"
+            " SELECT ?, ?, estado, COUNT(*), AVG(n), MAX(n_max)"
+            " FROM historico_estado WHERE granularidad = 'dia' AND periodo BETWEEN ? AND ?"
+            " GROUP BY estado",
+            (g, rango[0]) + rango)
+    marcar_cambio(db, "historico")
+    return {"fecha": dia, "pabellones": pabellones, "estados": estados}
+
+
+# --- Archivo de internos (base adjunta `archivo`) ---
+# Los internos Trasladados/Liberados con ingreso anterior al corte se mueven por lotes a
+# otro archivo. `internos` queda chico y las consultas de todos los días (listados,
+# contadores, reportes) no pagan por ellos; con incluir_archivo=true se suman vía UNION ALL.
+ARCHIVO_ANTIGUEDAD_DIAS = int(os.environ.get("PENITENCIARIO_ARCHIVO_ANTIGUEDAD_DIAS", 365 * 2))
+ARCHIVO_LOTE = 1000
+
+INTERNOS_COLUMNAS = "id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses"
+
+ARCHIVO_SQL = (
+    "CREATE TABLE IF NOT EXISTS archivo.internos ("
+    "\n  id INTEGER PRIMARY KEY,"
+    "\n  dni TEXT,"                   # sin UNIQUE: el DNI puede reingresar a la tabla activa
+    "\n  nombre   TEXT NOT NULL,"
+    "\n  apellido TEXT NOT NULL,"
+    "\n  fecha_ingreso TEXT NOT NULL,"
+    "\n  estado   TEXT NOT NULL CHECK (estado IN ('Trasladado','Liberado')),"
+    "\n  celda_id INTEGER,"
+    "\n  causa TEXT,"
+    "\n  condena_meses INTEGER,"
+    "\n  archivado_en TEXT NOT NULL"
+    "\n);"
+    "\nCREATE INDEX IF NOT EXISTS archivo.idx_archivo_orden   ON internos(apellido, nombre, id);"
+    "\nCREATE INDEX IF NOT EXISTS archivo.idx_archivo_reporte ON internos(fecha_ingreso DESC, apellido, nombre, id DESC);"
+    "\nCREATE INDEX IF NOT EXISTS archivo.idx_archivo_dni     ON internos(dni);"
+    "\nCREATE INDEX IF NOT EXISTS archivo.idx_archivo_estado  ON internos(estado);"
+)
+
+def internos_desde(incluir_archivo: bool) -> str:
+    """Fuente para `FROM`: la tabla activa o su unión con el archivo (mismas columnas)."""
+    if not incluir_archivo:
+        return "internos"
+    return (f"(SELECT {INTERNOS_COLUMNAS} FROM main.internos"
+            f" UNION ALL SELECT {INTERNOS_COLUMNAS} FROM archivo.internos)")
+
+def archivar_lote(db: sqlite3.Connection, corte: date, lote: int = ARCHIVO_LOTE) -> int:
+    """
+    Mueve hasta `lote` internos no activos con ingreso anterior a `corte`. No hace commit.
+    En WAL la transacción es atómica por base y no entre bases: si un corte deja la fila
+    en las dos, la próxima corrida la borra de la activa, pero solo si es idéntica a la
+    copia archivada. Los ids no se reutilizan (AUTOINCREMENT, piso en el máximo archivado).
+    """
+    iguales = " AND ".join(f"m.{c} IS a.{c}" for c in INTERNOS_COLUMNAS.split(", ")[1:])
+    db.execute(
+        "DELETE FROM main.internos WHERE id IN ("
+        " SELECT m.id FROM main.internos m JOIN archivo.internos a ON a.id = m.id"
+        f" WHERE {iguales})")
+    ids = [r[0] for r in db.execute(
+        "SELECT id FROM main.internos"
+        " WHERE fecha_ingreso < ? AND estado != 'Activo'"
+        "   AND id NOT IN (SELECT id FROM archivo.internos)"
+        " LIMIT ?", (corte.isoformat(), lote))]
+    if not ids:
+        return 0
+    marcas = ",".join("?" * len(ids))
+    db.execute(
+        f"INSERT INTO archivo.internos ({INTERNOS_COLUMNAS}, archivado_en)"
+        f" SELECT {INTERNOS_COLUMNAS}, date('now') FROM main.internos WHERE id IN ({marcas})", ids)
+    db.execute(f"DELETE FROM main.internos WHERE id IN ({marcas})", ids)   # triggers: contadores y FTS
+    return len(ids)
+
+def corte_archivo(antiguedad_dias: int = ARCHIVO_ANTIGUEDAD_DIAS, hoy: Optional[date] = None) -> date:
+    return (hoy or date.today()) - timedelta(days=antiguedad_dias)
+
+
+# --- Registro de cambios (feed de GET /eventos) ---
+# Triggers agregan una fila por alta/cambio/baja en las tablas de negocio, así queda
+# registrado todo lo que escribe (handlers, carga masiva, CLI). El id AUTOINCREMENT no se
+# reutiliza nunca: es el Last-Event-ID con el que un cliente SSE retoma donde quedó.
+EVENTOS_TABLAS = ("celdas", "agentes", "internos")
+EVENTOS_RETENCION = int(os.environ.get("PENITENCIARIO_EVENTOS_RETENCION", 100_000))   # filas que se conservan
+
+EVENTOS_TRIGGERS_SQL = "".join(
+    f"\n\nCREATE TRIGGER IF NOT EXISTS trg_{t}_ev_ai AFTER INSERT ON {t} BEGIN"
+    f"\n  INSERT INTO eventos (tabla, op, fila_id) VALUES ('{t}', 'alta', NEW.id);"
+    "\nEND;"
+    f"\n\nCREATE TRIGGER IF NOT EXISTS trg_{t}_ev_au AFTER UPDATE ON {t} BEGIN"
+    f"\n  INSERT INTO eventos (tabla, op, fila_id) VALUES ('{t}', 'cambio', NEW.id);"
+    "\nEND;"
+    f"\n\nCREATE TRIGGER IF NOT EXISTS trg_{t}_ev_ad AFTER DELETE ON {t} BEGIN"
+    f"\n  INSERT INTO eventos (tabla, op, fila_id) VALUES ('{t}', 'baja', OLD.id);"
+    "\nEND;"
+    for t in EVENTOS_TABLAS
+)
+EVENTOS_SQL = (
+    "CREATE TABLE IF NOT EXISTS eventos ("
+    "\n  id      INTEGER PRIMARY KEY AUTOINCREMENT,"
+    "\n  ts      TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),"
+    "\n  tabla   TEXT NOT NULL,"
+    "\n  op      TEXT NOT NULL CHECK (op IN ('alta', 'cambio', 'baja')),"
+    "\n  fila_id INTEGER NOT NULL"
+    "\n);"
+    + EVENTOS_TRIGGERS_SQL
+)
+
+def podar_eventos(db: sqlite3.Connection, retener: int = EVENTOS_RETENCION) -> int:
+    """Borra los eventos más viejos que las últimas `retener` filas. No hace commit."""
+    return db.execute("DELETE FROM eventos WHERE id <= (SELECT MAX(id) FROM eventos) - ?", (retener,)).rowcount
+
+
+# --- Marcas de cambio entre procesos ---
+# Un contador en memoria solo ve lo que escribe su proceso. Para ETags y cachés de resultados
+# hace falta algo que vea también otros workers y el CLI: el último evento (los triggers
+# registran toda escritura en celdas/agentes/internos, y de ellas derivan los contadores)
+# y, para lo que se escribe sin eventos (histórico, reconciliación), un contador por tabla.
+MARCAS_SQL = (
+    "CREATE TABLE IF NOT EXISTS marcas_cambio ("
+    "\n  tabla   TEXT PRIMARY KEY,"
+    "\n  version INTEGER NOT NULL"
+    "\n) WITHOUT ROWID;"
+)
+_TABLAS_CON_EVENTOS = EVENTOS_TABLAS + ("contadores",)
+
+def marcar_cambio(db: sqlite3.Connection, *tablas: str) -> None:
+    """Anota que `tablas` cambiaron por fuera de los triggers de eventos. No hace commit."""
+    db.executemany(
+        "INSERT INTO marcas_cambio (tabla, version) VALUES (?, 1)"
+        " ON CONFLICT (tabla) DO UPDATE SET version = version + 1",
+        [(t,) for t in tablas])
+
+def marca_cambios(db: sqlite3.Connection, *tablas: str) -> tuple:
+    """
+    Token que cambia con cualquier escritura a `tablas` (sin tablas: a cualquiera), venga
+    de este proceso o de otro. El último evento va con su ts: tras restaurar un respaldo los
+    ids se repiten, pero no con el mismo instante. Sin tablas suma schema_version.
+    """
+    if not tablas:
+        ev = db.execute("SELECT id, ts FROM eventos ORDER BY id DESC LIMIT 1").fetchone()
+        marcas = db.execute("SELECT tabla, version FROM marcas_cambio ORDER BY tabla").fetchall()
+        return (tuple(ev or ()), tuple(map(tuple, marcas)), db.execute("PRAGMA schema_version").fetchone()[0])
+    ev = ()
+    if any(t in _TABLAS_CON_EVENTOS for t in tablas):
+        ev = tuple(db.execute("SELECT id, ts FROM eventos ORDER BY id DESC LIMIT 1").fetchone() or ())
+    marcas = db.execute(
+        f"SELECT tabla, version FROM marcas_cambio WHERE tabla IN ({', '.join('?' * len(tablas))}) ORDER BY tabla",
+        tablas).fetchall()
+    return (ev, tuple(map(tuple, marcas)))
+
+
+# --- Migraciones (PRAGMA user_version) ---
+# Cada paso sube user_version en la misma transacción que aplica, así que una base al
+# día no ejecuta nada y una migración cortada se retoma desde el paso que faltó. Los
+# pasos son idempotentes: una base anterior a este esquema de versiones (user_version 0)
+# los recorre todos sin romper lo que ya tenía.
+MIGRACION_LOTE = 5000   # filas por transacción al reconstruir tablas
+
+@dataclass(frozen=True)
+class Migracion:
+    version: int
+    descripcion: str
+    aplicar: Callable[[sqlite3.Connection], Any]   # si devuelve un dict, va al resultado de migrar
+
+def sentencias(script: str) -> Iterator[str]:
+    """Parte un script en sentencias sueltas (los triggers llevan ';' dentro de BEGIN...END)."""
+    actual = ""
+    for parte in script.split(";"):
+        actual += parte + ";"
+        if sqlite3.complete_statement(actual):
+            if actual.strip(" \n;"):
+                yield actual.strip()
+            actual = ""
+
+def ejecutar_script(db: sqlite3.Connection, script: str) -> None:
+    """Como executescript pero dentro de la transacción en curso (executescript hace COMMIT)."""
+    for sql in sentencias(script):
+        db.execute(sql)
+
+def _script(sql: str) -> Callable[[sqlite3.Connection], None]:
+    return lambda db: ejecutar_script(db, sql)
+
+def _contadores(db: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+    ejecutar_script(db, CONTADORES_SQL)
+    if db.execute("SELECT COUNT(*) FROM contadores").fetchone()[0] == 0:
+        reconciliar_contadores(db, commit=False)   # primera vez: se siembran desde los datos existentes
+    # Los triggers de capacidad no validan lo que ya estaba: esas celdas quedan sobre su
+    # capacidad y rechazan altas y subas de capacidad menores a la ocupación hasta corregirlas
+    sobre = celdas_sobre_capacidad(db)
+    if not sobre:
+        return None
+    return {
+        "celdas_sobre_capacidad": sobre,
+        "avisos": [f"{len(sobre)} celda(s) con más internos activos que capacidad: no admiten nuevos "
+                   "internos ni una capacidad menor a su ocupación hasta reubicar o ampliar"],
+    }
+
+def reconstruir_tabla(
+    db: sqlite3.Connection,
+    tabla: str,
+    definicion: str,
+    columnas: List[str],
+    recrear: Callable[[sqlite3.Connection], None],
+    lote: int = MIGRACION_LOTE,
+) -> int:
+    """
+    Reemplaza `tabla` por una nueva con `definicion` (cuerpo del CREATE TABLE), para
+    cambios que ALTER TABLE no permite (agregar un CHECK). Copia por rangos de rowid, un
+    lote por transacción: nadie espera el lock de escritura más que un lote. Lo que se
+    escribe en `tabla` mientras tanto queda anotado por triggers en `_migracion_cambios`
+    y se vuelve a copiar en la transacción final, que cambia una tabla por otra y corre
+    `recrear` (índices y triggers). Esa última queda abierta: la confirma `migrar`.
+    """
+    nueva, cols = f"{tabla}_nueva", ", ".join(columnas)
+    begin_immediate(db)
+    db.execute(f"DROP TABLE IF EXISTS {nueva}")     # resto de una corrida interrumpida
+    db.execute(f"CREATE TABLE {nueva} ({definicion})")
+    db.execute("CREATE TABLE IF NOT EXISTS _migracion_cambios (rid INTEGER PRIMARY KEY)")
+    db.execute("DELETE FROM _migracion_cambios")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS _migracion_{tabla}_ai AFTER INSERT ON {tabla} BEGIN"
+               " INSERT OR IGNORE INTO _migracion_cambios VALUES (NEW.rowid); END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS _migracion_{tabla}_au AFTER UPDATE ON {tabla} BEGIN"
+               " INSERT OR IGNORE INTO _migracion_cambios VALUES (OLD.rowid);"
+               " INSERT OR IGNORE INTO _migracion_cambios VALUES (NEW.rowid); END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS _migracion_{tabla}_ad AFTER DELETE ON {tabla} BEGIN"
+               " INSERT OR IGNORE INTO _migracion_cambios VALUES (OLD.rowid); END")
     db.commit()
 
-def init_db(db: sqlite3.Connection) -> None:
-    db.executescript(SCHEMA_SQL)          # crea tablas si faltan
-    _ensure_internos_extra_columns(db)    # migra columnas nuevas si ya existía la tabla
+    copiadas, ultimo = 0, -(2 ** 63)
+    while True:
+        begin_immediate(db)
+        hasta = db.execute(
+            f"SELECT MAX(rowid) FROM (SELECT rowid FROM {tabla} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (ultimo, lote)).fetchone()[0]
+        if hasta is None:
+            db.commit()
+            break
+        copiadas += db.execute(
+            f"INSERT INTO {nueva} ({cols}) SELECT {cols} FROM {tabla} WHERE rowid > ? AND rowid <= ?",
+            (ultimo, hasta)).rowcount
+        db.commit()
+        ultimo = hasta
+
+    begin_immediate(db)
+    cambios = "SELECT rid FROM _migracion_cambios"
+    db.execute(f"DELETE FROM {nueva} WHERE rowid IN ({cambios})")
+    db.execute(f"INSERT INTO {nueva} ({cols}) SELECT {cols} FROM {tabla} WHERE rowid IN ({cambios})")
+    db.execute("DROP TABLE _migracion_cambios")
+    db.execute(f"DROP TABLE {tabla}")             # se lleva sus índices y triggers
+    # Sin el modo legacy, RENAME revalida los triggers de otras tablas que nombran a
+    # `tabla` y falla porque en este instante no existe.
+    db.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        db.execute(f"ALTER TABLE {nueva} RENAME TO {tabla}")
+    finally:
+        db.execute("PRAGMA legacy_alter_table = OFF")
+    recrear(db)
+    if db.execute(f"PRAGMA foreign_key_check({tabla})").fetchone() is not None:
+        raise sqlite3.IntegrityError(f"{tabla}: claves foráneas rotas tras la reconstrucción")
+    # DROP TABLE se llevó sus filas de sqlite_stat1: sin ellas el planner elige a ciegas
+    if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        db.execute("PRAGMA analysis_limit = 1000")
+        db.execute(f"ANALYZE {tabla}")
+    return copiadas
+
+def _recrear_dependientes_internos(db: sqlite3.Connection) -> None:
+    ejecutar_script(db, SCHEMA_SQL)       # índices y triggers de fecha
+    ejecutar_script(db, CONTADORES_SQL)
+    ejecutar_script(db, INDICES_SQL)
+    if fts_disponible(db):
+        ejecutar_script(db, BUSQUEDA_SQL)
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'eventos'").fetchone():
+        ejecutar_script(db, EVENTOS_TRIGGERS_SQL)
+
+def _internos_check_celda(db: sqlite3.Connection) -> None:
+    """Un interno no Activo no ocupa celda: lo validaba solo la API, ahora también la base."""
+    actual = db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'internos'").fetchone()[0]
+    if CHECK_CELDA_ACTIVO in actual:
+        return                            # base creada con el esquema actual
+    db.execute("UPDATE internos SET celda_id = NULL WHERE estado != 'Activo' AND celda_id IS NOT NULL")
     db.commit()
+    reconstruir_tabla(db, "internos", INTERNOS_DEF, INTERNOS_COLUMNAS.split(", "), _recrear_dependientes_internos)
+
+def piso_secuencia_internos(db: sqlite3.Connection) -> None:
+    """Lleva la secuencia de internos por encima de todo id archivado. No hace commit."""
+    piso = db.execute("SELECT COALESCE(MAX(id), 0) FROM archivo.internos").fetchone()[0]
+    if db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'internos'", (piso,)).rowcount == 0:
+        db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('internos', ?)", (piso,))
+
+def _internos_autoincrement(db: sqlite3.Connection) -> None:
+    actual = db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'internos'").fetchone()[0]
+    if "AUTOINCREMENT" not in actual.upper():
+        db.commit()
+        reconstruir_tabla(db, "internos", INTERNOS_DEF, INTERNOS_COLUMNAS.split(", "), _recrear_dependientes_internos)
+    piso_secuencia_internos(db)
+
+MIGRACIONES: List[Migracion] = [
+    Migracion(1, "esquema base: celdas, agentes, internos", _script(SCHEMA_SQL)),
+    Migracion(2, "internos: columnas causa y condena_meses", _columnas_extra_internos),
+    Migracion(3, "internos: fecha_ingreso normalizada a YYYY-MM-DD", normalizar_fechas_ingreso),
+    Migracion(4, "contadores de ocupación + triggers", _contadores),
+    Migracion(5, "histórico de ocupación", _script(HISTORICO_SQL)),
+    Migracion(6, "base adjunta de archivo", _script(ARCHIVO_SQL)),
+    Migracion(7, "búsqueda FTS5", lambda db: _init_busqueda(db)),
+    Migracion(8, "índices de consulta", _script(INDICES_SQL)),
+    Migracion(9, "internos: CHECK de celda solo para Activos (reconstrucción por lotes)", _internos_check_celda),
+    Migracion(10, "sin tabla meta (la reemplaza user_version)", _script("DROP TABLE IF EXISTS meta")),
+    Migracion(11, "registro de cambios para GET /eventos", _script(EVENTOS_SQL)),
+    Migracion(12, "internos: ids AUTOINCREMENT, sin reutilizar ids archivados", _internos_autoincrement),
+    Migracion(13, "marcas de cambio para ETags y cachés entre procesos", _script(MARCAS_SQL)),
+]
+ESQUEMA_VERSION = MIGRACIONES[-1].version
+
+def version_esquema(db: sqlite3.Connection) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def archivo_listo(db: sqlite3.Connection) -> bool:
+    return db.execute("SELECT 1 FROM archivo.sqlite_master WHERE name = 'internos'").fetchone() is not None
+
+def migrar(db: sqlite3.Connection, hasta: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Aplica en orden las migraciones pendientes y devuelve las que corrió."""
+    aplicadas: List[Dict[str, Any]] = []
+    actual = version_esquema(db)
+    # La base de archivo es otro archivo: user_version de la principal no dice si existe
+    # (copia o restauración solo de la principal, archivo borrado). Se recrea vacía.
+    if actual >= 6 and not archivo_listo(db):
+        t0 = time.perf_counter()
+        begin_immediate(db)
+        ejecutar_script(db, ARCHIVO_SQL)
+        db.commit()
+        aplicadas.append({"version": 6, "descripcion": "base adjunta de archivo (recreada)",
+                          "duracion_s": round(time.perf_counter() - t0, 3)})
+    for m in MIGRACIONES:
+        if m.version <= actual or (hasta is not None and m.version > hasta):
+            continue
+        t0 = time.perf_counter()
+        begin_immediate(db)
+        try:
+            resultado = m.aplicar(db)
+            if not db.in_transaction:     # los pasos por lotes confirman por su cuenta
+                begin_immediate(db)
+            db.execute(f"PRAGMA user_version = {m.version}")
+            db.commit()
+        except BaseException:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        aplicadas.append({"version": m.version, "descripcion": m.descripcion,
+                          "duracion_s": round(time.perf_counter() - t0, 3)})
+        if isinstance(resultado, dict) and resultado:
+            aplicadas[-1]["resultado"] = resultado
+    return aplicadas
+
+def init_db(db: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """Lleva la base al esquema actual. Sin migraciones pendientes no toca nada."""
+    return migrar(db)
+
+
+# --- Arranque con varios workers ---
+# Cada worker de uvicorn corre el lifespan. Si la base está al día alcanza con leer
+# user_version; si no, un flock sobre un archivo junto a la base hace que migre uno solo
+# y los demás esperen y encuentren la versión ya actualizada.
+_inicio_lock = threading.Lock()
+
+@contextmanager
+def lock_inicio(path: Path) -> Iterator[None]:
+    """Lock exclusivo entre procesos (`<db>.lock`); bloquea hasta obtenerlo."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _inicio_lock, open(path.with_name(path.name + ".lock"), "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def init_db_una_vez(config: Optional[PoolConfig] = None) -> bool:
+    """Migra si hace falta. Devuelve True si este proceso aplicó alguna migración."""
+    cfg = config or PoolConfig.from_env()
+    conn = connect(cfg)
+    try:
+        if version_esquema(conn) >= ESQUEMA_VERSION and archivo_listo(conn):
+            return False
+        with lock_inicio(cfg.path):
+            aplicadas = migrar(conn)      # si otro worker ya migró, no queda nada pendiente
+        for a in aplicadas:
+            for aviso in a.get("resultado", {}).get("avisos", []):
+                print(f"migración {a['version']}: {aviso}", file=sys.stderr)
+        return bool(aplicadas)
+    finally:
+        conn.close()
+
+
+# --- Respaldos en caliente (backup API) ---
+BACKUP_PAGINAS = 256    # páginas por paso (1 MiB con páginas de 4 KiB)
+BACKUP_PAUSA = 0.01     # segundos entre pasos
+
+def backup_dir() -> Path:
+    """Carpeta de respaldos. Se lee del entorno al usarla, como la ruta de la base en PoolConfig."""
+    return Path(os.environ.get("PENITENCIARIO_BACKUP_DIR", DB_DIR / "backups"))
+
+def sha256_archivo(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _checksum_guardado(path: Path) -> Optional[str]:
+    lateral = path.with_name(path.name + ".sha256")
+    if not lateral.exists():
+        return None
+    return lateral.read_text(encoding="utf-8").split()[0]
+
+def archivo_de_respaldo(path: Path) -> Path:
+    """El respaldo de la base `archivo` va al lado del de la principal, con el mismo nombre que usa ruta_archivo."""
+    return path.with_name(path.stem + "-archivo" + path.suffix)
+
+def _copiar(src: sqlite3.Connection, nombre: str, destino: Path, paginas: int,
+            progreso: Callable[[int, int, int], None]) -> Dict[str, Any]:
+    parcial = destino.with_name(destino.name + ".parcial")
+    parcial.unlink(missing_ok=True)
+    dst = sqlite3.connect(parcial)
+    try:
+        src.backup(dst, pages=paginas, progress=progreso, name=nombre)
+        dst.execute("PRAGMA journal_mode = DELETE")
+        chequeo = dst.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        dst.close()
+    if chequeo != "ok":
+        parcial.unlink(missing_ok=True)
+        raise sqlite3.DatabaseError(f"El respaldo de {nombre} no pasó quick_check: {chequeo}")
+    checksum = sha256_archivo(parcial)
+    parcial.replace(destino)
+    destino.with_name(destino.name + ".sha256").write_text(f"{checksum}  {destino.name}\n", encoding="utf-8")
+    return {"destino": str(destino), "bytes": destino.stat().st_size, "sha256": checksum}
+
+def respaldar(
+    destino: Optional[Path] = None,
+    config: Optional[PoolConfig] = None,
+    paginas: int = BACKUP_PAGINAS,
+    pausa: float = BACKUP_PAUSA,
+    progreso: Optional[Callable[[int, int], None]] = None,
+    fijar: Optional[Callable[[], ContextManager]] = None,
+) -> Dict[str, Any]:
+    """
+    Copia la base y su `archivo` con la backup API de a `paginas` por paso, durmiendo `pausa`
+    entre pasos. Las dos fotos se toman en una misma transacción de lectura que dura toda la
+    copia: es consistente y no se reinicia aunque el escritor siga commiteando (en WAL un
+    lector no lo bloquea). Un commit que abarca las dos bases no es atómico entre archivos:
+    `fijar` (p. ej. tomar la conexión escritora) se sostiene solo mientras se abren las fotos,
+    para que ninguna caiga a mitad de un archivado. Deja archivos en modo DELETE,
+    autocontenidos, cada uno con su .sha256 al lado.
+    """
+    cfg = config or PoolConfig.from_env()
+    destino = destino or backup_dir() / f"penitenciario-{time.strftime('%Y%m%d-%H%M%S')}.db"
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    hechas_previas = [0]
+
+    def _paso(status: int, restantes: int, total: int) -> None:
+        if progreso:
+            progreso(hechas_previas[0] + total - restantes, hechas_previas[0] + total)
+        if restantes and pausa > 0:
+            time.sleep(pausa)
+
+    src = connect(cfg, readonly=True)
+    try:
+        with (fijar() if fijar else nullcontext()):
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM main.sqlite_master").fetchone()      # fija las fotos de lectura
+            src.execute("SELECT COUNT(*) FROM archivo.sqlite_master").fetchone()
+        principal = _copiar(src, "main", destino, paginas, _paso)
+        hechas_previas[0] = src.execute("PRAGMA main.page_count").fetchone()[0]
+        archivo = _copiar(src, "archivo", archivo_de_respaldo(destino), paginas, _paso)
+        src.rollback()
+    finally:
+        src.close()
+    return {**principal, "archivo": archivo, "duracion_s": round(time.perf_counter() - t0, 3)}
+
+def listar_respaldos(directorio: Optional[Path] = None) -> List[Dict[str, Any]]:
+    directorio = directorio or backup_dir()
+    if not directorio.exists():
+        return []
+    return [
+        {"archivo": p.name, "bytes": p.stat().st_size, "sha256": _checksum_guardado(p),
+         "incluye_archivo": archivo_de_respaldo(p).exists()}
+        for p in sorted(directorio.glob("*.db"), reverse=True)
+        if not p.stem.endswith("-archivo")
+    ]
+
+def _verificar_respaldo(origen: Path) -> str:
+    checksum = sha256_archivo(origen)
+    esperado = _checksum_guardado(origen)
+    if esperado is None:
+        raise ValueError(f"Falta {origen.name}.sha256 para verificar el respaldo")
+    if esperado != checksum:
+        raise ValueError(f"Checksum inválido en {origen.name}: {checksum} (esperado {esperado})")
+    src = sqlite3.connect(f"file:{origen}?mode=ro", uri=True)
+    try:
+        chequeo = src.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        src.close()
+    if chequeo != "ok":
+        raise ValueError(f"{origen.name} no pasó quick_check: {chequeo}")
+    return checksum
+
+def _copiar_sobre(origen: Path, destino: sqlite3.Connection) -> None:
+    src = sqlite3.connect(f"file:{origen}?mode=ro", uri=True)
+    try:
+        src.backup(destino)
+    finally:
+        src.close()
+
+def restaurar(origen: Path, destino: sqlite3.Connection, verificar: bool = True) -> Dict[str, Any]:
+    """
+    Copia `origen` y su respaldo de `archivo` sobre la base de `destino` (una conexión
+    abierta con `archivo` adjunta, sin transacción), como par: se verifican los dos antes
+    de tocar nada. Mientras dura, los demás escritores esperan y los lectores siguen con su
+    foto. Un respaldo sin archivo (anterior a que existiera) solo se restaura si la base
+    de archivo actual está vacía: si no, quedarían ids archivados que la principal no conoce.
+    Con `verificar`, exige que los checksums coincidan con los .sha256 y que pasen quick_check.
+    """
+    if not origen.exists():
+        raise FileNotFoundError(f"No existe el respaldo {origen}")
+    origen_archivo = archivo_de_respaldo(origen)
+    con_archivo = origen_archivo.exists()
+    if not con_archivo and archivo_listo(destino) and destino.execute("SELECT 1 FROM archivo.internos LIMIT 1").fetchone():
+        raise ValueError(f"{origen.name} no incluye la base de archivo y la actual tiene internos archivados")
+    if verificar:
+        checksum = _verificar_respaldo(origen)
+        checksum_archivo = _verificar_respaldo(origen_archivo) if con_archivo else None
+    else:
+        checksum = sha256_archivo(origen)
+        checksum_archivo = sha256_archivo(origen_archivo) if con_archivo else None
+    t0 = time.perf_counter()
+    ruta_archivo = next(r[2] for r in destino.execute("PRAGMA database_list") if r[1] == "archivo")
+    _copiar_sobre(origen, destino)
+    if con_archivo:
+        dst_archivo = sqlite3.connect(ruta_archivo)
+        try:
+            _copiar_sobre(origen_archivo, dst_archivo)
+        finally:
+            dst_archivo.close()
+    return {"origen": str(origen), "sha256": checksum, "archivo_sha256": checksum_archivo,
+            "duracion_s": round(time.perf_counter() - t0, 3)}
 
 
 # --- Helpers de introspección de BD ---
@@ -71,38 +1505,90 @@ SYSTEM_TABLE_PREFIXES = ("sqlite_",)  # Excluimos tablas internas de SQLite
 def _is_system_table(name: str) -> bool:
     return any(name.startswith(p) for p in SYSTEM_TABLE_PREFIXES)
 
-def list_tables(db: sqlite3.Connection, include_system: bool = False):
-    """
-    Devuelve metadatos de tablas: nombre, columnas (name,type,notnull,pk,default) y row_count.
-    Por defecto excluye tablas internas sqlite_* (pero incluye nuestras como _healthcheck).
-    """
+CountMode = Literal["exact", "estimated", "none"]
+
+# Metadatos de columnas por archivo de BD; se invalidan cuando cambia PRAGMA schema_version
+_meta_cache: Dict[str, tuple] = {}
+_meta_lock = threading.Lock()
+
+def _metadatos_tablas(db: sqlite3.Connection) -> List[tuple]:
+    """[(tabla, columnas)] desde caché mientras el esquema no cambie."""
+    archivo = db.execute("PRAGMA database_list").fetchone()[2]
+    version = db.execute("PRAGMA schema_version").fetchone()[0]
+    with _meta_lock:
+        hit = _meta_cache.get(archivo)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+
     rows = db.execute(
         "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
     ).fetchall()
-    table_names = [r["name"] for r in rows]
-
-    result = []
-    for t in table_names:
-        if not include_system and _is_system_table(t):
-            continue
-
+    tablas = []
+    for r in rows:
+        t = r["name"]
         cols = db.execute(f"PRAGMA table_info('{t}')").fetchall()
-        columns = [{
+        tablas.append((t, [{
             "name": c["name"],
             "type": c["type"],
             "notnull": int(c["notnull"]),
             "pk": int(c["pk"]),
             "default": c["dflt_value"],
-        } for c in cols]
+        } for c in cols]))
+    with _meta_lock:
+        _meta_cache[archivo] = (version, tablas)
+    return tablas
 
-        try:
-            count = db.execute(f"SELECT COUNT(*) AS n FROM '{t}'").fetchone()["n"]
-        except sqlite3.OperationalError:
-            count = None
+def _conteos_estimados(db: sqlite3.Connection) -> Dict[str, tuple]:
+    """
+    Conteos sin recorrer tablas: contadores mantenidos por triggers (exactos) y,
+    para el resto, la estimación de sqlite_stat1 (requiere ANALYZE).
+    Devuelve {tabla: (conteo, fuente)}.
+    """
+    conteos: Dict[str, tuple] = {}
+    try:
+        for tbl, stat in db.execute("SELECT tbl, stat FROM sqlite_stat1"):
+            n = int(str(stat).split()[0])
+            if n > conteos.get(tbl, (-1,))[0]:
+                conteos[tbl] = (n, "sqlite_stat1")
+    except (sqlite3.OperationalError, ValueError):
+        pass
+    try:
+        for clave, valor in db.execute(
+            "SELECT clave, valor FROM contadores WHERE clave IN ('internos', 'celdas', 'agentes')"
+        ):
+            conteos[clave] = (valor, "contadores")
+    except sqlite3.OperationalError:
+        pass
+    return conteos
+
+def list_tables(db: sqlite3.Connection, include_system: bool = False, count_mode: CountMode = "exact"):
+    """
+    Devuelve metadatos de tablas: nombre, columnas (name,type,notnull,pk,default) y row_count.
+    Por defecto excluye tablas internas sqlite_* (pero incluye nuestras como _healthcheck).
+    count_mode: 'exact' (COUNT(*) por tabla), 'estimated' (contadores / sqlite_stat1)
+    o 'none' (row_count = None).
+    """
+    estimados = _conteos_estimados(db) if count_mode == "estimated" else {}
+
+    result = []
+    for t, columns in _metadatos_tablas(db):
+        if not include_system and _is_system_table(t):
+            continue
+
+        count, fuente = None, None
+        if count_mode == "exact":
+            try:
+                count = db.execute(f"SELECT COUNT(*) AS n FROM '{t}'").fetchone()["n"]
+                fuente = "exact"
+            except sqlite3.OperationalError:
+                count = None
+        elif count_mode == "estimated":
+            count, fuente = estimados.get(t, (None, None))
 
         result.append({
             "table": t,
             "row_count": count,
+            "row_count_source": fuente,
             "columns": columns,
         })
 
@@ -110,3 +1596,82 @@ def list_tables(db: sqlite3.Connection, include_system: bool = False):
 
 def row_to_dict(row: sqlite3.Row) -> dict:
     return {k: row[k] for k in row.keys()}
+
+
+# --- CLI de mantenimiento: python db.py <comando> ---
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base del Servicio Penitenciario")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("reconciliar", help="Reconstruye los contadores de ocupación e informa desvíos")
+    p_snap = sub.add_parser("snapshot", help="Guarda la foto diaria de ocupación (para cron)")
+    p_snap.add_argument("--fecha", type=date.fromisoformat, help="YYYY-MM-DD (por defecto, hoy)")
+    p_bak = sub.add_parser("backup", help="Respaldo en caliente con la backup API (no frena a la API)")
+    p_bak.add_argument("--destino", type=Path, help="Archivo de salida (por defecto, en PENITENCIARIO_BACKUP_DIR)")
+    p_bak.add_argument("--paginas", type=int, default=BACKUP_PAGINAS, help="Páginas por paso")
+    p_bak.add_argument("--pausa", type=float, default=BACKUP_PAUSA, help="Segundos entre pasos")
+    p_mig = sub.add_parser("migrar", help="Aplica las migraciones pendientes (las corre también el arranque de la API)")
+    p_mig.add_argument("--hasta", type=int, help="Detenerse en esta versión")
+    p_arc = sub.add_parser("archivar", help="Mueve al archivo los internos egresados antiguos, por lotes")
+    p_arc.add_argument("--antiguedad-dias", type=int, default=ARCHIVO_ANTIGUEDAD_DIAS,
+                       help="Archivar ingresos anteriores a hoy menos estos días")
+    p_arc.add_argument("--lote", type=int, default=ARCHIVO_LOTE, help="Filas por transacción")
+    p_res = sub.add_parser("restaurar", help="Restaura un respaldo sobre la base (detener la API antes)")
+    p_res.add_argument("archivo", type=Path)
+    p_res.add_argument("--sin-verificar", action="store_true", help="No exigir .sha256 ni quick_check")
+    args = parser.parse_args(argv)
+
+    if args.comando == "backup":
+        def _progreso(hechas: int, total: int) -> None:
+            print(f"\r{hechas}/{total} páginas", end="", file=sys.stderr, flush=True)
+        resultado = respaldar(args.destino, paginas=args.paginas, pausa=args.pausa, progreso=_progreso)
+        print(file=sys.stderr)
+        print(json.dumps(resultado, ensure_ascii=False))
+        return 0
+
+    conn = connect()
+    try:
+        if args.comando == "migrar":
+            with lock_inicio(PoolConfig.from_env().path):
+                aplicadas = migrar(conn, args.hasta)
+            print(json.dumps({"version": version_esquema(conn), "aplicadas": aplicadas}, ensure_ascii=False, indent=2))
+        if args.comando == "reconciliar":
+            init_db(conn)
+            desvios = reconciliar_contadores(conn, commit=False)
+            marcar_cambio(conn, "contadores")
+            conn.commit()
+            print(json.dumps({"desvios": desvios, "total": len(desvios)}, ensure_ascii=False, indent=2))
+            return 1 if desvios else 0
+        if args.comando == "snapshot":
+            init_db(conn)
+            begin_immediate(conn)
+            resultado = tomar_snapshot(conn, args.fecha)
+            conn.commit()
+            print(json.dumps(resultado, ensure_ascii=False))
+        if args.comando == "archivar":
+            init_db(conn)
+            corte, movidos = corte_archivo(args.antiguedad_dias), 0
+            while True:
+                begin_immediate(conn)
+                n = archivar_lote(conn, corte, args.lote)
+                conn.commit()
+                movidos += n
+                if n < args.lote:
+                    break
+            print(json.dumps({"corte": corte.isoformat(), "movidos": movidos}, ensure_ascii=False))
+        if args.comando == "restaurar":
+            try:
+                resultado = restaurar(args.archivo, conn, verificar=not args.sin_verificar)
+            except (ValueError, FileNotFoundError) as e:
+                print(str(e), file=sys.stderr)
+                return 1
+            print(json.dumps(resultado, ensure_ascii=False))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,254 @@
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Métricas en formato de texto de Prometheus, sin dependencias externas.
+# Cada observación es un bisect + una suma bajo un lock: apto para dejar activo en producción.
+
+Labels = Tuple[str, ...]
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt_num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), n: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                out.append(f"{self.name}{_fmt_labels(self.labels, lv)} {_fmt_num(v)}")
+        return out
+
+
+class Gauge(Counter):
+    def dec(self, labels: Labels = (), n: float = 1) -> None:
+        self.inc(labels, -n)
+
+    def set(self, labels: Labels, v: float) -> None:
+        with self._lock:
+            self._values[labels] = v
+
+    def render(self) -> List[str]:
+        out = super().render()
+        out[1] = f"# TYPE {self.name} gauge"
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [conteo por bucket (+Inf al final), suma, total]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for lv, (counts, total, n) in series:
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le_s = "+Inf" if le == float("inf") else repr(le)
+                extra = 'le="%s"' % le_s
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, extra)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, lv)} {total!r}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, lv)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[object] = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Callable[[], Iterable[str]]) -> None:
+        """Funciones que generan líneas al momento del scrape (pool, caché, ...)."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines += m.render()
+        for fn in self._collectors:
+            lines += list(fn())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+http_latencia = registry.register(Histogram(
+    "http_request_duration_seconds", "Latencia de requests HTTP por ruta", ("method", "route"), HTTP_BUCKETS))
+http_requests = registry.register(Counter(
+    "http_requests_total", "Requests HTTP por ruta y código de estado", ("method", "route", "status")))
+http_en_curso = registry.register(Gauge(
+    "http_requests_in_flight", "Requests HTTP en curso"))
+sql_duracion = registry.register(Histogram(
+    "sql_statement_duration_seconds", "Duración de execute() por sentencia normalizada", ("statement",), SQL_BUCKETS))
+sql_filas = registry.register(Counter(
+    "sql_rows_total", "Filas devueltas (SELECT) o afectadas (DML) por sentencia normalizada", ("statement",)))
+
+
+# --- Middleware ASGI (puro, sin BaseHTTPMiddleware: no interfiere con streaming) ---
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_en_curso.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_en_curso.dec()
+            # Plantilla de la ruta (/internos/{interno_id}), no el path real: cardinalidad acotada
+            route = getattr(scope.get("route"), "path", None) or "sin_ruta"
+            method = scope.get("method", "")
+            http_latencia.observe((method, route), time.perf_counter() - t0)
+            http_requests.inc((method, route, str(status[0])))
+
+
+# --- Instrumentación de SQL ---
+_WS_RE = re.compile(r"\s+")
+_STR_RE = re.compile(r"'(?:[^']|'')*'")
+_NUM_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LISTA_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> str:
+    """Normaliza una sentencia: sin literales, listas IN colapsadas, espacios simples."""
+    s = _WS_RE.sub(" ", sql).strip()
+    s = _STR_RE.sub("?", s)
+    s = _NUM_RE.sub("?", s)
+    s = _LISTA_RE.sub("(?...)", s)
+    return s[:160]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Mide execute() y cuenta las filas leídas (fetch* / iteración) o afectadas (DML)."""
+
+    _fp = ""
+    _iteradas = 0       # filas leídas iterando, aún no sumadas al contador
+    ITERADAS_LOTE = 1024
+
+    def _volcar(self) -> None:
+        # Iterando se cuenta en una variable del cursor; el contador (con lock) se toca por
+        # lote, al agotar el cursor, al ejecutar otra sentencia o al cerrarlo
+        if self._iteradas:
+            sql_filas.inc((self._fp,), self._iteradas)
+            self._iteradas = 0
+
+    def execute(self, sql, parameters=()):
+        self._volcar()
+        self._fp = fp = fingerprint(sql)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            sql_duracion.observe((fp,), time.perf_counter() - t0)
+            if self.rowcount > 0:
+                sql_filas.inc((fp,), self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._volcar()
+        self._fp = fp = fingerprint(sql)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            sql_duracion.observe((fp,), time.perf_counter() - t0)
+            if self.rowcount > 0:
+                sql_filas.inc((fp,), self.rowcount)
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._volcar()
+            raise
+        self._iteradas += 1
+        if self._iteradas >= self.ITERADAS_LOTE:
+            self._volcar()
+        return row
+
+    def close(self):
+        self._volcar()
+        super().close()
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            sql_filas.inc((self._fp,))
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if rows:
+            sql_filas.inc((self._fp,), len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if rows:
+            sql_filas.inc((self._fp,), len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,105 @@
+import json
+import os
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Type
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import orjson
+except ImportError:   # opcional: sin orjson se usa json de la stdlib con la misma salida
+    orjson = None
+
+# Camino rápido para filas que salen de la BD: arma el JSON directo desde la fila, sin
+# pasar por dict -> validación del response_model -> serialización. Las filas ya fueron
+# validadas al escribirse (modelos *In, triggers de fecha), así que revalidarlas solo
+# cuesta CPU. Con PENITENCIARIO_FAST_JSON=0 se vuelve al camino de FastAPI.
+HABILITADO = os.environ.get("PENITENCIARIO_FAST_JSON", "1") not in ("0", "false", "no")
+
+
+def dumps(obj: Any) -> bytes:
+    """JSON compacto en UTF-8, igual al que produce pydantic (`dump_json`)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class CodificadorFilas:
+    """
+    Encoder compilado por modelo: orden de claves del modelo y conversión a bool de los
+    campos booleanos (SQLite los devuelve como 0/1). Fechas y textos se copian tal cual.
+    """
+
+    def __init__(self, modelo: Type[BaseModel]):
+        self.modelo = modelo
+        self.campos: Tuple[str, ...] = tuple(modelo.model_fields)
+        self.booleanos = tuple(n for n, f in modelo.model_fields.items() if f.annotation is bool)
+        self._getters: Dict[Tuple[str, ...], Callable] = {}
+
+    def _getter(self, fila) -> Callable:
+        # Un itemgetter por forma de SELECT: evita buscar cada columna por nombre en cada fila
+        cols = tuple(fila.keys())
+        g = self._getters.get(cols)
+        if g is None:
+            idx = [cols.index(c) for c in self.campos]
+            g = self._getters[cols] = itemgetter(*idx) if len(idx) > 1 else (lambda f, i=idx[0]: (f[i],))
+        return g
+
+    def fila(self, fila) -> Dict[str, Any]:
+        d = dict(zip(self.campos, self._getter(fila)(fila)))
+        for c in self.booleanos:
+            if d[c] is not None:
+                d[c] = bool(d[c])
+        return d
+
+    def lista(self, filas: Iterable) -> bytes:
+        filas = list(filas)
+        if not filas:
+            return b"[]"
+        g, campos = self._getter(filas[0]), self.campos
+        dicts = [dict(zip(campos, g(f))) for f in filas]
+        for c in self.booleanos:
+            for d in dicts:
+                if d[c] is not None:
+                    d[c] = bool(d[c])
+        return dumps(dicts)
+
+    def uno(self, fila) -> bytes:
+        return dumps(self.fila(fila))
+
+
+@lru_cache(maxsize=None)
+def codificador(modelo: Type[BaseModel]) -> CodificadorFilas:
+    return CodificadorFilas(modelo)
+
+@lru_cache(maxsize=None)
+def _adaptador(modelo: Type[BaseModel], lista: bool) -> TypeAdapter:
+    return TypeAdapter(list[modelo] if lista else modelo)
+
+
+def json_validado(modelo: Type[BaseModel], filas: Any) -> bytes:
+    """Camino de FastAPI (dict -> validación -> dump_json). Referencia para comparar bytes."""
+    if isinstance(filas, list):
+        ta = _adaptador(modelo, True)
+        return ta.dump_json(ta.validate_python([dict(f) for f in filas]))
+    ta = _adaptador(modelo, False)
+    return ta.dump_json(ta.validate_python(dict(filas)))
+
+
+def respuesta_json(modelo: Type[BaseModel], filas: Any, response: Optional[Response] = None) -> Response:
+    """
+    Respuesta JSON para una fila o una lista de filas de la BD con la forma de `modelo`.
+    Copia los headers que el handler o sus dependencias dejaron en `response`
+    (X-Next-Cursor, ETag): al devolver un Response propio FastAPI no los agrega.
+    """
+    if HABILITADO:
+        c = codificador(modelo)
+        body = c.lista(filas) if isinstance(filas, list) else c.uno(filas)
+    else:
+        body = json_validado(modelo, filas)
+    r = Response(content=body, media_type="application/json")
+    if response is not None:
+        r.raw_headers.extend(response.raw_headers)
+    return r
@@ -0,0 +1,28 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("PENITENCIARIO_SNAPSHOT_INTERVALO", "0")   # sin fotos periódicas en segundo plano
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch) -> Path:
+    """Base (y archivo) en un directorio temporal; el pool la toma del entorno al abrirse."""
+    path = tmp_path / "penitenciario.db"
+    monkeypatch.setenv("PENITENCIARIO_DB_PATH", str(path))
+    monkeypatch.setenv("PENITENCIARIO_BACKUP_DIR", str(tmp_path / "backups"))
+    return path
+
+
+@pytest.fixture
+def client(db_path):
+    from fastapi.testclient import TestClient
+    import app
+    from cache import resultados
+
+    resultados.clear()      # caché global del módulo: no arrastrar resultados de otro test
+    with TestClient(app.app) as c:
+        yield c
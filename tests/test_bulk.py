@@ -0,0 +1,130 @@
+import json
+
+from db import PoolConfig, connect, reconciliar_contadores
+
+CSV = {"content-type": "text/csv"}
+NDJSON = {"content-type": "application/x-ndjson"}
+
+
+def _interno(n, **extra):
+    return {"dni": f"30{n:06d}", "nombre": f"N{n}", "apellido": f"A{n}", "fecha_ingreso": "2025-01-01", **extra}
+
+
+def _por_dni(client):
+    return {i["dni"]: i["id"] for i in client.get("/internos").json()}
+
+
+def _desvios(db_path):
+    conn = connect(PoolConfig(path=db_path))
+    try:
+        return reconciliar_contadores(conn, commit=False)
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_json_devuelve_ids_en_el_orden_del_lote(client, db_path, monkeypatch):
+    monkeypatch.setattr("app.BULK_CHUNK", 2)            # varios INSERT multi-fila
+    celda = client.post("/celdas", json={"pabellon": "A", "numero": "1", "capacidad": 4}).json()["id"]
+    lote = [_interno(n, celda_id=celda if n % 2 else None) for n in range(1, 6)]
+    r = client.post("/internos/bulk", json=lote)
+    assert r.status_code == 200, r.text
+    cuerpo = r.json()
+    assert cuerpo["recibidas"] == 5 and cuerpo["errores"] == []
+    por_dni = _por_dni(client)
+    assert cuerpo["insertados"] == [por_dni[i["dni"]] for i in lote]
+    assert client.get("/pabellones/A/ocupacion").json()["ocupados"] == 3
+    assert _desvios(db_path) == []
+
+
+def test_json_que_no_es_arreglo(client):
+    assert client.post("/internos/bulk", json={"nombre": "x"}).status_code == 400
+    r = client.post("/internos/bulk", content=b"[{", headers={"content-type": "application/json"})
+    assert r.status_code == 400
+
+
+def test_dni_repetido_en_un_chunk(client, db_path, monkeypatch):
+    monkeypatch.setattr("app.BULK_CHUNK", 3)
+    lote = [_interno(1), _interno(2), _interno(1), _interno(3), _interno(4)]
+
+    # Atómico: un error deshace todo, también los chunks que no tenían problemas
+    r = client.post("/internos/bulk", params={"atomico": True}, json=lote)
+    assert r.status_code == 422
+    assert r.json()["insertados"] == []
+    assert [e["fila"] for e in r.json()["errores"]] == [3]
+    assert _por_dni(client) == {}
+
+    # No atómico: el chunk se reintenta fila por fila; solo queda afuera el duplicado
+    r = client.post("/internos/bulk", json=lote)
+    assert r.status_code == 200, r.text
+    cuerpo = r.json()
+    assert [(e["fila"], "UNIQUE" in e["error"]) for e in cuerpo["errores"]] == [(3, True)]
+    por_dni = _por_dni(client)
+    assert len(por_dni) == 4
+    assert cuerpo["insertados"] == [por_dni[lote[i]["dni"]] for i in (0, 1, 3, 4)]
+    assert _desvios(db_path) == []
+
+    # Contra filas ya cargadas: todo el chunk choca y nada se duplica
+    r = client.post("/internos/bulk", json=[_interno(2), _interno(5)])
+    assert [e["fila"] for e in r.json()["errores"]] == [1]
+    assert r.json()["insertados"] == [_por_dni(client)[_interno(5)["dni"]]]
+
+
+def test_ndjson_con_linea_rota_a_mitad_de_camino(client, db_path):
+    lineas = [json.dumps(_interno(1)), json.dumps(_interno(2)), '{"dni": "30000003", "nombre": ',
+              "", json.dumps(_interno(4)), json.dumps({"nombre": "Sin", "apellido": "Fecha"})]
+    cuerpo = ("\n".join(lineas) + "\n").encode()
+
+    r = client.post("/internos/bulk", params={"atomico": True}, content=cuerpo, headers=NDJSON)
+    assert r.status_code == 422
+    assert [e["fila"] for e in r.json()["errores"]] == [3, 5]
+    assert _por_dni(client) == {}
+
+    r = client.post("/internos/bulk", content=cuerpo, headers=NDJSON)
+    assert r.status_code == 200, r.text
+    res = r.json()
+    assert res["recibidas"] == 5                         # las líneas vacías no cuentan
+    assert [e["fila"] for e in res["errores"]] == [3, 5]
+    assert res["errores"][0]["error"].startswith("JSON inválido")
+    assert "fecha_ingreso" in res["errores"][1]["error"]
+    por_dni = _por_dni(client)
+    assert res["insertados"] == [por_dni[f"30{n:06d}"] for n in (1, 2, 4)]
+    assert _desvios(db_path) == []
+
+
+def test_csv_valido_con_comillas_y_campos_vacios(client):
+    cuerpo = ("dni,nombre,apellido,fecha_ingreso,causa\r\n"
+              '30000001,Juan,Pérez,2025-01-01,"robo, con\nsalto"\r\n'
+              ",Ana,Gómez,2025-01-02,\r\n")
+    r = client.post("/internos/bulk", content=cuerpo.encode(), headers=CSV)
+    assert r.status_code == 200, r.text
+    assert len(r.json()["insertados"]) == 2 and r.json()["errores"] == []
+    internos = {i["nombre"]: i for i in client.get("/internos").json()}
+    assert internos["Juan"]["causa"] == "robo, con\nsalto"
+    assert internos["Ana"]["dni"] is None and internos["Ana"]["causa"] is None
+
+
+def test_csv_con_encabezado_invalido(client):
+    casos = {
+        "documento,nombre,apellido,fecha_ingreso": "columnas desconocidas: documento",
+        "dni,nombre,fecha_ingreso": "faltan columnas obligatorias: apellido",
+        "dni,nombre,apellido,fecha_ingreso,dni": "columnas repetidas: dni",
+    }
+    for encabezado, motivo in casos.items():
+        cuerpo = f"{encabezado}\n30000001,Juan,Pérez,2025-01-01\n".encode()
+        r = client.post("/internos/bulk", content=cuerpo, headers=CSV)
+        assert r.status_code == 400, encabezado
+        assert motivo in r.json()["detail"]
+    assert client.get("/internos").json() == []
+
+
+def test_csv_con_filas_de_otro_largo(client):
+    cuerpo = ("dni,nombre,apellido,fecha_ingreso\n"
+              "30000001,Juan,Pérez,2025-01-01\n"
+              "30000002,Ana,Gómez\n"
+              "30000003,Luis,Sosa,2025-01-01,sobra\n"
+              "30000004,Marta,Ruiz,2025-01-01\n").encode()
+    r = client.post("/internos/bulk", content=cuerpo, headers=CSV)
+    assert r.status_code == 200, r.text
+    assert [e["fila"] for e in r.json()["errores"]] == [2, 3]
+    assert sorted(_por_dni(client)) == ["30000001", "30000004"]
@@ -0,0 +1,124 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db as db_mod
+from db import ConnectionPool, PoolConfig, PoolTimeout
+
+
+@pytest.fixture
+def pool(tmp_path):
+    p = ConnectionPool(PoolConfig(path=tmp_path / "escritor.db", readers=1, timeout=5.0,
+                                  busy_timeout_ms=50, checkpoint_intervalo=0, sql_metrics=False))
+    with p.connection(write=True) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER UNIQUE)")
+        conn.commit()
+    yield p
+    p.close()
+
+
+def _valores(pool):
+    with pool.connection(write=False) as conn:
+        return [r[0] for r in conn.execute("SELECT x FROM t ORDER BY x")]
+
+
+def _insertar(x):
+    return lambda conn: conn.execute("INSERT INTO t (x) VALUES (?)", (x,)).lastrowid
+
+
+def _en_un_lote(pool, ops):
+    """Encola `ops` mientras el escritor está ocupado, así se ejecutan en un solo lote."""
+    escritor = pool._writer
+    adentro, soltar = threading.Event(), threading.Event()
+
+    def tapon(conn):
+        adentro.set()
+        soltar.wait(5)
+
+    primero = escritor.submit(tapon)
+    assert adentro.wait(5)
+    futs = [escritor.submit(op) for op in ops]
+    lotes = escritor.batches
+    soltar.set()
+    primero.result(5)
+    for f in futs:
+        f.exception(5)              # espera a que terminen, sin relanzar
+    assert escritor.batches == lotes + 2, "las operaciones no quedaron en un único lote"
+    return futs
+
+
+def test_op_fallida_deshace_solo_su_savepoint(pool):
+    def a_medias(conn):
+        conn.execute("INSERT INTO t (x) VALUES (100)")      # se deshace con su SAVEPOINT
+        conn.execute("INSERT INTO t (x) VALUES (1)")        # choca con la primera op
+        return "no llega"
+
+    ok1, mala, ok2 = _en_un_lote(pool, [_insertar(1), a_medias, _insertar(2)])
+    assert ok1.result() == 1
+    assert isinstance(mala.exception(), sqlite3.IntegrityError)
+    assert ok2.result() == 2
+    assert _valores(pool) == [1, 2]
+
+
+def test_cada_error_llega_a_quien_lo_encolo(pool):
+    class ErrorA(Exception):
+        pass
+
+    class ErrorB(Exception):
+        pass
+
+    def falla(exc):
+        def op(conn):
+            conn.execute("INSERT INTO t (x) VALUES (50)")
+            raise exc
+        return op
+
+    fa, ok, fb = _en_un_lote(pool, [falla(ErrorA("a")), _insertar(7), falla(ErrorB("b"))])
+    assert isinstance(fa.exception(), ErrorA) and str(fa.exception()) == "a"
+    assert isinstance(fb.exception(), ErrorB) and str(fb.exception()) == "b"
+    assert ok.result() == 1
+    assert _valores(pool) == [7]
+
+
+def test_escribir_devuelve_resultado_y_relanza_la_excepcion(pool):
+    assert pool.escribir(lambda conn: conn.execute("INSERT INTO t (x) VALUES (3)").rowcount) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        pool.escribir(_insertar(3))
+    assert pool.escribir(_insertar(4)) == 2
+    assert _valores(pool) == [3, 4]
+
+
+def test_sin_lock_de_escritura_falla_todo_el_lote(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(db_mod, "REINTENTOS_BUSY", 0)
+    otra = sqlite3.connect(tmp_path / "escritor.db", timeout=0.05)
+    otra.execute("BEGIN IMMEDIATE")                         # otro proceso con el lock
+    try:
+        futs = [pool._writer.submit(_insertar(x)) for x in (10, 11)]
+        for f in futs:
+            exc = f.exception(5)
+            assert isinstance(exc, sqlite3.OperationalError) and "locked" in str(exc)
+    finally:
+        otra.rollback()
+        otra.close()
+    assert _valores(pool) == []
+    assert pool.escribir(_insertar(12)) == 1               # el escritor sigue sano
+
+
+def test_prestar_excluye_al_hilo_y_descarta_lo_no_confirmado(pool):
+    with pool.connection(write=True) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT INTO t (x) VALUES (99)")       # sin commit: se deshace al devolverla
+        fut = pool._writer.submit(_insertar(5))
+        with pytest.raises(TimeoutError):
+            fut.result(0.2)                                 # el escritor espera la devolución
+    assert fut.result(5) == 1
+    assert _valores(pool) == [5]
+
+
+def test_prestar_con_timeout(pool):
+    with pool.connection(write=True):
+        escritor = pool._writer
+        with pytest.raises(PoolTimeout):
+            with escritor.prestar(0.1):
+                pass
@@ -0,0 +1,77 @@
+import sqlite3
+
+
+def _celda(client, numero="1", capacidad=2):
+    r = client.post("/celdas", json={"pabellon": "A", "numero": numero, "capacidad": capacidad})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_304_mientras_no_cambia(client):
+    _celda(client)
+    etag = client.get("/celdas").headers["etag"]
+    assert client.get("/celdas", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_escritura_propia_cambia_etag(client):
+    _celda(client)
+    etag = client.get("/celdas").headers["etag"]
+    _celda(client, numero="2")
+    r = client.get("/celdas", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert len(r.json()) == 2
+
+
+def test_escritura_de_otro_proceso_cambia_etag(client, db_path):
+    # Otra conexión sobre el mismo archivo: como otro worker o el CLI, no toca cache.versiones
+    _celda(client)
+    etag = client.get("/celdas").headers["etag"]
+    otra = sqlite3.connect(db_path)
+    otra.execute("INSERT INTO celdas (pabellon, numero, capacidad) VALUES ('B', '1', 3)")
+    otra.commit()
+    otra.close()
+    r = client.get("/celdas", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert {c["pabellon"] for c in r.json()} == {"A", "B"}
+    assert r.headers["etag"] != etag
+
+
+def test_snapshot_de_otro_proceso_cambia_etag_historico(client, db_path):
+    from db import PoolConfig, begin_immediate, connect, tomar_snapshot
+
+    _celda(client)
+    etag = client.get("/stats/historico").headers["etag"]
+    otra = connect(PoolConfig(path=db_path, sql_metrics=False))
+    begin_immediate(otra)
+    tomar_snapshot(otra)
+    otra.commit()
+    otra.close()
+    assert client.get("/stats/historico", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_ocupacion_ve_altas_de_otro_proceso(client, db_path):
+    celda = _celda(client)
+    r = client.get("/pabellones/A/ocupacion")
+    etag = r.headers["etag"]
+    assert r.json()["celdas"][0]["ocupados"] == 0
+    otra = sqlite3.connect(db_path)
+    otra.execute("INSERT INTO internos (nombre, apellido, fecha_ingreso, estado, celda_id)"
+                 " VALUES ('Ana', 'Paz', '2024-01-01', 'Activo', ?)", (celda["id"],))
+    otra.commit()
+    otra.close()
+    # Sin If-None-Match: la caché de resultados tampoco puede servir la ocupación vieja
+    assert client.get("/pabellones/A/ocupacion").json()["celdas"][0]["ocupados"] == 1
+    assert client.get("/pabellones/A/ocupacion", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_stats_y_tablas_sin_cache_vieja_tras_otro_proceso(client, db_path):
+    _celda(client)
+    assert client.get("/stats").json()["totales"]["celdas"] == 1
+    antes = {t["table"]: t["row_count"] for t in client.get("/db/tables").json()["tables"]}
+    otra = sqlite3.connect(db_path)
+    otra.execute("INSERT INTO celdas (pabellon, numero, capacidad) VALUES ('B', '1', 3)")
+    otra.commit()
+    otra.close()
+    assert client.get("/stats").json()["totales"]["celdas"] == 2
+    despues = {t["table"]: t["row_count"] for t in client.get("/db/tables").json()["tables"]}
+    assert (antes["celdas"], despues["celdas"]) == (1, 2)
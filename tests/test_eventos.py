@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+
+def _ocupacion(lote):
+    """Filas del `event: ocupacion` de un lote (None si el lote no trae ocupación)."""
+    if lote.ocupacion is None:
+        return None
+    data = lote.ocupacion.decode().split("data: ", 1)[1]
+    return json.loads(data)
+
+
+def _ciclos(difusor, n):
+    async def correr():
+        for _ in range(n):
+            await difusor.ciclo()
+    asyncio.run(correr())
+
+
+def test_ocupacion_solo_con_el_lote_que_llega_al_ultimo_evento(client, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "EVENTOS_LOTE", 2)
+    difusor = app.Difusor()
+    _ciclos(difusor, 1)                     # posición inicial: base vacía
+    cola = difusor.suscribir()
+
+    celda = client.post("/celdas", json={"pabellon": "A", "numero": "1", "capacidad": 3}).json()
+    for k in range(3):
+        r = client.post("/internos", json={"nombre": "N", "apellido": f"A{k}", "fecha_ingreso": "2024-01-01",
+                                           "estado": "Activo", "celda_id": celda["id"]})
+        assert r.status_code == 200, r.text
+
+    _ciclos(difusor, 2)                     # 4 eventos en lotes de 2
+    primero, segundo = cola.get_nowait(), cola.get_nowait()
+    assert [e[0] for e in primero.eventos] == [1, 2]
+    assert _ocupacion(primero) is None      # la ocupación de ahora incluiría los eventos 3 y 4
+    assert [e[0] for e in segundo.eventos] == [3, 4]
+    assert _ocupacion(segundo) == [{"pabellon": "A", "capacidad": 3, "ocupados": 3, "delta": 3}]
+    assert difusor.ultimo == 4
+
+
+def test_ocupacion_pendiente_aunque_el_ultimo_lote_sea_de_agentes(client, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "EVENTOS_LOTE", 2)
+    difusor = app.Difusor()
+    _ciclos(difusor, 1)
+    cola = difusor.suscribir()
+
+    client.post("/celdas", json={"pabellon": "B", "numero": "1", "capacidad": 2})
+    for k in range(3):
+        r = client.post("/agentes", json={"legajo": f"L{k}", "nombre": "N", "apellido": "A", "rango": "Oficial"})
+        assert r.status_code == 200, r.text
+
+    _ciclos(difusor, 2)
+    primero, segundo = cola.get_nowait(), cola.get_nowait()
+    assert _ocupacion(primero) is None
+    assert {e[1] for e in segundo.eventos} == {"agentes"}
+    assert _ocupacion(segundo) == [{"pabellon": "B", "capacidad": 2, "ocupados": 0, "delta": 0}]
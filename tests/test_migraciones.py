@@ -0,0 +1,128 @@
+import sqlite3
+
+import db as db_mod
+from db import ESQUEMA_VERSION, PoolConfig, connect, migrar, reconciliar_contadores
+
+# Esquema de la primera versión publicada (sin user_version, contadores, FTS ni eventos)
+ESQUEMA_BASE = (
+    "CREATE TABLE celdas ("
+    "\n  id INTEGER PRIMARY KEY,"
+    "\n  pabellon TEXT NOT NULL,"
+    "\n  numero   TEXT NOT NULL,"
+    "\n  capacidad INTEGER NOT NULL CHECK (capacidad BETWEEN 1 AND 12),"
+    "\n  UNIQUE (pabellon, numero)"
+    "\n);"
+    "\nCREATE TABLE agentes ("
+    "\n  id INTEGER PRIMARY KEY,"
+    "\n  legajo   TEXT NOT NULL UNIQUE,"
+    "\n  nombre   TEXT NOT NULL,"
+    "\n  apellido TEXT NOT NULL,"
+    "\n  rango    TEXT NOT NULL CHECK (rango IN ('Auxiliar','Oficial','Sargento','Suboficial','Inspector')),"
+    "\n  activo   INTEGER NOT NULL DEFAULT 1"
+    "\n);"
+    "\nCREATE TABLE internos ("
+    "\n  id INTEGER PRIMARY KEY,"
+    "\n  dni TEXT UNIQUE,"
+    "\n  nombre   TEXT NOT NULL,"
+    "\n  apellido TEXT NOT NULL,"
+    "\n  fecha_ingreso TEXT NOT NULL,"
+    "\n  estado   TEXT NOT NULL DEFAULT 'Activo' CHECK (estado IN ('Activo','Trasladado','Liberado')),"
+    "\n  celda_id INTEGER,"
+    "\n  causa TEXT,"
+    "\n  condena_meses INTEGER CHECK (condena_meses >= 0),"
+    "\n  FOREIGN KEY (celda_id) REFERENCES celdas(id) ON UPDATE CASCADE ON DELETE SET NULL"
+    "\n);"
+)
+
+INTERNOS = [
+    (1, "20111111", "Juan", "Pérez", "2025-08-20 10:00:00", "Activo", 1, "robo", 24),
+    (2, "20222222", "Ana", "Gómez", "2025-08-21", "Activo", 1, "estafa", 12),
+    (3, "20333333", "Luis", "Sosa", "2024-01-05", "Activo", 2, None, None),
+    (4, "20444444", "Marta", "Ruiz", "2024-02-10", "Activo", 2, "hurto", 6),       # B-1 sobre capacidad
+    (5, "20555555", "Pedro", "Díaz", "2023-03-01", "Liberado", 2, "robo", 36),     # celda que ya no ocupa
+    (7, None, "Sofía", "Paz", "ayer", "Trasladado", None, None, None),             # fecha ilegible
+]
+
+
+def _base_antigua(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(ESQUEMA_BASE)
+    conn.executemany("INSERT INTO celdas VALUES (?, ?, ?, ?)", [(1, "A", "1", 2), (2, "B", "1", 1)])
+    conn.executemany("INSERT INTO agentes VALUES (?, ?, ?, ?, ?, ?)",
+                     [(1, "L-001", "Carla", "Vera", "Oficial", 1), (2, "L-002", "Raúl", "Pérez", "Inspector", 0)])
+    conn.executemany("INSERT INTO internos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", INTERNOS)
+    conn.commit()
+    conn.close()
+
+
+def _conteos(conn):
+    return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("celdas", "agentes", "internos")}
+
+
+def test_migra_base_antigua_hasta_la_version_actual(tmp_path):
+    path = tmp_path / "antigua.db"
+    _base_antigua(path)
+    conn = connect(PoolConfig(path=path))
+    try:
+        assert db_mod.version_esquema(conn) == 0
+        antes = _conteos(conn)
+
+        aplicadas = migrar(conn)
+        assert [a["version"] for a in aplicadas] == list(range(1, ESQUEMA_VERSION + 1))
+        assert db_mod.version_esquema(conn) == ESQUEMA_VERSION
+        assert _conteos(conn) == antes == {"celdas": 2, "agentes": 2, "internos": 6}
+
+        fechas = next(a["resultado"] for a in aplicadas if a["version"] == 3)
+        assert fechas == {"normalizadas": 1, "invalidas": 1}
+        sobre = next(a["resultado"] for a in aplicadas if a["version"] == 4)["celdas_sobre_capacidad"]
+        assert [(c["celda_id"], c["ocupados"]) for c in sobre] == [(2, 2)]
+
+        # Las filas llegan intactas salvo lo que corrigen las migraciones
+        filas = [tuple(r) for r in conn.execute(
+            "SELECT id, dni, nombre, apellido, fecha_ingreso, estado, celda_id, causa, condena_meses"
+            " FROM internos ORDER BY id")]
+        esperadas = [list(i) for i in INTERNOS]
+        esperadas[0][4] = "2025-08-20"                   # migración 3
+        esperadas[4][6] = None                           # migración 9: un Liberado no ocupa celda
+        assert filas == [tuple(i) for i in esperadas]
+
+        assert reconciliar_contadores(conn) == []
+        pab = {r[0]: tuple(r[1:]) for r in conn.execute("SELECT pabellon, capacidad, ocupados FROM contador_pabellon")}
+        assert pab == {"A": (2, 2), "B": (1, 2)}
+
+        if db_mod.fts_disponible(conn):
+            def buscar(q):
+                return [r[0] for r in conn.execute(
+                    "SELECT rowid FROM internos_fts WHERE internos_fts MATCH ? ORDER BY rowid", (q,))]
+            assert buscar('"pérez"') == [1]
+            assert buscar('"robo"') == [1, 5]
+            assert buscar('"20333333"') == [3]
+            assert [r[0] for r in conn.execute(
+                "SELECT rowid FROM agentes_fts WHERE agentes_fts MATCH ?", ('"vera"',))] == [1]
+
+        # Idempotente: una segunda pasada no aplica nada
+        assert migrar(conn) == []
+        # AUTOINCREMENT: el próximo id no reutiliza huecos ni baja del máximo
+        conn.execute("INSERT INTO internos (nombre, apellido, fecha_ingreso, estado) VALUES ('X', 'Y', '2025-01-01', 'Liberado')")
+        assert conn.execute("SELECT MAX(id) FROM internos").fetchone()[0] == 8
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def test_la_api_arranca_sobre_base_antigua_y_busca(db_path):
+    from fastapi.testclient import TestClient
+    import app
+    from cache import resultados
+
+    _base_antigua(db_path)
+    resultados.clear()
+    with TestClient(app.app) as c:                       # el arranque migra
+        r = c.get("/internos")
+        assert r.status_code == 200
+        assert sorted(i["id"] for i in r.json()) == [1, 2, 3, 4, 5, 7]
+        assert c.post("/stats/reconciliar").json()["desvios"] == []
+        r = c.get("/buscar", params={"q": "pere"})
+        if r.status_code == 501:                         # SQLite sin FTS5
+            return
+        assert sorted((x["tipo"], x["id"]) for x in r.json()) == [("agente", 2), ("interno", 1)]
@@ -0,0 +1,54 @@
+import csv
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def _cargar(client, n=3):
+    for k in range(n):
+        r = client.post("/internos", json={"nombre": "N", "apellido": f"A{k}", "fecha_ingreso": "2024-01-0%d" % (k + 1)})
+        assert r.status_code == 200, r.text
+
+
+def _lectores_libres():
+    from db import get_pool
+    return get_pool()._readers.qsize()
+
+
+def test_csv_completo_y_conexion_devuelta(client):
+    _cargar(client)
+    libres = _lectores_libres()
+    r = client.get("/reportes/internos", params={"desde": "2024-01-01", "hasta": "2024-01-31"})
+    assert r.status_code == 200
+    filas = list(csv.reader(io.StringIO(r.text)))
+    assert len(filas) == 4
+    assert _lectores_libres() == libres
+
+
+def test_pool_agotado_responde_503_antes_del_stream(db_path, monkeypatch):
+    monkeypatch.setenv("PENITENCIARIO_POOL_READERS", "1")
+    monkeypatch.setenv("PENITENCIARIO_POOL_TIMEOUT", "0.2")
+    import app
+    from db import get_pool
+
+    with TestClient(app.app) as client:
+        with get_pool().connection(write=False):        # el único lector, ocupado
+            r = client.get("/reportes/internos", params={"formato": "ndjson"})
+        assert r.status_code == 503
+        assert r.headers["retry-after"] == "1"
+        assert client.get("/reportes/internos", params={"formato": "ndjson"}).status_code == 200
+
+
+@pytest.mark.parametrize("formato", ["csv", "json", "parquet"])
+def test_error_de_sql_responde_500_y_devuelve_la_conexion(db_path, monkeypatch, formato):
+    import app
+
+    if formato == "parquet":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(app, "internos_desde", lambda incluir_archivo: "tabla_inexistente")
+    with TestClient(app.app, raise_server_exceptions=False) as client:
+        libres = _lectores_libres()
+        r = client.get("/reportes/internos", params={"formato": formato})
+        assert r.status_code == 500
+        assert _lectores_libres() == libres
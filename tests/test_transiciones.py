@@ -0,0 +1,93 @@
+from db import PoolConfig, connect, reconciliar_contadores
+
+
+def _desvios(db_path):
+    """Desvíos entre contador_* y los datos, sin reescribir los contadores."""
+    conn = connect(PoolConfig(path=db_path))
+    try:
+        return reconciliar_contadores(conn, commit=False)
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _celda(client, pabellon, numero, capacidad):
+    r = client.post("/celdas", json={"pabellon": pabellon, "numero": numero, "capacidad": capacidad})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def _interno(client, n, celda_id=None, estado="Activo"):
+    r = client.post("/internos", json={"nombre": f"N{n}", "apellido": f"A{n}", "fecha_ingreso": "2025-01-01",
+                                       "dni": f"30{n:06d}", "estado": estado, "celda_id": celda_id})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def _ocupacion(client, pabellon):
+    r = client.get(f"/pabellones/{pabellon}/ocupacion")
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_ids_con_faltantes_actualiza_solo_los_existentes(client, db_path):
+    a1 = _celda(client, "A", "1", 3)
+    i1, i2 = _interno(client, 1, a1), _interno(client, 2, a1)
+    i3 = _interno(client, 3, estado="Liberado")
+
+    r = client.post("/internos/transiciones", json={"ids": [i2, 9999, i1, i2, 12345], "estado": "Trasladado"})
+    assert r.status_code == 200, r.text
+    assert r.json() == {"actualizados": 2, "ids": [i1, i2]}
+
+    estados = {i["id"]: (i["estado"], i["celda_id"]) for i in client.get("/internos").json()}
+    assert estados == {i1: ("Trasladado", None), i2: ("Trasladado", None), i3: ("Liberado", None)}
+    assert _ocupacion(client, "A")["ocupados"] == 0
+    assert _desvios(db_path) == []
+
+    # Solo faltantes, o los que ya están en el destino: nada que hacer
+    r = client.post("/internos/transiciones", json={"ids": [9999, i1], "estado": "Trasladado"})
+    assert r.json() == {"actualizados": 0, "ids": []}
+    assert _desvios(db_path) == []
+
+
+def test_evacuar_pabellon(client, db_path):
+    a1, a2, b1 = _celda(client, "A", "1", 2), _celda(client, "A", "2", 2), _celda(client, "B", "1", 2)
+    en_a = [_interno(client, 1, a1), _interno(client, 2, a1), _interno(client, 3, a2)]
+    en_b = _interno(client, 4, b1)
+    _interno(client, 5, estado="Liberado")
+
+    r = client.post("/internos/transiciones", json={"pabellon": "A", "estado": "Trasladado"})
+    assert r.status_code == 200, r.text
+    assert r.json() == {"actualizados": 3, "ids": en_a}
+
+    assert _ocupacion(client, "A")["ocupados"] == 0
+    assert _ocupacion(client, "B")["ocupados"] == 1
+    assert client.get(f"/internos/{en_b}").json()["celda_id"] == b1
+    assert _desvios(db_path) == []
+
+    r = client.post("/internos/transiciones", json={"pabellon": "Z", "estado": "Trasladado"})
+    assert r.status_code == 404
+    assert _desvios(db_path) == []
+
+
+def test_activar_en_celda_llena_rechaza_todo_el_lote(client, db_path):
+    chica, grande = _celda(client, "A", "1", 2), _celda(client, "B", "1", 6)
+    _interno(client, 1, chica)
+    ids = [_interno(client, n, grande) for n in (2, 3)] + [_interno(client, 4, estado="Liberado")]
+
+    # Tres internos a una celda con una sola cama libre: no se mueve ninguno
+    r = client.post("/internos/transiciones", json={"ids": ids, "estado": "Activo", "celda_destino": chica})
+    assert r.status_code == 409, r.text
+    assert "Celda sin capacidad disponible" in r.json()["detail"]
+
+    assert _ocupacion(client, "A")["ocupados"] == 1
+    assert _ocupacion(client, "B")["ocupados"] == 2
+    assert client.get(f"/internos/{ids[2]}").json()["estado"] == "Liberado"
+    assert _desvios(db_path) == []
+
+    # El que sí entra pasa, y los contadores lo siguen
+    r = client.post("/internos/transiciones", json={"ids": [ids[2]], "estado": "Activo", "celda_destino": chica})
+    assert r.status_code == 200, r.text
+    assert r.json() == {"actualizados": 1, "ids": [ids[2]]}
+    assert _ocupacion(client, "A")["ocupados"] == 2
+    assert _desvios(db_path) == []